@@ -0,0 +1,141 @@
+"""
+Module providing a facade over several TD Ameritrade accounts.
+
+The accounts share a single TDAmeritrade client's transport (connection
+pool), token manager, scheduler, caches and metrics. The account calls are
+fanned out concurrently, so a snapshot of every account costs about one
+round trip instead of one per account. The results are merged and tagged
+with the account number.
+
+Example:
+>>accounts = MultiAccount.from_files("accounts.txt", "oAuth.txt")
+>>positions = accounts.get_positions()
+
+Classes:
+    MultiAccount
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from models import Order, Position, Transaction
+from tdameritrade import TDAmeritrade
+
+
+class MultiAccount:
+    """Runs account calls across several accounts concurrently.
+
+    Class variables
+        client (TDAmeritrade): Client whose session the accounts share.
+        accounts (dict): Client per account number.
+        max_workers (int): Number of concurrent requests.
+    """
+    def __init__(self, client, account_numbers, max_workers=8):
+        """Create a client per account sharing the session of client.
+
+        Arguments:
+            client (TDAmeritrade): Client of any of the accounts.
+            account_numbers (list): Account numbers.
+            max_workers (int) optional: Number of concurrent requests.
+        """
+        self.client = client
+        self.accounts = {str(account_no): client.for_account(account_no)
+                         for account_no in account_numbers}
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_files(cls, filename_accounts, filename_oauth, max_workers=8,
+                   **kwargs):
+        """Create the facade from a file listing one account number per line.
+
+        Arguments:
+            filename_accounts (str): Name of the file containing the account
+            numbers.
+            filename_oauth (str): Name of the file containing the OAuth
+            certificate.
+            max_workers (int) optional: Number of concurrent requests.
+            kwargs: Passed on to TDAmeritrade.
+        """
+        with open(filename_accounts) as file_obj:
+            account_numbers = [line.strip() for line in file_obj
+                               if line.strip()]
+        client = TDAmeritrade(filename_accounts, filename_oauth, **kwargs)
+        return cls(client, account_numbers, max_workers=max_workers)
+
+    def _fan_out(self, method, **kwargs):
+        """Call a client method for every account concurrently. The first
+        exception raised by a call is re-raised.
+
+        Returns:
+            dict: {account_no: result}
+        """
+        if len(self.accounts) <= 1:
+            return {account_no: getattr(client, method)(**kwargs)
+                    for account_no, client in self.accounts.items()}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {account_no: executor.submit(getattr(client, method),
+                                                   **kwargs)
+                       for account_no, client in self.accounts.items()}
+            return {account_no: future.result()
+                    for account_no, future in futures.items()}
+
+    @staticmethod
+    def _merge(results, as_models=False, model=None):
+        """Concatenate the records of every account. Each record is tagged
+        with its account number under the "accountId" key. The records are
+        shallow copies, the decoded (and possibly cached) responses are left
+        untouched.
+        """
+        records = list()
+        for account_no, messages in results.items():
+            for message in messages or list():
+                record = dict(message)
+                record["accountId"] = account_no
+                records.append(record)
+        if as_models:
+            return [model.from_json(record) for record in records]
+        return records
+
+    def get_account_info(self, fields="positions,orders"):
+        """Get the account information of every account.
+
+        Arguments:
+            fields (str) optional: Fields requested, e.g. "positions,orders".
+
+        Returns:
+            dict: {account_no: account information}
+        """
+        return self._fan_out("get_account_info", fields=fields)
+
+    def get_positions(self, as_models=False):
+        """Get the positions of every account in one list. Each position is
+        tagged with its account number under "accountId".
+
+        Arguments:
+            as_models (bool) optional: Return models.Position records.
+        """
+        results = {account_no: message["securitiesAccount"].get("positions")
+                   for account_no, message
+                   in self.get_account_info(fields="positions").items()}
+        return self._merge(results, as_models, Position)
+
+    def get_orders(self, as_models=False, **kwargs):
+        """Get the orders of every account in one list, tagged with the
+        account number under "accountId".
+
+        Arguments:
+            as_models (bool) optional: Return models.Order records.
+            kwargs: Passed on to TDAmeritrade.get_orders.
+        """
+        return self._merge(self._fan_out("get_orders", **kwargs), as_models,
+                           Order)
+
+    def get_transactions(self, as_models=False, **kwargs):
+        """Get the transactions of every account in one list, tagged with
+        the account number under "accountId".
+
+        Arguments:
+            as_models (bool) optional: Return models.Transaction records.
+            kwargs: Passed on to TDAmeritrade.get_transactions.
+        """
+        return self._merge(self._fan_out("get_transactions", **kwargs),
+                           as_models, Transaction)
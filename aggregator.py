@@ -0,0 +1,235 @@
+"""
+Module providing an incremental intraday bar aggregator.
+
+Quote snapshots, polled with get_quotes(as_frame=False) or pushed by
+streaming.TDStreamer, are folded into rolling OHLCV bars of many symbols at
+several frequencies. The bars of each frequency live in a fixed size ring
+buffer of shape (capacity, symbol, field), the fields in the column order of
+get_price_history, so live bars are read without any request.
+
+The bars are aligned on the wall clock: a bar of a frequency of 60 seconds
+covers one calendar minute for every symbol. The volume of a bar is the
+increase of the cumulative day volume of the quotes; the first quote of a
+symbol only sets the starting volume. A quote older than the current bar
+only adds its volume increase to the current bar, as the closed bars are
+not changed.
+
+Example:
+>>bars = BarAggregator(symbols, frequencies=(60, 300))
+>>bars.update_quotes(td.get_quotes(symbols, as_frame=False))
+>>bars.get_bars("SPYG", 60)
+>>streamer.add_callback("QUOTE", bars.on_quote)
+
+Classes:
+    BarAggregator
+
+"""
+import threading
+import time
+
+import numpy as np
+
+from analytics import FIELDS, PricePanel
+
+
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(len(FIELDS))
+
+
+class BarAggregator:
+    """Rolling OHLCV bars per symbol and frequency in ring buffers.
+
+    Class variables
+        symbols (tuple): Symbols aggregated, in the order of the symbol axis.
+        frequencies (tuple): Bar lengths in seconds.
+        capacity (int): Number of bars kept per frequency.
+    """
+    def __init__(self, symbols, frequencies=(60, 300), capacity=390):
+        """Allocate the ring buffers.
+
+        Arguments:
+            symbols (list): Symbols to aggregate.
+            frequencies (tuple) optional: Bar lengths in seconds.
+            capacity (int) optional: Number of bars kept per frequency, a
+            trading day of one minute bars by default.
+        """
+        self.symbols = tuple(symbols)
+        self.frequencies = tuple(frequencies)
+        self.capacity = capacity
+        self._columns = {symbol: i for i, symbol in enumerate(self.symbols)}
+        count = len(self.symbols)
+        self._data = {frequency: np.full((capacity, count, len(FIELDS)),
+                                         np.nan)
+                      for frequency in self.frequencies}
+        self._times = {frequency: np.zeros(capacity, dtype=np.int64)
+                       for frequency in self.frequencies}
+        # Position of the current bar in the ring, -1 before the first bar.
+        self._head = dict.fromkeys(self.frequencies, -1)
+        self._written = dict.fromkeys(self.frequencies, 0)
+        self._day_volume = np.full(count, np.nan)
+        self._lock = threading.Lock()
+
+    def _advance(self, frequency, timestamp):
+        """Move the ring of a frequency to the bar holding timestamp. Bars
+        without quotes in between are left empty. Returns the position of
+        the bar, None if the timestamp is before the current bar.
+        """
+        length = frequency * 1000
+        start = timestamp - timestamp % length
+        times = self._times[frequency]
+        head = self._head[frequency]
+        if head >= 0:
+            current = times[head]
+            if start < current:
+                return None
+            if start == current:
+                return head
+            steps = min((start - current) // length, self.capacity)
+        else:
+            current, steps = start - length, 1
+        data = self._data[frequency]
+        for step in range(steps, 0, -1):
+            head = (head + 1) % self.capacity
+            data[head] = np.nan
+            data[head, :, VOLUME] = 0.
+            times[head] = start - (step - 1) * length
+        self._head[frequency] = head
+        self._written[frequency] += steps
+        return head
+
+    def _fold(self, columns, prices, volumes, timestamp):
+        """Fold the prices and cumulative volumes of the symbols at columns
+        into the current bar of every frequency. The prices of a late quote
+        are dropped, its volume increase is counted in the current bar.
+        """
+        previous = self._day_volume[columns]
+        traded = volumes - previous
+        # A lower cumulative volume starts a new day.
+        traded = np.where(np.isnan(traded), 0., np.where(traded < 0, volumes,
+                                                         traded))
+        traded = np.nan_to_num(traded)
+        self._day_volume[columns] = np.where(np.isnan(volumes), previous,
+                                             volumes)
+        for frequency in self.frequencies:
+            head = self._advance(frequency, timestamp)
+            if head is None:
+                bar = self._data[frequency][self._head[frequency]]
+                bar[columns, VOLUME] += traded
+                continue
+            bar = self._data[frequency][head]
+            opened = bar[columns, OPEN]
+            bar[columns, OPEN] = np.where(np.isnan(opened), prices, opened)
+            bar[columns, HIGH] = np.fmax(bar[columns, HIGH], prices)
+            bar[columns, LOW] = np.fmin(bar[columns, LOW], prices)
+            bar[columns, CLOSE] = prices
+            bar[columns, VOLUME] += traded
+
+    def update(self, symbol, price, volume=None, timestamp=None):
+        """Add a single quote.
+
+        Arguments:
+            symbol (str): Symbol.
+            price (float): Last price.
+            volume (float) optional: Cumulative day volume.
+            timestamp (int) optional: Epoch milliseconds. Defaults to now.
+        """
+        column = self._columns.get(symbol)
+        if column is None or price is None:
+            return
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._fold(np.array([column]), np.array([float(price)]),
+                       np.array([np.nan if volume is None else float(volume)]),
+                       int(timestamp))
+
+    def update_quotes(self, quotes, timestamp=None):
+        """Add a snapshot of get_quotes(as_frame=False). Every quote is
+        folded into the bar of the snapshot time.
+
+        Arguments:
+            quotes (dict): Quotes keyed by symbol.
+            timestamp (int) optional: Epoch milliseconds of the snapshot.
+            Defaults to now.
+        """
+        columns, prices, volumes = list(), list(), list()
+        for symbol, quote in quotes.items():
+            column = self._columns.get(symbol)
+            price = quote.get("lastPrice")
+            if column is None or price is None:
+                continue
+            columns.append(column)
+            prices.append(price)
+            volumes.append(quote.get("totalVolume", np.nan))
+        if not columns:
+            return
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._fold(np.array(columns), np.array(prices, dtype=np.float64),
+                       np.array(volumes, dtype=np.float64), int(timestamp))
+
+    def on_quote(self, update):
+        """TDStreamer QUOTE callback. Updates without a last price are
+        skipped.
+
+        Arguments:
+            update (dict): Parsed streamer update.
+        """
+        self.update(update.get("symbol"), update.get("last"),
+                    update.get("volume"), update.get("timestamp"))
+
+    def _ordered(self, frequency, count, include_current):
+        """Get the positions of the bars in the ring, oldest first.
+        """
+        head = self._head[frequency]
+        if head < 0:
+            return np.empty(0, dtype=np.intp)
+        available = min(self._written[frequency], self.capacity)
+        if not include_current:
+            available -= 1
+            head -= 1
+        if count is not None:
+            available = min(available, count)
+        return np.arange(head - available + 1, head + 1) % self.capacity
+
+    def get_bars(self, symbol, frequency, count=None, include_current=True,
+                 as_frame=True):
+        """Get the bars of a symbol.
+
+        Arguments:
+            symbol (str): Symbol.
+            frequency (int): Bar length in seconds.
+            count (int) optional: Number of most recent bars. All the bars
+            kept if None.
+            include_current (bool) optional: Include the bar still being
+            built.
+            as_frame (bool) optional: Return a DataFrame indexed by datetime
+            with the columns of get_price_history. If False, return the
+            timestamps (datetime64[ms]) and a (bar, field) array.
+        """
+        column = self._columns[symbol]
+        with self._lock:
+            rows = self._ordered(frequency, count, include_current)
+            data = self._data[frequency][rows, column]
+            index = self._times[frequency][rows].astype("datetime64[ms]")
+        if not as_frame:
+            return index, data
+        import pandas as pd
+        frame = pd.DataFrame(data, columns=list(FIELDS),
+                             index=pd.DatetimeIndex(index, name="datetime"))
+        return frame.astype({"volume": np.int64})
+
+    def to_panel(self, frequency, count=None, include_current=True):
+        """Get the bars of every symbol as an analytics.PricePanel.
+
+        Arguments:
+            frequency (int): Bar length in seconds.
+            count (int) optional: Number of most recent bars.
+            include_current (bool) optional: Include the bar still being
+            built.
+        """
+        with self._lock:
+            rows = self._ordered(frequency, count, include_current)
+            data = self._data[frequency][rows]
+            index = self._times[frequency][rows].astype("datetime64[ms]")
+        return PricePanel(index, self.symbols, data, FIELDS)
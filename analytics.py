@@ -0,0 +1,242 @@
+"""
+Module providing vectorized return analytics over price bars.
+
+The bars are a dense float array of shape (time, symbol, field), the fields
+in the column order of get_price_history. Every function works on whole
+arrays at once with NumPy ufuncs and writes into caller supplied buffers
+(out), so repeated runs over thousands of symbols allocate nothing and pay
+no pandas index alignment.
+
+Differentials, for bar i:
+    cc = (close_i - close_i-1) / close_i-1
+    co = (open_i - close_i-1) / close_i-1
+    oc = (close_i - open_i) / open_i
+    high = (high_i - open_i) / open_i
+    low = (low_i - open_i) / open_i
+
+PricePanel holds the bars of many symbols aligned on a shared time index,
+as built by align_candles from get_price_history(as_frame=False) arrays.
+
+Example:
+>>panel = td.get_price_panel(td.get_commission_free_etfs(), period=6)
+>>dbars = differentials(panel.data)
+>>cumulative = cumulative_returns(dbars[:, :, DIFFERENTIALS.index("cc")])
+
+Classes:
+    PricePanel
+
+"""
+import numpy as np
+
+
+# Column order of the bars returned by get_price_history.
+FIELDS = ("open", "high", "low", "close", "volume")
+DIFFERENTIALS = ("cc", "co", "oc", "high", "low")
+# Size of the blocks of bars processed at once, about a L2 cache.
+BLOCK_BYTES = 1 << 18
+# Minimum number of symbols for which returns are accumulated row by row.
+MIN_ROW_SIZE = 256
+FILL_METHODS = ("backfill", "ffill")
+
+
+def _ratio(numerator, denominator, out):
+    """Compute (numerator - denominator) / denominator into out without
+    temporaries.
+    """
+    np.subtract(numerator, denominator, out=out)
+    np.divide(out, denominator, out=out)
+    return out
+
+
+def differentials(bars, out=None, fields=FIELDS):
+    """Calculate the price differentials of every symbol.
+
+    Arguments:
+        bars (np.ndarray): Bars of shape (time, symbol, field).
+        out (np.ndarray) optional: Buffer of shape (time - 1, symbol, 5)
+        the differentials are written to. Allocated if None.
+        fields (tuple) optional: Names of the fields of bars.
+
+    Returns:
+        np.ndarray: Shape (time - 1, symbol, 5), the last axis in
+        DIFFERENTIALS order.
+    """
+    bars = np.asarray(bars, dtype=np.float64)
+    if bars.ndim != 3:
+        raise ValueError("bars must have shape (time, symbol, field), got {}"
+                         .format(bars.shape))
+    shape = (bars.shape[0] - 1, bars.shape[1], len(DIFFERENTIALS))
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError("out must have shape {}, got {}"
+                         .format(shape, out.shape))
+    index = [fields.index(field) for field in ("open", "high", "low",
+                                               "close")]
+    # The fields are interleaved in memory. Working through blocks of rows
+    # that fit the CPU cache reads each block from memory once instead of
+    # once per differential.
+    rows = max(1, BLOCK_BYTES // max(bars.strides[0], 1))
+    for start in range(1, bars.shape[0], rows):
+        block = bars[start:start + rows]
+        dest = out[start - 1:start - 1 + len(block)]
+        previous_close = bars[start - 1:start - 1 + len(block), :, index[3]]
+        open_price = block[:, :, index[0]]
+        close_price = block[:, :, index[3]]
+        _ratio(close_price, previous_close, dest[:, :, 0])
+        _ratio(open_price, previous_close, dest[:, :, 1])
+        _ratio(close_price, open_price, dest[:, :, 2])
+        _ratio(block[:, :, index[1]], open_price, dest[:, :, 3])
+        _ratio(block[:, :, index[2]], open_price, dest[:, :, 4])
+    return out
+
+
+def cumulative_returns(returns, out=None, compound=True):
+    """Accumulate returns along the time axis.
+
+    Arguments:
+        returns (np.ndarray): Returns, time along the first axis.
+        out (np.ndarray) optional: Buffer of the shape of returns. Allocated
+        if None, may be returns itself.
+        compound (bool) optional: Compound the returns, prod(1 + r) - 1.
+        Sum them if False (log returns, or the notebook's cumsum of cc).
+
+    Returns:
+        np.ndarray
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if out is None:
+        out = np.empty_like(returns)
+    if compound:
+        np.add(returns, 1., out=out)
+    elif out is not returns:
+        np.copyto(out, returns)
+    accumulate = np.multiply if compound else np.add
+    if out.ndim > 1 and out[0].size >= MIN_ROW_SIZE:
+        # Accumulating row by row runs over contiguous rows, much faster
+        # than the strided ufunc.accumulate along the first axis.
+        for i in range(1, len(out)):
+            accumulate(out[i - 1], out[i], out=out[i])
+    else:
+        accumulate.accumulate(out, axis=0, out=out)
+    if compound:
+        np.subtract(out, 1., out=out)
+    return out
+
+
+def log_returns(bars, out=None, fields=FIELDS):
+    """Calculate the close to close log returns of every symbol.
+
+    Arguments:
+        bars (np.ndarray): Bars of shape (time, symbol, field).
+        out (np.ndarray) optional: Buffer of shape (time - 1, symbol).
+        fields (tuple) optional: Names of the fields of bars.
+
+    Returns:
+        np.ndarray: Shape (time - 1, symbol).
+    """
+    close_price = np.asarray(bars, dtype=np.float64)[:, :,
+                                                     fields.index("close")]
+    if out is None:
+        out = np.empty((close_price.shape[0] - 1, close_price.shape[1]))
+    np.divide(close_price[1:], close_price[:-1], out=out)
+    return np.log(out, out=out)
+
+
+def fill_missing(bars, method="backfill"):
+    """Fill the missing (NaN) bars in place along the time axis. A bar is
+    missing if its first field is NaN.
+
+    Arguments:
+        bars (np.ndarray): Bars of shape (time, symbol, field).
+        method (str or float): backfill (next bar) | ffill (previous bar),
+        or a value every NaN is replaced with. None leaves the NaN.
+
+    Returns:
+        np.ndarray: bars
+    """
+    if method is None or bars.size == 0:
+        return bars
+    if method not in FILL_METHODS:
+        bars[np.isnan(bars)] = method
+        return bars
+    steps = bars.shape[0]
+    present = ~np.isnan(bars[:, :, 0])
+    rows = np.arange(steps)[:, None]
+    if method == "ffill":
+        source = np.where(present, rows, 0)
+        np.maximum.accumulate(source, axis=0, out=source)
+    else:
+        source = np.where(present, rows, steps - 1)[::-1]
+        np.minimum.accumulate(source, axis=0, out=source)
+        source = source[::-1]
+    bars[:] = bars[source, np.arange(bars.shape[1])]
+    return bars
+
+
+class PricePanel:
+    """Bars of several symbols aligned on a shared time index.
+
+    Class variables
+        index (np.ndarray): Timestamps, datetime64[ms], sorted.
+        symbols (tuple): Symbols, in the order of the symbol axis.
+        fields (tuple): Fields, in the order of the field axis.
+        data (np.ndarray): float64 bars of shape (time, symbol, field).
+    """
+    __slots__ = ("index", "symbols", "fields", "data")
+
+    def __init__(self, index, symbols, data, fields=FIELDS):
+        self.index = index
+        self.symbols = tuple(symbols)
+        self.fields = tuple(fields)
+        self.data = data
+
+    def __getitem__(self, field):
+        """Get a field as a (time, symbol) view.
+        """
+        return self.data[:, :, self.fields.index(field)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return "<PricePanel {} bars x {} symbols x {} fields>".format(
+            *self.data.shape)
+
+    def to_frame(self, field):
+        """Get a field as a DataFrame indexed by datetime, one column per
+        symbol.
+        """
+        import pandas as pd
+        return pd.DataFrame(self[field], columns=list(self.symbols),
+                            index=pd.DatetimeIndex(self.index,
+                                                   name="datetime"))
+
+
+def align_candles(symbols, histories, fill="backfill", fields=FIELDS):
+    """Align the price histories of several symbols on the union of their
+    timestamps in one pass, without a DataFrame per symbol.
+
+    Arguments:
+        symbols (list): Symbols.
+        histories (list): Structured arrays with a datetime field and the
+        fields, one per symbol, each sorted by datetime (as returned by
+        get_price_history(as_frame=False)).
+        fill (str or float) optional: Fill policy of the missing bars, see
+        fill_missing.
+        fields (tuple) optional: Fields of the panel.
+
+    Returns:
+        PricePanel
+    """
+    if histories:
+        index = np.unique(np.concatenate([history["datetime"]
+                                          for history in histories]))
+    else:
+        index = np.empty(0, dtype="datetime64[ms]")
+    data = np.full((len(index), len(histories), len(fields)), np.nan)
+    for column, history in enumerate(histories):
+        rows = np.searchsorted(index, history["datetime"])
+        for k, field in enumerate(fields):
+            data[rows, column, k] = history[field]
+    return PricePanel(index, symbols, fill_missing(data, fill), fields)
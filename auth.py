@@ -0,0 +1,227 @@
+"""
+Module providing OAuth 2.0 access token management for the TDAmeritrade
+client.
+
+The access tokens issued by TD Ameritrade expire after 30 minutes. The
+TokenManager keeps the refresh token, renews the access token in a
+background thread before it expires and lets the client force a renewal
+after an HTTP 401. Concurrent callers share a single in-flight refresh.
+
+References:
+https://developer.tdameritrade.com/content/simple-auth-local-apps
+https://developer.tdameritrade.com/authentication/apis/post/token-0
+
+Classes:
+    TokenManager
+
+"""
+import io
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+from transport import HTTPTransport
+
+
+TOKEN_URL = "https://api.tdameritrade.com/v1/oauth2/token"
+
+
+class TokenManager:
+    """Holds the access and refresh tokens and renews the access token.
+
+    Class variables
+        access_token (str): Current access token.
+        refresh_token (str): Refresh token (None if the token is static).
+        client_id (str): Consumer key of the app, e.g. APPID@AMER.OAUTHAP.
+        expires_at (float): time.time() at which the access token expires.
+        refresh_margin (float): Seconds before expiry the token is renewed.
+        filename_refresh (str): File the refresh token is saved to.
+
+    Example:
+    >>tokens = TokenManager(refresh_token=refresh,
+    >>                      client_id="APP@AMER.OAUTHAP")
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt", token_manager=tokens)
+    """
+    def __init__(self, access_token=None, refresh_token=None, client_id=None,
+                 expires_in=None, refresh_margin=300., transport=None,
+                 token_url=TOKEN_URL, filename_refresh=None):
+        """Set up the tokens. Without a refresh token and client id the
+        access token is static and never renewed.
+
+        Arguments:
+            access_token (str) optional: Initial access token.
+            refresh_token (str) optional: Refresh token.
+            client_id (str) optional: Consumer key of the app.
+            expires_in (float) optional: Seconds until the initial access
+            token expires. Unknown expiry is treated as expired if the token
+            can be refreshed.
+            refresh_margin (float) optional: Seconds before expiry the token
+            is renewed.
+            transport (HTTPTransport) optional: Transport of the token
+            requests. The client sets its own if None.
+            token_url (str) optional: Url of the token endpoint.
+            filename_refresh (str) optional: File a new refresh token is
+            saved to.
+        """
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.refresh_margin = refresh_margin
+        self.transport = transport
+        self.token_url = token_url
+        self.filename_refresh = filename_refresh
+        if expires_in is not None:
+            self.expires_at = time.time() + expires_in
+        elif self.refreshable:
+            self.expires_at = 0.
+        else:
+            self.expires_at = float("inf")
+        self.refreshes = 0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_files(cls, filename_oauth, filename_refresh, client_id,
+                   **kwargs):
+        """Create a token manager from the files holding the access token
+        and the refresh token. Renewed refresh tokens are saved back.
+
+        Arguments:
+            filename_oauth (str): Name of the file containing the access
+            token.
+            filename_refresh (str): Name of the file containing the refresh
+            token.
+            client_id (str): Consumer key of the app.
+        """
+        tokens = list()
+        for filename in (filename_oauth, filename_refresh):
+            with open(filename) as file_obj:
+                tokens.append(file_obj.readlines()[0].rstrip("\n"))
+        return cls(access_token=tokens[0], refresh_token=tokens[1],
+                   client_id=client_id, filename_refresh=filename_refresh,
+                   **kwargs)
+
+    @property
+    def refreshable(self):
+        """Whether the access token can be renewed.
+        """
+        return self.refresh_token is not None and self.client_id is not None
+
+    def _expiring(self):
+        """Whether the access token is missing or about to expire.
+        """
+        return (self.access_token is None
+                or time.time() >= self.expires_at - self.refresh_margin)
+
+    def get_token(self):
+        """Get a valid access token, renewing it first if it is about to
+        expire.
+        """
+        token = self.access_token
+        if self.refreshable and self._expiring():
+            token = self.refresh(stale_token=token)
+        return token
+
+    def invalidate(self, token):
+        """Report that a token was rejected (HTTP 401). The access token is
+        renewed, unless another caller already replaced the rejected token.
+
+        Arguments:
+            token (str): The rejected access token.
+
+        Returns:
+            The access token to retry with, None if it cannot be renewed.
+        """
+        if not self.refreshable:
+            return None
+        return self.refresh(stale_token=token)
+
+    def refresh(self, stale_token=None, access_type=None):
+        """Renew the access token. Only one refresh is in flight at a time.
+        Callers waiting on it get the renewed token without a request of
+        their own.
+
+        Arguments:
+            stale_token (str) optional: Token the caller wants replaced. No
+            request is made if it was already replaced.
+            access_type (str) optional: "offline" to also get a new refresh
+            token.
+
+        Returns:
+            The access token.
+        """
+        with self._refresh_lock:
+            if (stale_token is not None and stale_token != self.access_token
+                    and not self._expiring()):
+                return self.access_token
+            form = {"grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token,
+                    "client_id": self.client_id}
+            if access_type is not None:
+                form["access_type"] = access_type
+            body = urllib.parse.urlencode(form).encode("utf-8")
+            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+            if self.transport is None:
+                self.transport = HTTPTransport()
+            response = self.transport.request("POST", self.token_url,
+                                              headers=headers, body=body)
+            if response.status != 200:
+                self._logger.error("token refresh failed: %s %s",
+                                   response.status, response.body)
+                from urllib.error import HTTPError
+                raise HTTPError(self.token_url, response.status,
+                                response.reason, response.headers,
+                                io.BytesIO(response.body))
+            message = json.loads(response.body.decode("utf-8"))
+            self.access_token = message["access_token"]
+            self.expires_at = time.time() + message.get("expires_in", 1800)
+            if "refresh_token" in message:
+                self.refresh_token = message["refresh_token"]
+                self._save_refresh_token()
+            self.refreshes += 1
+            self._logger.info("access token renewed, expires in %ss",
+                              message.get("expires_in"))
+            return self.access_token
+
+    def _save_refresh_token(self):
+        """Save the refresh token to filename_refresh.
+        """
+        if self.filename_refresh is None:
+            return
+        with open(self.filename_refresh, mode='w') as file_obj:
+            file_obj.write(self.refresh_token + "\n")
+
+    def _run(self):
+        """Background loop renewing the access token before it expires.
+        """
+        while not self._stop.is_set():
+            delay = self.expires_at - self.refresh_margin - time.time()
+            if delay > 0. and self._stop.wait(delay):
+                break
+            try:
+                self.refresh(stale_token=self.access_token)
+            except Exception:  # pylint: disable=broad-except
+                self._logger.exception("background token refresh failed")
+                self._stop.wait(30.)
+
+    def start(self):
+        """Start renewing the access token in a background thread.
+        """
+        if not self.refreshable or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background renewal.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
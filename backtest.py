@@ -0,0 +1,266 @@
+"""
+Module providing a backtest engine over cached price history.
+
+A strategy is a function of the bars of shape (time, symbol, field) and of
+keyword parameters. It returns the LIMIT orders to submit after the close of
+each bar as two (time, symbol) arrays: the limit price (NaN for no order)
+and the signed quantity (> 0 BUY, < 0 SELL). The orders of a bar are DAY
+orders working during the next bar, exactly what place_orders would submit
+(see to_orders). A BUY fills if the next low reaches the limit, at the
+better of the limit and the open; a SELL fills if the next high reaches the
+limit, for at most the shares held.
+
+Parameter sweeps run on a process pool. The bars are copied once into
+shared memory, the workers map them instead of receiving a pickled copy
+with every task.
+
+Example:
+>>panel = td.get_price_panel(td.get_commission_free_etfs(), period=6)
+>>engine = Backtest.from_panel(panel)
+>>grid = [{"window": w, "threshold": t} for w in (5, 10, 20)
+>>        for t in (0.005, 0.01, 0.02)]
+>>results = engine.sweep(mean_reversion, grid)
+
+Classes:
+    Backtest
+
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from analytics import FIELDS, align_candles
+
+
+TRADING_DAYS = 252
+# Bars mapped from shared memory in the workers: {name: (memory, bars)}.
+_SHARED = dict()
+
+
+def mean_reversion(bars, window=5, threshold=0.01, quantity=10,
+                   fields=FIELDS):
+    """Example strategy: buy below the moving average of the close, sell
+    above it, with limits threshold away from the close.
+
+    Arguments:
+        bars (np.ndarray): Bars of shape (time, symbol, field).
+        window (int): Number of bars of the moving average.
+        threshold (float): Relative distance of the limits to the close.
+        quantity (int): Shares per order.
+        fields (tuple): Names of the fields of bars.
+
+    Returns:
+        (prices, quantities): (time, symbol) arrays.
+    """
+    close = bars[:, :, fields.index("close")]
+    cumulative = np.cumsum(close, axis=0)
+    average = np.full_like(close, np.nan)
+    average[window - 1] = cumulative[window - 1] / window
+    average[window:] = (cumulative[window:] - cumulative[:-window]) / window
+    below = close < average * (1. - threshold)
+    above = close > average * (1. + threshold)
+    prices = np.where(below, close * (1. - threshold),
+                      np.where(above, close * (1. + threshold), np.nan))
+    quantities = np.where(below, quantity, np.where(above, -quantity, 0))
+    return prices, quantities
+
+
+def to_orders(symbols, prices, quantities, row):
+    """Get the orders of a bar as place_orders arguments.
+
+    Arguments:
+        symbols (tuple): Symbols of the symbol axis.
+        prices (np.ndarray): (time, symbol) limit prices.
+        quantities (np.ndarray): (time, symbol) signed quantities.
+        row (int): Bar index.
+
+    Returns:
+        list of (symbol, price, quantity, instruction) tuples.
+    """
+    orders = list()
+    for column in np.flatnonzero(~np.isnan(prices[row])
+                                 & (quantities[row] != 0)):
+        quantity = int(quantities[row, column])
+        orders.append((symbols[column], round(float(prices[row, column]), 2),
+                       abs(quantity), "BUY" if quantity > 0 else "SELL"))
+    return orders
+
+
+def simulate(bars, prices, quantities, initial_cash=100000., commission=0.,
+             fields=FIELDS):
+    """Simulate the LIMIT orders of a strategy over the bars.
+
+    Arguments:
+        bars (np.ndarray): Bars of shape (time, symbol, field).
+        prices (np.ndarray): (time, symbol) limit prices, NaN for no order.
+        quantities (np.ndarray): (time, symbol) signed quantities.
+        initial_cash (float) optional: Cash at the start.
+        commission (float) optional: Commission per filled order.
+        fields (tuple) optional: Names of the fields of bars.
+
+    Returns:
+        dict: final_equity, total_return, max_drawdown, sharpe, fills and
+        equity (time array).
+    """
+    open_price = bars[:, :, fields.index("open")]
+    high = bars[:, :, fields.index("high")]
+    low = bars[:, :, fields.index("low")]
+    close = bars[:, :, fields.index("close")]
+    steps, count = close.shape
+    cash = initial_cash
+    held = np.zeros(count)
+    fills = 0
+    equity = np.empty(steps)
+    equity[0] = cash
+    limit_price = np.nan_to_num(prices, nan=0.)
+    # Holdings are marked at the last valid close of each symbol.
+    marks = np.nan_to_num(close[0], nan=0.)
+    with np.errstate(invalid="ignore"):
+        for row in range(1, steps):
+            price, quantity = limit_price[row - 1], quantities[row - 1]
+            buy = (quantity > 0) & (low[row] <= price)
+            sell = (quantity < 0) & (high[row] >= price) & (held > 0)
+            if buy.any():
+                fill_price = np.minimum(price[buy], open_price[row, buy])
+                cash -= fill_price @ quantity[buy] + commission * buy.sum()
+                held[buy] += quantity[buy]
+                fills += int(buy.sum())
+            if sell.any():
+                size = np.minimum(-quantity[sell], held[sell])
+                fill_price = np.maximum(price[sell], open_price[row, sell])
+                cash += fill_price @ size - commission * sell.sum()
+                held[sell] -= size
+                fills += int(sell.sum())
+            marks = np.where(np.isnan(close[row]), marks, close[row])
+            equity[row] = cash + held @ marks
+    peak = np.maximum.accumulate(equity)
+    returns = np.diff(equity) / equity[:-1]
+    deviation = returns.std() if len(returns) else 0.
+    return {"final_equity": float(equity[-1]),
+            "total_return": float(equity[-1] / initial_cash - 1.),
+            "max_drawdown": float(((peak - equity) / peak).max()),
+            "sharpe": (float(returns.mean() / deviation
+                             * math.sqrt(TRADING_DAYS)) if deviation else 0.),
+            "fills": fills, "equity": equity}
+
+
+def _attach(name, shape, dtype):
+    """Process pool initializer: map the shared bars.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    _SHARED[name] = (memory, np.ndarray(shape, dtype=dtype,
+                                        buffer=memory.buf))
+
+
+def _run_shared(name, strategy, params, initial_cash, commission, fields):
+    """Run a parameter set on the shared bars in a worker.
+    """
+    bars = _SHARED[name][1]
+    prices, quantities = strategy(bars, **params)
+    result = simulate(bars, prices, quantities, initial_cash, commission,
+                      fields)
+    del result["equity"]
+    result["params"] = params
+    return result
+
+
+class Backtest:
+    """Backtest engine over aligned bars.
+
+    Class variables
+        bars (np.ndarray): float64 bars of shape (time, symbol, field).
+        symbols (tuple): Symbols of the symbol axis.
+        index (np.ndarray): Timestamps of the time axis.
+        fields (tuple): Fields of the field axis.
+        initial_cash (float): Cash at the start.
+        commission (float): Commission per filled order.
+    """
+    def __init__(self, bars, symbols, index=None, fields=FIELDS,
+                 initial_cash=100000., commission=0.):
+        self.bars = np.ascontiguousarray(bars, dtype=np.float64)
+        self.symbols = tuple(symbols)
+        self.index = index
+        self.fields = tuple(fields)
+        self.initial_cash = initial_cash
+        self.commission = commission
+
+    @classmethod
+    def from_panel(cls, panel, **kwargs):
+        """Create an engine from an analytics.PricePanel.
+        """
+        return cls(panel.data, panel.symbols, panel.index, panel.fields,
+                   **kwargs)
+
+    @classmethod
+    def from_histories(cls, histories, fill="ffill", **kwargs):
+        """Create an engine from price histories in the get_price_history
+        format.
+
+        Arguments:
+            histories (dict): {symbol: DataFrame or structured array}.
+            fill (str or float) optional: Fill policy of the missing bars.
+        """
+        symbols = list(histories)
+        arrays = list()
+        for symbol in symbols:
+            history = histories[symbol]
+            if hasattr(history, "to_records"):
+                history = history.to_records()
+            arrays.append(history)
+        panel = align_candles(symbols, arrays, fill=fill)
+        return cls.from_panel(panel, **kwargs)
+
+    def run(self, strategy, **params):
+        """Run a strategy in this process.
+
+        Arguments:
+            strategy (callable): strategy(bars, **params) -> (prices,
+            quantities).
+            params: Strategy parameters.
+
+        Returns:
+            dict, see simulate.
+        """
+        prices, quantities = strategy(self.bars, **params)
+        return simulate(self.bars, prices, quantities, self.initial_cash,
+                        self.commission, self.fields)
+
+    def sweep(self, strategy, grid, processes=None, chunksize=1):
+        """Run a strategy for every parameter set on a process pool sharing
+        the bars. The equity curves are dropped from the results.
+
+        Arguments:
+            strategy (callable): Module level strategy function (pickled to
+            the workers by reference).
+            grid (list): Parameter dicts.
+            processes (int) optional: Number of worker processes. Defaults
+            to the number of CPUs.
+            chunksize (int) optional: Parameter sets sent per task.
+
+        Returns:
+            list of dict in grid order, see simulate, with the params.
+        """
+        grid = list(grid)
+        if not grid:
+            return list()
+        memory = shared_memory.SharedMemory(create=True,
+                                            size=max(self.bars.nbytes, 1))
+        shared = None
+        try:
+            shared = np.ndarray(self.bars.shape, dtype=self.bars.dtype,
+                                buffer=memory.buf)
+            shared[:] = self.bars
+            with ProcessPoolExecutor(
+                    max_workers=processes, initializer=_attach,
+                    initargs=(memory.name, self.bars.shape,
+                              self.bars.dtype.str)) as executor:
+                tasks = [(memory.name, strategy, params, self.initial_cash,
+                          self.commission, self.fields) for params in grid]
+                return list(executor.map(_run_shared, *zip(*tasks),
+                                         chunksize=chunksize))
+        finally:
+            del shared
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,556 @@
+"""
+Micro-benchmarks for the TDAmeritrade client. Run with
+
+    python benchmarks.py
+
+Each benchmark prints the best time over a number of repeats. No
+credentials or network access are needed: the API benchmarks run against a
+local ReplayServer serving a synthetic cassette (see replay.py).
+
+The best times are compared with the stored baseline (benchmarks.json):
+the run exits with status 1 if a benchmark is slower than its baseline by
+more than the tolerance, so it can gate CI. Record the baseline on the
+machine running the check with
+
+    python benchmarks.py --save-baseline
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from aggregator import BarAggregator
+from analytics import FIELDS, align_candles, cumulative_returns, \
+    differentials
+from auth import TokenManager
+from backtest import Backtest, mean_reversion
+from cache import ResponseCache
+from orders import LIMIT_ORDER
+from replay import API_PATH, Cassette, ReplayServer
+from scheduler import RequestScheduler
+from tdameritrade import TDAmeritrade, candles_to_frame, decode_candles, \
+    setup_logging
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "benchmarks.json")
+# Relative slowdown over the baseline reported as a regression, and
+# absolute seconds of slack for the benchmarks too short to time reliably.
+TOLERANCE = 0.5
+SLACK = 0.001
+ACCOUNT_NO = "123456789"
+WATCHLIST_ID = "1148189253"
+
+
+def synthetic_candles(count=100000, start=1514764800000, step=60000):
+    """Create a synthetic pricehistory candles payload.
+
+    Arguments:
+        count (int): Number of candles.
+        start (int): Epoch milliseconds of the first candle.
+        step (int): Milliseconds between candles.
+    """
+    rng = np.random.default_rng(0)
+    close = 100. + np.cumsum(rng.normal(0., 0.1, count))
+    return [{"open": float(c - 0.05), "high": float(c + 0.1),
+             "low": float(c - 0.1), "close": float(c),
+             "volume": int(v), "datetime": start + i * step}
+            for i, (c, v) in enumerate(zip(close,
+                                           rng.integers(100, 10000, count)))]
+
+
+def synthetic_bars(steps=252, symbols=1000):
+    """Create synthetic bars of shape (time, symbol, field), fields in
+    analytics.FIELDS order.
+
+    Arguments:
+        steps (int): Number of bars per symbol.
+        symbols (int): Number of symbols.
+    """
+    rng = np.random.default_rng(0)
+    close = 100. * np.exp(np.cumsum(rng.normal(0., 0.01, (steps, symbols)),
+                                    axis=0))
+    bars = np.empty((steps, symbols, len(FIELDS)))
+    bars[:, :, 0] = close * (1. + rng.normal(0., 0.002, close.shape))
+    bars[:, :, 1] = np.maximum(bars[:, :, 0], close) * 1.005
+    bars[:, :, 2] = np.minimum(bars[:, :, 0], close) * 0.995
+    bars[:, :, 3] = close
+    bars[:, :, 4] = rng.integers(100, 10000, close.shape)
+    return bars
+
+
+def _pandas_differentials(frames):
+    """Calculate the differentials the way the analysis notebook did, one
+    (time x symbol) DataFrame per field with index aligned arithmetic.
+    """
+    previous_close = frames["close"].shift(1)
+    result = {"cc": (frames["close"] - previous_close) / previous_close,
+              "co": (frames["open"] - previous_close) / previous_close,
+              "oc": (frames["close"] - frames["open"]) / frames["open"],
+              "high": (frames["high"] - frames["open"]) / frames["open"],
+              "low": (frames["low"] - frames["open"]) / frames["open"]}
+    result = {name: frame.iloc[1:] for name, frame in result.items()}
+    result["cumulative"] = result["cc"].cumsum()
+    return result
+
+
+def _legacy_decode(candles):
+    """Decode the candles the way get_price_history used to (object dtype).
+    """
+    data = np.array([[datetime.fromtimestamp(t["datetime"]/1000.).date(),
+                      t["open"], t["high"], t["low"], t["close"], t["volume"]]
+                     for t in candles])
+    return pd.DataFrame(index=data[:, 0],
+                        columns=["open", "high", "low", "close", "volume"],
+                        data=data[:, 1:])
+
+
+def offline_client(**kwargs):
+    """Create a TDAmeritrade client from throw-away account and token files.
+    The request log goes to a file next to them, not ./tdameritrade.log.
+
+    Arguments:
+        kwargs: Passed on to TDAmeritrade.
+    """
+    directory = tempfile.mkdtemp(prefix="tdameritrade-bench-")
+    setup_logging(os.path.join(directory, "tdameritrade.log"))
+    filenames = list()
+    for name, value in (("account_no.txt", ACCOUNT_NO),
+                        ("oAuth_hash.txt", "token")):
+        filename = os.path.join(directory, name)
+        with open(filename, mode='w') as file_obj:
+            file_obj.write(value + "\n")
+        filenames.append(filename)
+    return TDAmeritrade(*filenames, **kwargs)
+
+
+def synthetic_cassette(directory, symbols, candles=252):
+    """Record synthetic responses of every endpoint used by the client.
+
+    Arguments:
+        directory (str): Directory of the cassette.
+        symbols (list): Symbols of the watchlist, quotes and price history.
+        candles (int): Number of daily candles per price history.
+    """
+    cassette = Cassette(directory)
+    account = "{}accounts/{}".format(API_PATH, ACCOUNT_NO)
+    position = {"instrument": {"symbol": symbols[0], "assetType": "EQUITY"},
+                "longQuantity": 10., "shortQuantity": 0.,
+                "averagePrice": 30., "marketValue": 310.}
+    orders = [{"orderId": i, "accountId": int(ACCOUNT_NO), "status": "FILLED",
+               "orderType": "LIMIT", "price": 30., "quantity": 2.,
+               "filledQuantity": 2., "enteredTime": "2018-07-02T14:30:00+0000",
+               "orderLegCollection": [{"instruction": "BUY", "quantity": 2.,
+                                       "instrument": {"symbol": symbol}}]}
+              for i, symbol in enumerate(symbols)]
+    transactions = [{"transactionId": i, "type": "TRADE",
+                     "transactionDate": "2018-07-02T14:30:00+0000",
+                     "netAmount": -60., "fees": {"commission": 0.},
+                     "transactionItem": {"instruction": "BUY", "amount": 2.,
+                                         "price": 30.,
+                                         "instrument": {"symbol": symbol}}}
+                    for i, symbol in enumerate(symbols)]
+    quotes = {symbol: {"symbol": symbol, "bidPrice": 30., "askPrice": 30.02,
+                       "lastPrice": 30.01, "totalVolume": 1000}
+              for symbol in symbols}
+    responses = [
+        ("GET", account, {"securitiesAccount": {
+            "accountId": ACCOUNT_NO, "positions": [position],
+            "orderStrategies": orders}}),
+        ("GET", API_PATH + "orders", orders),
+        ("GET", account + "/transactions", transactions),
+        ("GET", account + "/watchlists", [{"watchlistId": WATCHLIST_ID}]),
+        ("GET", "{}/watchlists/{}".format(account, WATCHLIST_ID),
+         {"watchlistId": WATCHLIST_ID, "watchlistItems": [
+             {"instrument": {"symbol": symbol}} for symbol in symbols]}),
+        ("GET", API_PATH + "userprincipals", {"accounts": [
+            {"accountId": ACCOUNT_NO}]}),
+        ("GET", API_PATH + "marketdata/quotes", quotes),
+        ("POST", API_PATH + "oauth2/token", {
+            "access_token": "token", "refresh_token": "refresh",
+            "expires_in": 1800})]
+    for method, url, message in responses:
+        cassette.add(method, url, 200, "OK",
+                     {"Content-Type": "application/json"}, json.dumps(message))
+    for path in ("orders", "savedorders"):
+        cassette.add("POST", "{}/{}".format(account, path), 201, "Created",
+                     {"Location": "{}/{}/1".format(account, path)})
+    for symbol in symbols:
+        cassette.add("GET", "{}marketdata/{}/pricehistory"
+                     .format(API_PATH, symbol), 200, "OK",
+                     {"Content-Type": "application/json"},
+                     json.dumps({"symbol": symbol, "empty": False,
+                                 "candles": synthetic_candles(
+                                     candles, step=86400000)}))
+    return cassette
+
+
+# Best seconds of every benchmark run so far, keyed by name.
+RESULTS = dict()
+
+
+def _report(name, seconds, count):
+    """Print a benchmark result and keep it for the baseline comparison.
+    """
+    RESULTS[name] = seconds
+    print("{:<40s} {:10.2f} ms {:12.0f} items/s"
+          .format(name, seconds * 1e3, count / seconds))
+
+
+def benchmark_decode_candles(count=100000, repeat=5):
+    """Compare the legacy object dtype decode with decode_candles on a
+    synthetic payload.
+
+    Arguments:
+        count (int): Number of candles in the payload.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    candles = synthetic_candles(count)
+    for name, func in [("decode legacy (object dtype)",
+                        lambda: _legacy_decode(candles)),
+                       ("decode_candles (DataFrame)",
+                        lambda: decode_candles(candles)),
+                       ("decode_candles (structured array)",
+                        lambda: decode_candles(candles, as_frame=False))]:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        _report(name, seconds, count)
+
+
+def benchmark_order_serialization(count=10000, repeat=5):
+    """Compare building and JSON encoding the order dict with rendering the
+    pre-compiled order template, and time a dry-run batch submission.
+
+    Arguments:
+        count (int): Number of orders.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    orders = [("SYM{}".format(i), 30. + i / 100., i % 10 + 1, "BUY")
+              for i in range(count)]
+    client = offline_client()
+    for name, func in [("order dict + json.dumps",
+                        lambda: [json.dumps(LIMIT_ORDER.build(*order))
+                                 .encode("utf-8") for order in orders]),
+                       ("OrderTemplate.render",
+                        lambda: [LIMIT_ORDER.render(*order)
+                                 for order in orders]),
+                       ("place_orders(dry_run=True)",
+                        lambda: client.place_orders(orders, dry_run=True))]:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        _report(name, seconds, count)
+
+
+def benchmark_differentials(steps=252, symbols=(100, 1000, 5000), repeat=5):
+    """Compare the per field DataFrame differentials of the analysis
+    notebook with analytics.differentials writing into reused buffers.
+
+    Arguments:
+        steps (int): Number of bars per symbol.
+        symbols (tuple): Numbers of symbols to benchmark.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    for count in symbols:
+        bars = synthetic_bars(steps, count)
+        index = pd.date_range("2018-01-01", periods=steps)
+        frames = {field: pd.DataFrame(bars[:, :, i], index=index)
+                  for i, field in enumerate(FIELDS)}
+        out = np.empty((steps - 1, count, 5))
+        cumulative = np.empty((steps - 1, count))
+
+        def vectorized():
+            differentials(bars, out=out)
+            cumulative_returns(out[:, :, 0], out=cumulative, compound=False)
+
+        for name, func in [("differentials pandas, {} symbols".format(count),
+                            lambda: _pandas_differentials(frames)),
+                           ("differentials numpy, {} symbols".format(count),
+                            vectorized)]:
+            seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+            _report(name, seconds, steps * count)
+
+
+def benchmark_price_panel(steps=252, symbols=500, repeat=5):
+    """Compare aligning per symbol DataFrames (concat + backfill, as in the
+    analysis notebook) with align_candles on the structured arrays.
+
+    Arguments:
+        steps (int): Number of daily bars per symbol before dropping gaps.
+        symbols (int): Number of symbols.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    rng = np.random.default_rng(0)
+    histories = list()
+    for _ in range(symbols):
+        candles = synthetic_candles(steps, step=86400000)
+        keep = rng.random(steps) > 0.05
+        histories.append(decode_candles([candle for candle, kept
+                                         in zip(candles, keep) if kept],
+                                        as_frame=False))
+    names = ["SYM{}".format(i) for i in range(symbols)]
+
+    def frames():
+        frames = {name: candles_to_frame(history)
+                  for name, history in zip(names, histories)}
+        return pd.concat(frames, axis=1, sort=True).bfill()
+
+    for name, func in [("price panel via DataFrames", frames),
+                       ("align_candles", lambda: align_candles(names,
+                                                               histories))]:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        _report(name, seconds, steps * symbols)
+
+
+def benchmark_api(symbols=50, latency=0.002, error_rate=0., repeat=3):
+    """Time every public method of the client against a local ReplayServer:
+    single calls, bulk fan-out and response cache hits and misses.
+
+    Arguments:
+        symbols (int): Number of symbols of the watchlist and fan-outs.
+        latency (float): Seconds of latency injected per request.
+        error_rate (float): Fraction of requests answered with HTTP 429,
+        which the client retries.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    names = ["SYM{}".format(i) for i in range(symbols)]
+    directory = tempfile.mkdtemp(prefix="tdameritrade-cassette-")
+    cassette = synthetic_cassette(directory, names)
+    server = ReplayServer(cassette, latency=latency, error_rate=error_rate,
+                          error_status=429, seed=0).start()
+    tokens = TokenManager(access_token="token", refresh_token="refresh",
+                          client_id="APP@AMER.OAUTHAP", expires_in=1800,
+                          token_url=server.base_url + "oauth2/token")
+    client = offline_client(base_url=server.base_url,
+                            scheduler=RequestScheduler(rate=100000, per=1.,
+                                                       backoff=0.001),
+                            response_cache=ResponseCache(),
+                            token_manager=tokens)
+    start = date(2018, 1, 1)
+    orders = [(name, 30., 2, "BUY") for name in names]
+    calls = [("get_account_info", client.get_account_info, 1),
+             ("get_orders", client.get_orders, 1),
+             ("get_transactions", client.get_transactions, 1),
+             ("get_watchlists", client.get_watchlists, 1),
+             ("get_watchlist", client.get_watchlist, 1),
+             ("get_user_principals", client.get_user_principals, 1),
+             ("get_refresh_token", client.get_refresh_token, 1),
+             ("get_recent_orders", client.get_recent_orders, 1),
+             ("get_recent_transactions", client.get_recent_transactions, 2),
+             ("get_commission_free_etfs", client.get_commission_free_etfs, 1),
+             ("get_price_history", lambda: client.get_price_history(
+                 names[0]), 1),
+             ("get_quotes", lambda: client.get_quotes(names), 1),
+             ("create_saved_order", lambda: client.create_saved_order(
+                 *orders[0]), 1),
+             ("place_order", lambda: client.place_order(*orders[0]), 1),
+             ("iter_orders, 6 windows", lambda: list(client.iter_orders(
+                 start, start.replace(month=6, day=29))), 6),
+             ("iter_transactions, 6 windows", lambda: list(
+                 client.iter_transactions(start, start.replace(
+                     month=6, day=29))), 6),
+             ("bulk get_price_history", lambda: client.bulk(
+                 "get_price_history", [{"symbol": name} for name in names]),
+              symbols),
+             ("get_price_panel", lambda: client.get_price_panel(names),
+              symbols),
+             ("get_quotes, chunks of 10", lambda: client.get_quotes(
+                 names, max_symbols=10), -(-symbols // 10)),
+             ("place_orders", lambda: client.place_orders(orders), symbols)]
+    try:
+        print("API against ReplayServer, {:.1f} ms latency, {:.0%} errors"
+              .format(latency * 1e3, error_rate))
+        for name, func, count in calls:
+            def miss(func=func):
+                client.response_cache.invalidate()
+                func()
+            seconds = min(timeit.repeat(miss, number=1, repeat=repeat))
+            _report(name, seconds, count)
+        for name, func in [("get_account_info (cache hit)",
+                            client.get_account_info),
+                           ("get_watchlist (cache hit)",
+                            client.get_watchlist)]:
+            func()
+            seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+            _report(name, seconds, 1)
+    finally:
+        tokens.stop()
+        client.transport.close()
+        server.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_backtest(steps=252, symbols=500, repeat=3):
+    """Time a parameter sweep of the example strategy on one process and on
+    a process pool sharing the bars (one process per CPU). The name of the
+    pool benchmark does not include the number of processes, so results of
+    machines with different CPU counts compare against the same baseline;
+    the number is printed apart.
+
+    Arguments:
+        steps (int): Number of bars per symbol.
+        symbols (int): Number of symbols.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    engine = Backtest(synthetic_bars(steps, symbols),
+                      ["SYM{}".format(i) for i in range(symbols)])
+    grid = [{"window": window, "threshold": threshold}
+            for window in (5, 10, 20, 50) for threshold in (0.005, 0.01, 0.02)]
+    print("process pool: {} processes".format(os.cpu_count()))
+    for name, func in [("backtest sweep, 1 process",
+                        lambda: [engine.run(mean_reversion, **params)
+                                 for params in grid]),
+                       ("backtest sweep, process pool",
+                        lambda: engine.sweep(mean_reversion, grid))]:
+        seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+        _report(name, seconds, len(grid))
+
+
+def benchmark_aggregator(symbols=500, snapshots=600, repeat=3):
+    """Time folding get_quotes snapshots of many symbols into 1 and 5
+    minute bars, one snapshot per second.
+
+    Arguments:
+        symbols (int): Number of symbols per snapshot.
+        snapshots (int): Number of snapshots.
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    names = ["SYM{}".format(i) for i in range(symbols)]
+    rng = np.random.default_rng(0)
+    prices = 100. + np.cumsum(rng.normal(0., 0.01, (snapshots, symbols)),
+                              axis=0)
+    volumes = np.cumsum(rng.integers(0, 100, (snapshots, symbols)), axis=0)
+    quotes = [{name: {"lastPrice": float(price), "totalVolume": int(volume)}
+               for name, price, volume in zip(names, row, volume_row)}
+              for row, volume_row in zip(prices, volumes)]
+    start = 1514764800000
+
+    def aggregate():
+        bars = BarAggregator(names, frequencies=(60, 300))
+        for i, snapshot in enumerate(quotes):
+            bars.update_quotes(snapshot, start + i * 1000)
+        return bars
+
+    seconds = min(timeit.repeat(aggregate, number=1, repeat=repeat))
+    _report("aggregate quote snapshots", seconds, snapshots * symbols)
+
+
+def benchmark_startup(repeat=5):
+    """Time the startup of short-lived scripts in fresh interpreters: an
+    order-only script importing tdameritrade and creating a client with a
+    ResponseCache, which must not load NumPy or pandas, against one also
+    loading pandas.
+
+    Arguments:
+        repeat (int): Number of repeats, the best time is reported.
+    """
+    directory = tempfile.mkdtemp(prefix="tdameritrade-startup-")
+    try:
+        for name, value in (("account_no.txt", ACCOUNT_NO),
+                            ("oAuth_hash.txt", "token")):
+            with open(os.path.join(directory, name), mode='w') as file_obj:
+                file_obj.write(value + "\n")
+        client = ("import sys, tdameritrade\n"
+                  "from cache import ResponseCache\n"
+                  "tdameritrade.TDAmeritrade('account_no.txt', "
+                  "'oAuth_hash.txt', response_cache=ResponseCache())\n"
+                  "assert 'numpy' not in sys.modules\n")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.abspath(__file__)))
+        for name, script in [("startup, interpreter", "pass"),
+                             ("startup, order-only client", client),
+                             ("startup, client and pandas",
+                              client + "import pandas\n")]:
+            seconds = min(timeit.repeat(
+                lambda script=script: subprocess.run(
+                    [sys.executable, "-c", script], cwd=directory, env=env,
+                    check=True),
+                number=1, repeat=repeat))
+            _report(name, seconds, 1)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def load_baseline(filename=BASELINE):
+    """Read the baseline {name: seconds}, empty if there is none.
+    """
+    if not os.path.exists(filename):
+        return dict()
+    with open(filename) as file_obj:
+        return json.load(file_obj)
+
+
+def save_baseline(results, filename=BASELINE):
+    """Write the results as the baseline. The file is replaced atomically.
+    """
+    tmp_filename = "{}.tmp".format(filename)
+    with open(tmp_filename, mode='w') as file_obj:
+        json.dump({name: round(seconds, 6) for name, seconds
+                   in sorted(results.items())}, file_obj, indent=1)
+    os.replace(tmp_filename, filename)
+
+
+def compare(results, baseline, tolerance=TOLERANCE, slack=SLACK):
+    """Get the benchmarks slower than their baseline by more than tolerance
+    (plus slack seconds). Benchmarks missing from the baseline are skipped.
+
+    Returns:
+        list of (name, seconds, baseline seconds) tuples.
+    """
+    return [(name, seconds, baseline[name])
+            for name, seconds in results.items()
+            if name in baseline
+            and seconds > baseline[name] * (1. + tolerance) + slack]
+
+
+def main(argv=None):
+    """Run every benchmark and compare the results with the baseline.
+
+    Returns:
+        int: Exit status, 1 if a benchmark regressed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="baseline file (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="relative slowdown reported as a regression "
+                        "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    benchmark_startup()
+    benchmark_decode_candles()
+    benchmark_order_serialization()
+    benchmark_differentials()
+    benchmark_price_panel()
+    benchmark_backtest()
+    benchmark_aggregator()
+    benchmark_api()
+
+    if args.save_baseline:
+        save_baseline(RESULTS, args.baseline)
+        print("Baseline saved to {}".format(args.baseline))
+        return 0
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print("No baseline in {}, nothing compared".format(args.baseline))
+        return 0
+    regressions = compare(RESULTS, baseline, args.tolerance)
+    for name, seconds, base in regressions:
+        print("REGRESSION {:<40s} {:10.2f} ms, baseline {:.2f} ms"
+              .format(name, seconds * 1e3, base * 1e3))
+    if not regressions:
+        print("{} benchmarks within {:.0%} of the baseline"
+              .format(len([name for name in RESULTS if name in baseline]),
+                      args.tolerance))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Module providing the caches used by the TDAmeritrade client.
+
+PriceHistoryCache is a persistent on-disk cache of price history. Each
+symbol/frequency/session (regular or extended hours) is stored as one NumPy
+.npy file holding a structured array of dtype tdameritrade.CANDLE_DTYPE.
+Files are opened memory-mapped, so loading a cached history is instant and
+only touched pages are read.
+
+ResponseCache is a short lived in-memory TTL + LRU cache of GET responses
+for read-only endpoints such as watchlists and account information.
+
+NumPy is only imported by the price history functions, so a client using
+the ResponseCache alone starts without it.
+
+Classes:
+    PriceHistoryCache
+    ResponseCache
+
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Days per period type, rounded up so the estimated start of a period is
+# never later than the one used by the API. A cached history is sliced from
+# this estimate, so it may start a few candles before the history the API
+# returns for the same period.
+PERIOD_DAYS = {"day": 1, "month": 31, "year": 366}
+# Days of allowance for weekends and holidays at the start of a period.
+START_SLACK_DAYS = 7
+# Seconds a response is cached per endpoint. Endpoints not listed are not
+# cached.
+DEFAULT_TTLS = {"watchlists": 3600., "account": 5., "orders": 5.,
+                "savedorders": 5., "transactions": 60.}
+
+
+def period_start(period_type, period, end_date):
+    """Estimate the first timestamp requested by a period.
+
+    Arguments:
+        period_type (str): day | month | year | ytd
+        period (int): Number of periods.
+        end_date (int): Epoch milliseconds of the end of the period.
+
+    Returns:
+        numpy.datetime64[ms]
+    """
+    import numpy as np
+    end = np.datetime64(int(end_date), "ms")
+    if period_type == "ytd":
+        return end.astype("datetime64[Y]").astype("datetime64[ms]")
+    days = int(period) * PERIOD_DAYS[period_type]
+    return end - np.timedelta64(days, "D").astype("timedelta64[ms]")
+
+
+class PriceHistoryCache:
+    """Columnar on-disk price history cache keyed on symbol, frequency type,
+    frequency and extended hours.
+
+    Class variables
+        directory (str): Directory holding the cache files.
+
+    Example:
+    >>cache = PriceHistoryCache("price_history")
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt", price_cache=cache)
+    >>td.get_price_history(symbol="SPYG", period=6)
+    """
+    def __init__(self, directory="price_history"):
+        """Create the cache directory if needed.
+
+        Arguments:
+            directory (str): Directory holding the cache files.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._locks = dict()
+        self._locks_lock = threading.Lock()
+
+    def path(self, symbol, frequency_type, frequency, extended_hours="true"):
+        """Get the file name of a cache entry.
+        """
+        session = "ext" if str(extended_hours).lower() == "true" else "reg"
+        name = "{}_{}_{}_{}.npy".format(symbol, frequency_type, frequency,
+                                        session)
+        return os.path.join(self.directory, name.replace("/", "-"))
+
+    def lock(self, symbol, frequency_type, frequency, extended_hours="true"):
+        """Get the lock guarding a cache entry, so that concurrent refreshes
+        of the same symbol do not race.
+        """
+        key = self.path(symbol, frequency_type, frequency, extended_hours)
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, symbol, frequency_type, frequency, extended_hours="true"):
+        """Load a cache entry memory-mapped. Returns None if the entry does
+        not exist.
+        """
+        path = self.path(symbol, frequency_type, frequency, extended_hours)
+        if not os.path.exists(path):
+            return None
+        import numpy as np
+        return np.load(path, mmap_mode="r")
+
+    def store(self, symbol, frequency_type, frequency, data,
+              extended_hours="true"):
+        """Write a cache entry. The file is replaced atomically.
+
+        Arguments:
+            data (numpy.ndarray): Structured array of dtype CANDLE_DTYPE.
+        """
+        path = self.path(symbol, frequency_type, frequency, extended_hours)
+        tmp_path = "{}.tmp.npy".format(path[:-4])
+        import numpy as np
+        np.save(tmp_path, np.ascontiguousarray(data))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def merge(cached, tail):
+        """Merge newly fetched candles into the cached ones. Cached candles
+        at or after the first new candle are replaced, as the last cached
+        bar may have been incomplete.
+
+        Arguments:
+            cached (numpy.ndarray): Cached candles sorted by datetime.
+            tail (numpy.ndarray): New candles sorted by datetime.
+        """
+        import numpy as np
+        if len(tail) == 0:
+            return np.array(cached)
+        keep = np.searchsorted(cached["datetime"], tail["datetime"][0])
+        return np.concatenate([cached[:keep], tail])
+
+    def clear(self, symbol, frequency_type, frequency, extended_hours="true"):
+        """Remove a cache entry.
+        """
+        path = self.path(symbol, frequency_type, frequency, extended_hours)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class ResponseCache:
+    """In-memory TTL + LRU cache of decoded GET responses. Cached responses
+    are shared between callers and must be treated as read-only.
+
+    Class variables
+        ttls (dict): Seconds a response is cached, keyed by endpoint name.
+        maxsize (int): Maximum number of cached responses.
+
+    Example:
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt",
+    >>                  response_cache=ResponseCache())
+    >>td.get_commission_free_etfs()
+    >>td.response_cache.stats()
+    """
+    def __init__(self, ttls=None, maxsize=256):
+        """Create an empty cache.
+
+        Arguments:
+            ttls (dict) optional: Seconds a response is cached, keyed by
+            endpoint name. Defaults to DEFAULT_TTLS.
+            maxsize (int) optional: Maximum number of cached responses.
+        """
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._hits = dict()
+        self._misses = dict()
+        self._lock = threading.Lock()
+
+    def cacheable(self, endpoint):
+        """Check whether responses of an endpoint are cached.
+        """
+        return self.ttls.get(endpoint, 0.) > 0.
+
+    def get(self, endpoint, key):
+        """Get a cached response.
+
+        Arguments:
+            endpoint (str): Endpoint name.
+            key (str): Request url.
+
+        Returns:
+            (bool, object): Whether the response was found and the response.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._hits[endpoint] = self._hits.get(endpoint, 0) + 1
+                return True, entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self._misses[endpoint] = self._misses.get(endpoint, 0) + 1
+            return False, None
+
+    def put(self, endpoint, key, value):
+        """Cache a response for the TTL of its endpoint. The least recently
+        used response is evicted when the cache is full.
+        """
+        expires = time.monotonic() + self.ttls.get(endpoint, 0.)
+        with self._lock:
+            self._entries[key] = (endpoint, expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, endpoints=None):
+        """Drop cached responses.
+
+        Arguments:
+            endpoints (iterable) optional: Endpoint names to drop. Drops
+            everything if None.
+        """
+        with self._lock:
+            if endpoints is None:
+                self._entries.clear()
+                return
+            endpoints = set(endpoints)
+            for key in [key for key, entry in self._entries.items()
+                        if entry[0] in endpoints]:
+                del self._entries[key]
+
+    def stats(self):
+        """Get the hit and miss counters per endpoint.
+
+        Returns:
+            dict: {"size": int, "hits": {endpoint: int},
+            "misses": {endpoint: int}}
+        """
+        with self._lock:
+            return {"size": len(self._entries), "hits": dict(self._hits),
+                    "misses": dict(self._misses)}
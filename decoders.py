@@ -0,0 +1,168 @@
+"""
+Module providing the JSON decoding path of the TDAmeritrade client.
+
+get_decoder picks the fastest JSON library installed (orjson, then ujson,
+then the standard library). Every decoder takes the response body as bytes,
+so no intermediate str copy of the payload is made.
+
+CandleStreamParser parses the candles array of a pricehistory response
+incrementally as the body is read from the socket. The candles are written
+into a preallocated NumPy buffer chunk by chunk, so neither the full body nor
+the full list of candle dicts is held in memory.
+
+Example:
+>>decode = get_decoder()
+>>decode(b'{"symbol": "SPYG"}')
+
+Classes:
+    CandleStreamParser
+
+"""
+import json
+import operator
+
+
+DECODERS = ("orjson", "ujson", "json")
+
+
+def _load(name):
+    """Get the bytes -> object function of a JSON library, None if the
+    library is not installed.
+    """
+    if name == "json":
+        return json.loads
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def get_decoder(name=None):
+    """Get a JSON decoder taking bytes.
+
+    Arguments:
+        name (str) optional: orjson | ujson | json. The first installed
+        library of DECODERS if None.
+
+    Returns:
+        callable
+    """
+    if name is not None:
+        decoder = _load(name)
+        if decoder is None:
+            raise ImportError("JSON decoder {} is not installed".format(name))
+        return decoder
+    for name in DECODERS:
+        decoder = _load(name)
+        if decoder is not None:
+            return decoder
+    return json.loads
+
+
+class CandleStreamParser:
+    """Incremental parser of the candles array of a pricehistory response.
+
+    The candles are flat JSON objects, so every complete object in a chunk
+    ends at a closing brace and the first closing bracket ends the array.
+    The complete objects of a chunk are decoded in one call and appended to
+    the buffer; the incomplete tail is kept for the next chunk.
+
+    Class variables
+        dtype (np.dtype): Dtype of the buffer.
+        fields (tuple): Candle keys, in the order of the dtype fields.
+        decoder (callable): JSON decoder taking bytes.
+        count (int): Number of candles parsed so far.
+        done (bool): Whether the end of the candles array was reached.
+
+    Example:
+    >>parser = CandleStreamParser(dtype, ("datetime", "open", "high", "low",
+    >>                                    "close", "volume"))
+    >>for chunk in response.iter_content():
+    >>    parser.feed(chunk)
+    >>data = parser.result()
+    """
+    def __init__(self, dtype, fields, capacity=1024, decoder=None):
+        """Preallocate the buffer.
+
+        Arguments:
+            dtype (np.dtype): Structured dtype of the buffer.
+            fields (tuple): Candle keys, in the order of the dtype fields.
+            capacity (int) optional: Initial number of candles the buffer
+            holds. The buffer doubles when full.
+            decoder (callable) optional: JSON decoder taking bytes.
+        """
+        import numpy as np
+        self.dtype = np.dtype(dtype)
+        self.fields = tuple(fields)
+        self.decoder = get_decoder() if decoder is None else decoder
+        self.count = 0
+        self.done = False
+        self._getter = operator.itemgetter(*self.fields)
+        self._buffer = np.empty(max(capacity, 1), dtype=self.dtype)
+        self._pending = b""
+        self._in_array = False
+
+    def _reserve(self, count):
+        """Grow the buffer to hold count more candles.
+        """
+        needed = self.count + count
+        if needed <= len(self._buffer):
+            return
+        import numpy as np
+        size = len(self._buffer)
+        while size < needed:
+            size *= 2
+        buffer = np.empty(size, dtype=self.dtype)
+        buffer[:self.count] = self._buffer[:self.count]
+        self._buffer = buffer
+
+    def _append(self, segment):
+        """Decode a run of complete candle objects into the buffer.
+        """
+        segment = segment.strip(b", \t\r\n")
+        if not segment:
+            return
+        import numpy as np
+        candles = self.decoder(b"[" + segment + b"]")
+        self._reserve(len(candles))
+        self._buffer[self.count:self.count + len(candles)] = np.fromiter(
+            map(self._getter, candles), dtype=self.dtype, count=len(candles))
+        self.count += len(candles)
+
+    def feed(self, chunk):
+        """Parse a chunk of the response body.
+
+        Arguments:
+            chunk (bytes): Next bytes of the body.
+        """
+        if self.done:
+            return
+        data = self._pending + chunk
+        if not self._in_array:
+            key = data.find(b'"candles"')
+            start = data.find(b"[", key) if key >= 0 else -1
+            if start < 0:
+                # Keep enough of the tail to match a key split over chunks.
+                self._pending = data if key >= 0 else data[-16:]
+                return
+            self._in_array = True
+            data = data[start + 1:]
+        # Candles hold no brackets, the first one closes the array.
+        close = data.find(b"]")
+        if close >= 0:
+            self._append(data[:close])
+            self._pending = b""
+            self.done = True
+            return
+        end = data.rfind(b"}")
+        self._append(data[:end + 1])
+        self._pending = data[end + 1:]
+
+    def result(self):
+        """Get the parsed candles.
+
+        Returns:
+            NumPy structured array of dtype dtype (a view of the buffer).
+        """
+        return self._buffer[:self.count]
@@ -0,0 +1,222 @@
+"""
+Module providing a persistent index of the last fill per symbol, to
+enforce the 30 day hold of the commission free ETFs (and wash sale windows)
+inline in an order loop.
+
+The index keeps the day of the last buy and of the last sell fill of every
+symbol, so "can I trade X today?" and "when can I trade X?" are a dict
+lookup and a comparison. Fills are merged in incrementally from orders or
+transactions; keeping the latest day makes merging the same fill twice
+harmless, so overlapping syncs need no de-duplication. The index is saved
+to a JSON file and only the orders entered since the last sync, or since
+the oldest order still open at the last sync if it is older, are fetched.
+
+Example:
+>>holds = HoldIndex("holds.json")
+>>holds.sync(td)
+>>[sym for sym in td.get_commission_free_etfs() if holds.can_trade(sym)]
+
+Classes:
+    HoldIndex
+
+"""
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+from models import Order, Transaction
+from state import TERMINAL_STATUSES
+
+
+HOLD_DAYS = 30
+# Days fetched before the last sync, for fills reported late.
+SYNC_OVERLAP = 1
+BUY, SELL = 0, 1
+
+
+def _side(instruction):
+    """Get the side (BUY | SELL) of an order or transaction instruction.
+    """
+    return BUY if instruction.startswith("BUY") else SELL
+
+
+def _day(timestamp):
+    """Get the day of an API timestamp, e.g. 2018-07-02T14:30:00+0000.
+    """
+    return date.fromisoformat(timestamp[:10])
+
+
+class HoldIndex:
+    """Day of the last buy and sell fill per symbol.
+
+    Class variables
+        filename (str): JSON file the index is saved to, None to keep it in
+        memory only.
+        hold_days (int): Number of days a symbol is held after a fill.
+        synced (datetime.date): Day of the last sync.
+        open_since (datetime.date): Day the oldest order still open at the
+        last sync was entered, None if there was none. It may fill later, so
+        the next sync fetches the orders from this day.
+    """
+    def __init__(self, filename=None, hold_days=HOLD_DAYS):
+        """Load the index from filename if it exists.
+
+        Arguments:
+            filename (str) optional: JSON file of the index.
+            hold_days (int) optional: Number of days a symbol is held after
+            a fill.
+        """
+        self.filename = filename
+        self.hold_days = hold_days
+        self.synced = None
+        self.open_since = None
+        self._fills = dict()
+        self._lock = threading.Lock()
+        if filename is not None and os.path.exists(filename):
+            self.load()
+
+    def __len__(self):
+        return len(self._fills)
+
+    def load(self):
+        """Read the index from filename.
+        """
+        with open(self.filename) as file_obj:
+            data = json.load(file_obj)
+        with self._lock:
+            self.synced = (date.fromordinal(data["synced"])
+                           if data.get("synced") else None)
+            self.open_since = (date.fromordinal(data["open_since"])
+                               if data.get("open_since") else None)
+            self._fills = {symbol: list(days)
+                           for symbol, days in data["fills"].items()}
+
+    def save(self):
+        """Write the index to filename. The file is replaced atomically.
+        """
+        if self.filename is None:
+            return
+        with self._lock:
+            data = {"synced": self.synced.toordinal() if self.synced else None,
+                    "open_since": (self.open_since.toordinal()
+                                   if self.open_since else None),
+                    "fills": self._fills}
+            tmp_filename = "{}.tmp".format(self.filename)
+            with open(tmp_filename, mode='w') as file_obj:
+                json.dump(data, file_obj)
+        os.replace(tmp_filename, self.filename)
+
+    def add_fill(self, symbol, day, instruction):
+        """Merge a fill into the index.
+
+        Arguments:
+            symbol (str): Symbol filled.
+            day (datetime.date): Day of the fill.
+            instruction (str): BUY | SELL | BUY_TO_COVER | ...
+        """
+        ordinal = day.toordinal()
+        side = _side(instruction)
+        with self._lock:
+            days = self._fills.get(symbol)
+            if days is None:
+                days = self._fills[symbol] = [0, 0]
+            if ordinal > days[side]:
+                days[side] = ordinal
+
+    def add_orders(self, orders):
+        """Merge the filled orders (decoded get_orders response or
+        models.Order) into the index. The fill day is the close time of the
+        order, every leg counts.
+        """
+        for order in orders:
+            if not isinstance(order, Order):
+                order = Order.from_json(order)
+            if not order.filled_quantity:
+                continue
+            day = _day(order.close_time or order.entered_time)
+            for leg in order.legs:
+                if leg.symbol is not None and leg.instruction is not None:
+                    self.add_fill(leg.symbol, day, leg.instruction)
+
+    def add_transactions(self, transactions):
+        """Merge trade transactions (decoded get_transactions response or
+        models.Transaction) into the index.
+        """
+        for transaction in transactions:
+            if not isinstance(transaction, Transaction):
+                transaction = Transaction.from_json(transaction)
+            if transaction.symbol is None or transaction.instruction is None:
+                continue
+            self.add_fill(transaction.symbol, _day(transaction.date),
+                          transaction.instruction)
+
+    def sync(self, client, lookback=HOLD_DAYS + 5):
+        """Fetch the orders entered since the last sync, or since the
+        oldest order still open at the last sync (GTC orders, orders
+        partially filled), merge their fills and save the index. Every status
+        is fetched, as orders partially filled and then CANCELED or EXPIRED
+        have fills too. The first sync fetches lookback days.
+
+        Arguments:
+            client (TDAmeritrade): Client of the account.
+            lookback (int) optional: Days fetched by the first sync.
+        """
+        today = date.today()
+        if self.synced is None:
+            start = today - timedelta(lookback)
+        else:
+            start = min(self.synced - timedelta(SYNC_OVERLAP), today)
+        if self.open_since is not None and self.open_since < start:
+            start = self.open_since
+        orders = list(client.iter_orders(start, today, order_status=None,
+                                         as_models=True))
+        self.add_orders(orders)
+        days = [_day(order.entered_time) for order in orders
+                if order.entered_time
+                and order.status not in TERMINAL_STATUSES]
+        self.open_since = min(days) if days else None
+        self.synced = today
+        self.save()
+
+    def last_fill(self, symbol, instruction=None):
+        """Get the day of the last fill of a symbol, None if there is none.
+
+        Arguments:
+            symbol (str): Symbol.
+            instruction (str) optional: Only fills of this side (BUY | SELL).
+            Any side if None.
+        """
+        days = self._fills.get(symbol)
+        if days is None:
+            return None
+        ordinal = days[_side(instruction)] if instruction else max(days)
+        return date.fromordinal(ordinal) if ordinal else None
+
+    def eligible_date(self, symbol, instruction=None):
+        """Get the first day a symbol can be traded again, hold_days after
+        its last fill. None if it is not held.
+
+        Arguments:
+            symbol (str): Symbol.
+            instruction (str) optional: Only count fills of this side, e.g.
+            BUY for the hold before selling what was bought.
+        """
+        last = self.last_fill(symbol, instruction)
+        if last is None:
+            return None
+        return last + timedelta(self.hold_days)
+
+    def can_trade(self, symbol, day=None, instruction=None):
+        """Whether a symbol is out of its hold on a day.
+
+        Arguments:
+            symbol (str): Symbol.
+            day (datetime.date) optional: Day of the trade. Defaults to
+            today.
+            instruction (str) optional: Only count fills of this side.
+        """
+        eligible = self.eligible_date(symbol, instruction)
+        if eligible is None:
+            return True
+        return (date.today() if day is None else day) >= eligible
@@ -0,0 +1,188 @@
+"""
+Module providing request latency instrumentation for the TDAmeritrade
+client.
+
+Every request is broken down into phases, each recorded in a histogram per
+endpoint:
+    connect: DNS lookup, TCP connect and TLS handshake (new connections only)
+    ttfb: Time from sending the request to the response headers
+    download: Reading the response body
+    decode: JSON decoding of the body
+    total: Whole request, including retries and decoding
+Counters keep the number of requests, errors and bytes sent/received per
+endpoint. The metrics can be read in-process (snapshot) or exported in the
+Prometheus text exposition format (to_prometheus).
+
+Classes:
+    Histogram
+    Metrics
+
+"""
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5,
+                   5., 10.)
+COUNTERS = ("requests", "errors", "request_bytes", "response_bytes")
+
+
+class Histogram:
+    """Fixed bucket histogram.
+
+    Class variables
+        buckets (tuple): Upper bounds of the buckets in seconds.
+        counts (list): Observations per bucket, the last one is +Inf.
+        sum (float): Sum of the observations.
+        count (int): Number of observations.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        """Add an observation.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """Get the histogram as a dict with cumulative bucket counts.
+        """
+        cumulative = list()
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {"buckets": dict(zip(self.buckets + (float("inf"),),
+                                    cumulative)),
+                "sum": self.sum, "count": self.count,
+                "mean": self.sum / self.count if self.count else 0.}
+
+
+class Metrics:
+    """Per endpoint request timing histograms and counters.
+
+    Example:
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt")
+    >>td.get_quotes(["SPYG", "SPYV"])
+    >>td.metrics.snapshot()["histograms"]["quotes"]["ttfb"]
+    >>print(td.metrics.to_prometheus())
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Create empty metrics.
+
+        Arguments:
+            buckets (tuple) optional: Upper bounds of the histogram buckets
+            in seconds.
+        """
+        self.buckets = tuple(buckets)
+        self._histograms = dict()
+        self._counters = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, phase, seconds):
+        """Record the duration of a request phase.
+
+        Arguments:
+            endpoint (str): Endpoint name.
+            phase (str): connect | ttfb | download | decode | total
+            seconds (float): Duration.
+        """
+        key = (endpoint, phase)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, endpoint, name, value=1):
+        """Increment a counter.
+
+        Arguments:
+            endpoint (str): Endpoint name.
+            name (str): requests | errors | request_bytes | response_bytes
+            value (int): Increment.
+        """
+        key = (endpoint, name)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_response(self, endpoint, response):
+        """Record the transport timings, byte counts and status of a
+        response.
+
+        Arguments:
+            endpoint (str): Endpoint name.
+            response (transport.Response): Response of the request.
+        """
+        for phase, seconds in response.timings.items():
+            self.observe(endpoint, phase, seconds)
+        self.count(endpoint, "requests")
+        self.count(endpoint, "request_bytes", response.bytes_sent)
+        self.count(endpoint, "response_bytes", response.bytes_received)
+        if response.status >= 400:
+            self.count(endpoint, "errors")
+
+    def reset(self):
+        """Drop every recorded metric.
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """Get the metrics.
+
+        Returns:
+            dict: {"histograms": {endpoint: {phase: histogram dict}},
+            "counters": {endpoint: {counter: int}}, "error_rate":
+            {endpoint: float}}
+        """
+        with self._lock:
+            histograms = dict()
+            for (endpoint, phase), histogram in self._histograms.items():
+                histograms.setdefault(endpoint, dict())[phase] = \
+                    histogram.snapshot()
+            counters = dict()
+            for (endpoint, name), value in self._counters.items():
+                counters.setdefault(endpoint, dict())[name] = value
+        error_rate = {endpoint: values.get("errors", 0)
+                      / max(values.get("requests", 0), 1)
+                      for endpoint, values in counters.items()}
+        return {"histograms": histograms, "counters": counters,
+                "error_rate": error_rate}
+
+    def to_prometheus(self, prefix="tdameritrade"):
+        """Export the metrics in the Prometheus text exposition format.
+
+        Arguments:
+            prefix (str) optional: Metric name prefix.
+        """
+        snapshot = self.snapshot()
+        name = "{}_request_phase_seconds".format(prefix)
+        lines = ["# HELP {} Duration of the request phases.".format(name),
+                 "# TYPE {} histogram".format(name)]
+        for endpoint, phases in sorted(snapshot["histograms"].items()):
+            for phase, histogram in sorted(phases.items()):
+                labels = 'endpoint="{}",phase="{}"'.format(endpoint, phase)
+                for bound, count in histogram["buckets"].items():
+                    bound = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('{}_bucket{{{},le="{}"}} {}'
+                                 .format(name, labels, bound, count))
+                lines.append("{}_sum{{{}}} {!r}"
+                             .format(name, labels, histogram["sum"]))
+                lines.append("{}_count{{{}}} {}"
+                             .format(name, labels, histogram["count"]))
+        for counter in COUNTERS:
+            name = "{}_{}_total".format(prefix, counter)
+            lines.append("# TYPE {} counter".format(name))
+            for endpoint, values in sorted(snapshot["counters"].items()):
+                lines.append('{}{{endpoint="{}"}} {}'
+                             .format(name, endpoint, values.get(counter, 0)))
+        return "\n".join(lines) + "\n"
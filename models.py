@@ -0,0 +1,197 @@
+"""
+Module providing compact record types for the TDAmeritrade API responses.
+
+The records use __slots__ and only keep the fields that are used, so tens of
+thousands of them take a fraction of the memory of the decoded JSON dicts
+and give fast attribute access. The fields are extracted when a record is
+created and no reference to the JSON object is kept. Nested collections
+that are rarely needed (e.g. the legs of an order) are kept as plain tuples
+of their fields and only wrapped into records on first access.
+
+Example:
+>>orders = [Order.from_json(order) for order in td.get_orders()]
+>>orders[0].symbol
+
+Classes:
+    Record
+    OrderLeg
+    Order
+    Transaction
+    Position
+    Quote
+    Candle
+
+"""
+
+
+def _lookup(obj, path):
+    """Get a nested value, None if any key along the path is missing.
+
+    Arguments:
+        obj (dict): Decoded JSON object.
+        path (tuple): Keys (str) and list indices (int) to follow.
+    """
+    for key in path:
+        try:
+            obj = obj[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return obj
+
+
+class Record:
+    """Base class of the records. Subclasses list their attributes in
+    FIELDS as (attribute, path) pairs, path being the keys leading to the
+    value in the JSON object.
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, *args, **kwargs):
+        """Set the attributes in FIELDS order, missing ones are None.
+        """
+        names = [name for name, _ in self.FIELDS]
+        values = dict(zip(names, args))
+        values.update(kwargs)
+        for name in names:
+            setattr(self, name, values.get(name))
+
+    @classmethod
+    def from_json(cls, obj):
+        """Create a record from a decoded JSON object.
+        """
+        return cls(*[_lookup(obj, path) for _, path in cls.FIELDS])
+
+    def as_dict(self):
+        """Get the fields as a dict.
+        """
+        return {name: getattr(self, name) for name, _ in self.FIELDS}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            "{}={!r}".format(name, getattr(self, name))
+            for name, _ in self.FIELDS))
+
+
+class OrderLeg(Record):
+    """Leg of an order.
+    """
+    FIELDS = (("instruction", ("instruction",)),
+              ("quantity", ("quantity",)),
+              ("symbol", ("instrument", "symbol")),
+              ("asset_type", ("instrument", "assetType")))
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+class Order(Record):
+    """Order as returned by get_orders. The symbol and instruction are
+    those of the first leg. The legs are kept as tuples of the OrderLeg
+    fields and wrapped into OrderLeg records on first access of legs.
+    """
+    FIELDS = (("order_id", ("orderId",)),
+              ("account_id", ("accountId",)),
+              ("status", ("status",)),
+              ("order_type", ("orderType",)),
+              ("entered_time", ("enteredTime",)),
+              ("close_time", ("closeTime",)),
+              ("price", ("price",)),
+              ("quantity", ("quantity",)),
+              ("filled_quantity", ("filledQuantity",)),
+              ("symbol", ("orderLegCollection", 0, "instrument", "symbol")),
+              ("instruction", ("orderLegCollection", 0, "instruction")))
+    __slots__ = tuple(name for name, _ in FIELDS) + ("_legs",)
+
+    def __init__(self, *args, legs=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._legs = legs
+
+    @classmethod
+    def from_json(cls, obj):
+        """Create an order from a decoded JSON object. Only the OrderLeg
+        fields of the legs are kept, as tuples.
+        """
+        order = super().from_json(obj)
+        legs = obj.get("orderLegCollection")
+        if legs:
+            order._legs = tuple(tuple(_lookup(leg, path)
+                                      for _, path in OrderLeg.FIELDS)
+                                for leg in legs)
+        return order
+
+    @property
+    def legs(self):
+        """Legs of the order (tuple of OrderLeg).
+        """
+        legs = self._legs
+        if not legs:
+            return tuple()
+        if not isinstance(legs[0], OrderLeg):
+            legs = tuple(OrderLeg(*values) for values in legs)
+            self._legs = legs
+        return legs
+
+
+class Transaction(Record):
+    """Transaction as returned by get_transactions.
+    """
+    FIELDS = (("transaction_id", ("transactionId",)),
+              ("type", ("type",)),
+              ("date", ("transactionDate",)),
+              ("settlement_date", ("settlementDate",)),
+              ("net_amount", ("netAmount",)),
+              ("symbol", ("transactionItem", "instrument", "symbol")),
+              ("instruction", ("transactionItem", "instruction")),
+              ("amount", ("transactionItem", "amount")),
+              ("price", ("transactionItem", "price")),
+              ("commission", ("fees", "commission")),
+              ("account_id", ("accountId",)))
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+class Position(Record):
+    """Position from the positions field of get_account_info.
+    """
+    FIELDS = (("symbol", ("instrument", "symbol")),
+              ("asset_type", ("instrument", "assetType")),
+              ("long_quantity", ("longQuantity",)),
+              ("short_quantity", ("shortQuantity",)),
+              ("average_price", ("averagePrice",)),
+              ("market_value", ("marketValue",)),
+              ("account_id", ("accountId",)))
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+    @property
+    def quantity(self):
+        """Net quantity (long - short).
+        """
+        return (self.long_quantity or 0) - (self.short_quantity or 0)
+
+
+class Quote(Record):
+    """Quote as returned by get_quotes(as_frame=False).
+    """
+    FIELDS = (("symbol", ("symbol",)),
+              ("bid", ("bidPrice",)),
+              ("ask", ("askPrice",)),
+              ("last", ("lastPrice",)),
+              ("volume", ("totalVolume",)),
+              ("quote_time", ("quoteTimeInLong",)))
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+class Candle(Record):
+    """Candle of a pricehistory response. datetime is in epoch
+    milliseconds.
+    """
+    FIELDS = (("datetime", ("datetime",)),
+              ("open", ("open",)),
+              ("high", ("high",)),
+              ("low", ("low",)),
+              ("close", ("close",)),
+              ("volume", ("volume",)))
+    __slots__ = tuple(name for name, _ in FIELDS)
@@ -0,0 +1,105 @@
+"""
+Module providing pre-compiled order payload templates.
+
+The JSON text of an order is compiled once per order shape. Serializing an
+order then only formats the variable fields (symbol, price, quantity and
+instruction) into the template, instead of building the nested dict and
+JSON encoding it for every order. The output is byte for byte what
+json.dumps produces for the equivalent dict.
+
+Example:
+>>LIMIT_ORDER.render("SPYV", 30.16, 2, "BUY")
+
+Classes:
+    OrderTemplate
+
+"""
+import json
+from json.encoder import encode_basestring_ascii
+
+
+FIELDS = ("price", "instruction", "quantity", "symbol")
+
+
+def _dump(value):
+    """JSON encode a scalar, with fast paths for the common types.
+    """
+    kind = type(value)
+    if kind is str:
+        return encode_basestring_ascii(value)
+    if kind is int or (kind is float and value - value == 0.):
+        return repr(value)
+    return json.dumps(value)
+
+
+class OrderTemplate:
+    """Single leg order payload template.
+
+    Class variables
+        order_type (str): LIMIT | MARKET | ...
+        session (str): NORMAL | AM | PM | SEAMLESS
+        duration (str): DAY | GOOD_TILL_CANCEL | FILL_OR_KILL
+        order_strategy_type (str): SINGLE | ...
+        asset_type (str): EQUITY | ...
+    """
+    def __init__(self, order_type="LIMIT", session="NORMAL", duration="DAY",
+                 order_strategy_type="SINGLE", asset_type="EQUITY"):
+        """Compile the template.
+        """
+        self.order_type = order_type
+        self.session = session
+        self.duration = duration
+        self.order_strategy_type = order_strategy_type
+        self.asset_type = asset_type
+        marks = {field: "@@{}@@".format(field) for field in FIELDS}
+        text = json.dumps(self.build(**marks)).replace("%", "%%")
+        for field, mark in marks.items():
+            text = text.replace(json.dumps(mark), "%({})s".format(field))
+        self._template = text
+
+    def build(self, symbol=None, price=None, quantity=0, instruction=None):
+        """Build the order as a dict.
+
+        Arguments:
+            symbol (str): Symbol to trade.
+            price (float): Limit price.
+            quantity (int): Number of shares.
+            instruction (str): "BUY" | "SELL"
+        """
+        return {
+            "orderType": self.order_type,
+            "session": self.session,
+            "price": price,
+            "duration": self.duration,
+            "orderStrategyType": self.order_strategy_type,
+            "orderLegCollection": [
+                {
+                    "instruction": instruction,
+                    "quantity": quantity,
+                    "instrument": {
+                        "symbol": symbol,
+                        "assetType": self.asset_type
+                    }
+                }
+            ]
+        }
+
+    def render(self, symbol=None, price=None, quantity=0, instruction=None):
+        """Serialize the order into the JSON encoded request body.
+
+        Arguments:
+            symbol (str): Symbol to trade.
+            price (float): Limit price.
+            quantity (int): Number of shares.
+            instruction (str): "BUY" | "SELL"
+
+        Returns:
+            bytes
+        """
+        return (self._template % {"price": _dump(price),
+                                  "instruction": _dump(instruction),
+                                  "quantity": _dump(quantity),
+                                  "symbol": _dump(symbol)}).encode("utf-8")
+
+
+LIMIT_ORDER = OrderTemplate()
@@ -0,0 +1,617 @@
+"""
+Module providing record/replay fixtures to run the TDAmeritrade client
+without credentials or network access.
+
+Responses of the live API are recorded once into a Cassette directory (one
+JSON file per request) by wrapping the transport in a RecordingTransport.
+They are replayed either in-process by a ReplayTransport, or over HTTP by a
+ReplayServer, a local stand-in of the API that exercises the real
+HTTPTransport (keep-alive pool, gzip). Both inject a configurable latency
+and error rate.
+
+Streamer messages are recorded into a frame file (one message per line) and
+replayed by a StreamerReplayServer, a local WebSocket stand-in of the
+streamer that exercises streaming.WebSocket and TDStreamer.
+
+Example:
+>>cassette = Cassette("fixtures")
+>>td = TDAmeritrade("account_no.txt", "oAuth.txt",
+>>                  transport=RecordingTransport(HTTPTransport(), cassette))
+>>td.get_watchlists()
+>>with ReplayServer(cassette, latency=0.05, error_rate=0.01) as server:
+>>    td = TDAmeritrade("account_no.txt", "oAuth.txt",
+>>                      base_url=server.base_url)
+>>    td.get_watchlists()
+>>async with StreamerReplayServer(load_frames("frames.jsonl")) as server:
+>>    streamer = TDStreamer(server.url, queue=asyncio.Queue())
+
+Classes:
+    Cassette
+    Faults
+    RecordingTransport
+    ReplayTransport
+    ReplayServer
+    StreamerReplayServer
+
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import random
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from streaming import OPCODE_CLOSE, OPCODE_CONTINUATION, OPCODE_PING, \
+    OPCODE_PONG, OPCODE_TEXT, WEBSOCKET_GUID
+from transport import Response
+
+
+# Query parameters derived from the current date. They are left out of the
+# request key so that recordings keep matching on later days.
+IGNORED_PARAMS = ("endDate", "startDate", "fromEnteredTime", "toEnteredTime")
+# Response headers describing the transfer of the recorded body, which is
+# stored decoded.
+TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding",
+                    "connection", "keep-alive", "set-cookie")
+# Keys of the secrets in the recorded bodies: the OAuth tokens of the
+# oauth2/token endpoint, the streamer token and subscription keys of
+# userprincipals. Their values are replaced by REDACTED.
+SECRET_FIELDS = ("access_token", "refresh_token", "id_token", "token", "key",
+                 "password")
+REDACTED = "REDACTED"
+API_PATH = "/v1/"
+NOT_RECORDED = (404, "Not Recorded", b'{"error": "not recorded"}')
+
+
+class Cassette:
+    """Directory of recorded responses keyed on method, path and query.
+
+    A request matches the recording of the same method, path and query
+    (minus IGNORED_PARAMS), or else the last recording of the same method
+    and path.
+
+    Class variables
+        directory (str): Directory holding the recordings.
+        ignore_params (tuple): Query parameters left out of the key.
+    """
+    def __init__(self, directory="fixtures", ignore_params=IGNORED_PARAMS):
+        """Load the recordings of the directory, creating it if needed.
+
+        Arguments:
+            directory (str) optional: Directory holding the recordings.
+            ignore_params (tuple) optional: Query parameters left out of the
+            key.
+        """
+        self.directory = directory
+        self.ignore_params = tuple(ignore_params)
+        os.makedirs(directory, exist_ok=True)
+        self._entries = dict()
+        self._paths = dict()
+        self._lock = threading.Lock()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(directory, name)) as file_obj:
+                    self._index(json.load(file_obj))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, method, url):
+        """Get the (method, path, query) key of a request url.
+        """
+        parts = urlsplit(url)
+        query = sorted((name, value) for name, value in parse_qsl(parts.query)
+                       if name not in self.ignore_params)
+        return method.upper(), parts.path, urlencode(query)
+
+    def _index(self, entry):
+        """Add a recording to the lookup tables.
+        """
+        key = (entry["method"], entry["path"], entry["query"])
+        with self._lock:
+            self._entries[key] = entry
+            self._paths[key[:2]] = entry
+
+    def add(self, method, url, status, reason="OK", headers=None, body=b""):
+        """Record a response. The recording is written atomically.
+
+        Arguments:
+            method (str): HTTP method.
+            url (str): Request url (absolute or path).
+            status (int): HTTP status code.
+            reason (str) optional: HTTP reason phrase.
+            headers (dict) optional: Response headers.
+            body (bytes or str) optional: Decoded response body.
+        """
+        method, path, query = self._key(method, url)
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        headers = {name: value for name, value in (headers or dict()).items()
+                   if name.lower() not in TRANSFER_HEADERS}
+        entry = {"method": method, "path": path, "query": query,
+                 "status": status, "reason": reason, "headers": headers,
+                 "body": body}
+        name = hashlib.sha1(" ".join((method, path, query)).encode("utf-8"))
+        filename = os.path.join(self.directory,
+                                "{}.json".format(name.hexdigest()[:16]))
+        tmp_filename = "{}.tmp".format(filename)
+        with open(tmp_filename, mode='w') as file_obj:
+            json.dump(entry, file_obj, indent=1)
+        os.replace(tmp_filename, filename)
+        self._index(entry)
+
+    def lookup(self, method, url):
+        """Find the recording of a request.
+
+        Returns:
+            dict: method, path, query, status, reason, headers and body, None
+            if nothing was recorded for the path.
+        """
+        key = self._key(method, url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._paths.get(key[:2])
+        return entry
+
+
+class Faults:
+    """Injected latency and errors of the replayed responses.
+
+    Class variables
+        latency (float): Seconds added to every response.
+        jitter (float): Maximum random seconds added on top of latency.
+        error_rate (float): Fraction of the requests answered with
+        error_status.
+        error_status (int): Status of the injected errors, e.g. 429 or 503.
+    """
+    def __init__(self, latency=0., jitter=0., error_rate=0., error_status=503,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Get the latency of the next response.
+        """
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0., self.jitter)
+
+    def error(self):
+        """Whether the next response is an injected error.
+        """
+        if self.error_rate <= 0.:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def error_response(self):
+        """Get the (status, reason, headers, body) of an injected error.
+        """
+        headers = {"Content-Type": "application/json"}
+        if self.error_status == 429:
+            headers["Retry-After"] = "0"
+        return (self.error_status, "Injected Error", headers,
+                b'{"error": "injected"}')
+
+
+def redact(body, fields=SECRET_FIELDS):
+    """Replace the values of the secret fields of a JSON body, at any depth.
+    Bodies that are not JSON are returned unchanged.
+
+    Arguments:
+        body (bytes): Decoded response body.
+        fields (tuple) optional: Keys whose values are redacted.
+    """
+    try:
+        message = json.loads(body)
+    except ValueError:
+        return body
+
+    def scrub(value):
+        if isinstance(value, dict):
+            return {name: REDACTED if name in fields else scrub(item)
+                    for name, item in value.items()}
+        if isinstance(value, list):
+            return [scrub(item) for item in value]
+        return value
+
+    return json.dumps(scrub(message)).encode("utf-8")
+
+
+def _message(headers):
+    """Build case insensitive response headers from a dict.
+    """
+    message = http.client.HTTPMessage()
+    for name, value in headers.items():
+        message[name] = value
+    return message
+
+
+class RecordingTransport:
+    """Transport recording every response of a wrapped transport into a
+    cassette. The secret fields of the bodies are redacted before they are
+    written, so cassettes can be checked in.
+
+    Class variables
+        transport (HTTPTransport): Transport sending the requests.
+        cassette (Cassette): Cassette the responses are recorded into.
+        secret_fields (tuple): Keys whose values are redacted.
+    """
+    def __init__(self, transport, cassette, secret_fields=SECRET_FIELDS):
+        self.transport = transport
+        self.cassette = cassette
+        self.secret_fields = tuple(secret_fields)
+
+    def request(self, method, url, headers=None, body=None, stream=False):
+        """Send the request and record the response. Responses are always
+        read in full (stream is ignored) so they can be recorded. The
+        response returned is not redacted.
+        """
+        response = self.transport.request(method, url, headers=headers,
+                                          body=body)
+        self.cassette.add(method, url, response.status, response.reason,
+                          dict(response.headers.items()),
+                          redact(response.body, self.secret_fields))
+        return response
+
+    def close(self):
+        """Close the wrapped transport.
+        """
+        self.transport.close()
+
+
+class ReplayTransport:
+    """In-process transport answering from a cassette, without sockets.
+
+    Class variables
+        cassette (Cassette): Recorded responses.
+        faults (Faults): Injected latency and errors.
+        requests_sent (int): Number of requests answered so far.
+    """
+    def __init__(self, cassette, faults=None):
+        self.cassette = cassette
+        self.faults = Faults() if faults is None else faults
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, body=None, stream=False):
+        """Answer the request with its recording, an injected error, or 404
+        if nothing was recorded.
+
+        Returns:
+            transport.Response
+        """
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.requests_sent += 1
+        if self.faults.error():
+            status, reason, response_headers, data = \
+                self.faults.error_response()
+        else:
+            entry = self.cassette.lookup(method, url)
+            if entry is None:
+                status, reason, data = NOT_RECORDED
+                response_headers = dict()
+            else:
+                status, reason = entry["status"], entry["reason"]
+                response_headers = entry["headers"]
+                data = entry["body"].encode("utf-8")
+        return Response(status, reason, _message(response_headers), data, url,
+                        timings={"ttfb": delay, "download": 0.},
+                        bytes_sent=len(body) if body else 0,
+                        bytes_received=len(data))
+
+    def close(self):
+        """Nothing to close, for symmetry with HTTPTransport.
+        """
+
+
+class ReplayServer:
+    """Local HTTP stand-in of the API answering from a cassette.
+
+    Class variables
+        cassette (Cassette): Recorded responses.
+        faults (Faults): Injected latency and errors.
+        requests (int): Number of requests answered so far.
+    """
+    def __init__(self, cassette, latency=0., jitter=0., error_rate=0.,
+                 error_status=503, seed=None, host="127.0.0.1", port=0):
+        """Bind the server. Requests are served once started.
+
+        Arguments:
+            cassette (Cassette): Recorded responses.
+            latency (float) optional: Seconds added to every response.
+            jitter (float) optional: Maximum random seconds added on top.
+            error_rate (float) optional: Fraction of injected errors.
+            error_status (int) optional: Status of the injected errors.
+            seed (int) optional: Seed of the fault injection.
+            host (str) optional: Address to bind.
+            port (int) optional: Port to bind, any free port if 0.
+        """
+        self.cassette = cassette
+        self.faults = Faults(latency, jitter, error_rate, error_status, seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Base url to pass to TDAmeritrade.
+        """
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}{}".format(host, port, API_PATH)
+
+    def _handler(self):
+        """Build the request handler class bound to this server.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, without TCP_NODELAY
+            # the body waits for the delayed ACK of the headers.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                server._answer(self)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+        return Handler
+
+    def _answer(self, handler):
+        """Write the response of a request.
+        """
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.requests += 1
+        if self.faults.error():
+            status, reason, headers, body = self.faults.error_response()
+        else:
+            entry = self.cassette.lookup(handler.command, handler.path)
+            if entry is None:
+                status, reason, body = NOT_RECORDED
+                headers = dict()
+            else:
+                status, reason = entry["status"], entry["reason"]
+                headers = entry["headers"]
+                body = entry["body"].encode("utf-8")
+        if body and "gzip" in handler.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers = dict(headers, **{"Content-Encoding": "gzip"})
+        handler.send_response(status, reason)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        """Serve requests in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever,
+                                            name="replay-server",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop serving and close the socket.
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_frames(filename, messages):
+    """Write streamer messages to a frame file, one message per line.
+
+    Arguments:
+        filename (str): Frame file.
+        messages (list): Raw streamer messages (str).
+    """
+    tmp_filename = "{}.tmp".format(filename)
+    with open(tmp_filename, mode='w') as file_obj:
+        for message in messages:
+            file_obj.write(json.dumps(json.loads(message)) + "\n")
+    os.replace(tmp_filename, filename)
+
+
+def load_frames(filename):
+    """Read the streamer messages of a frame file.
+    """
+    with open(filename) as file_obj:
+        return [line.rstrip("\n") for line in file_obj if line.strip()]
+
+
+def _encode_frame(opcode, payload, fin=True):
+    """Encode an unmasked server frame.
+    """
+    length = len(payload)
+    header = bytearray([(0x80 if fin else 0) | opcode])
+    if length < 126:
+        header.append(length)
+    elif length < 65536:
+        header.append(126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(127)
+        header += struct.pack("!Q", length)
+    return bytes(header) + payload
+
+
+class StreamerReplayServer:
+    """Local WebSocket stand-in of the streamer replaying recorded messages.
+
+    Every SUBS request of the client is answered with the recorded
+    messages, preceded by a ping and split into fragments of fragment_size
+    bytes. Once every subscription is served the server sends a close frame.
+
+    Class variables
+        frames (list): Recorded messages (str).
+        fragment_size (int): Maximum payload bytes per frame, None to send
+        each message in a single frame.
+        subscriptions (int): Number of SUBS requests to serve before
+        closing.
+        received (list): Decoded requests received from the client.
+        unmasked (int): Number of client frames without mask (must be 0).
+        pongs (list): Payloads of the pongs received.
+        close_code (int): Status code of the close frame of the client.
+    """
+    def __init__(self, frames, fragment_size=None, subscriptions=1,
+                 host="127.0.0.1", port=0):
+        self.frames = list(frames)
+        self.fragment_size = fragment_size
+        self.subscriptions = subscriptions
+        self.received = list()
+        self.unmasked = 0
+        self.pongs = list()
+        self.close_code = None
+        self._host = host
+        self._port = port
+        self._server = None
+
+    @property
+    def url(self):
+        """ws:// url to pass to TDStreamer.
+        """
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return "ws://{}:{}/ws".format(host, port)
+
+    async def start(self):
+        """Start accepting connections.
+        """
+        self._server = await asyncio.start_server(self._serve, self._host,
+                                                  self._port)
+        return self
+
+    async def close(self):
+        """Stop accepting connections.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @staticmethod
+    async def _handshake(reader, writer):
+        """Answer the opening handshake of the client.
+        """
+        await reader.readline()
+        key = None
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "sec-websocket-key":
+                key = value.strip()
+        accept = base64.b64encode(hashlib.sha1(
+            (key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      "Sec-WebSocket-Accept: {}\r\n\r\n")
+                     .format(accept).encode("ascii"))
+        await writer.drain()
+
+    async def _read_frame(self, reader):
+        """Read a client frame. Returns (opcode, payload).
+        """
+        first, second = await reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", await reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", await reader.readexactly(8))
+        if second & 0x80:
+            mask = await reader.readexactly(4)
+        else:
+            mask = b"\x00" * 4
+            self.unmasked += 1
+        payload = bytes(byte ^ mask[i % 4] for i, byte in
+                        enumerate(await reader.readexactly(length)))
+        return first & 0x0F, payload
+
+    def _send_message(self, writer, message):
+        """Write a message, split into fragments of fragment_size bytes.
+        """
+        payload = message.encode("utf-8")
+        size = self.fragment_size or max(len(payload), 1)
+        chunks = [payload[i:i + size]
+                  for i in range(0, len(payload), size)] or [b""]
+        for i, chunk in enumerate(chunks):
+            writer.write(_encode_frame(
+                OPCODE_TEXT if i == 0 else OPCODE_CONTINUATION, chunk,
+                fin=i == len(chunks) - 1))
+
+    async def _serve(self, reader, writer):
+        """Serve one client connection.
+        """
+        served = 0
+        try:
+            await self._handshake(reader, writer)
+            while True:
+                opcode, payload = await self._read_frame(reader)
+                if opcode == OPCODE_CLOSE:
+                    if len(payload) >= 2:
+                        self.close_code, = struct.unpack("!H", payload[:2])
+                    break
+                if opcode == OPCODE_PONG:
+                    self.pongs.append(payload)
+                    continue
+                request = json.loads(payload.decode("utf-8"))
+                self.received.append(request)
+                if request["requests"][0]["command"] != "SUBS":
+                    continue
+                writer.write(_encode_frame(OPCODE_PING, b"replay"))
+                for message in self.frames:
+                    self._send_message(writer, message)
+                await writer.drain()
+                served += 1
+                if served >= self.subscriptions:
+                    writer.write(_encode_frame(OPCODE_CLOSE,
+                                               struct.pack("!H", 1000)))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
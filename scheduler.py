@@ -0,0 +1,161 @@
+"""
+Module providing client side pacing of the TDAmeritrade API requests.
+
+TD Ameritrade enforces a per minute request quota. The scheduler hands out
+tokens from a token bucket refilled at the quota rate. Requests wait in a
+priority queue, so trading calls (high priority lane) are always served
+before queued market data calls (normal priority lane).
+
+Classes:
+    RequestScheduler
+
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+LANES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal"}
+
+
+class RequestScheduler:
+    """Token bucket rate limiter with priority lanes.
+
+    Class variables
+        rate (int): Number of requests allowed every per seconds.
+        per (float): Length of the quota window in seconds.
+        burst (int): Size of the token bucket.
+        max_retries (int): Number of retries on HTTP 429/5xx.
+        backoff (float): Initial backoff in seconds, doubled on every retry.
+        max_backoff (float): Upper limit of the backoff in seconds.
+        retries (int): Number of retries so far.
+
+    Example:
+    >>scheduler = RequestScheduler(rate=120, per=60.)
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt", scheduler=scheduler)
+    >>scheduler.stats()
+    """
+    def __init__(self, rate=120, per=60., burst=None, max_retries=3,
+                 backoff=1., max_backoff=30.):
+        """Create a full token bucket.
+
+        Arguments:
+            rate (int): Number of requests allowed every per seconds.
+            per (float): Length of the quota window in seconds.
+            burst (int) optional: Size of the token bucket. Defaults to rate.
+            max_retries (int): Number of retries on HTTP 429/5xx.
+            backoff (float): Initial backoff in seconds.
+            max_backoff (float): Upper limit of the backoff in seconds.
+        """
+        self.rate = rate
+        self.per = per
+        self.burst = rate if burst is None else burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.
+        self._queue = list()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {lane: {"requests": 0, "wait_total": 0., "wait_max": 0.}
+                       for lane in LANES.values()}
+
+    def _refill(self, now):
+        """Add the tokens accumulated since the last refill.
+        """
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst,
+                           self._tokens + elapsed * self.rate / self.per)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Block until the request may be sent. Requests are served in
+        priority order, first come first served within a lane.
+
+        Arguments:
+            priority (int): PRIORITY_HIGH | PRIORITY_NORMAL
+
+        Returns:
+            Time waited in seconds.
+        """
+        start = time.monotonic()
+        ticket = (priority, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            while True:
+                if self._queue[0] != ticket:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                self._refill(now)
+                timeout = self._paused_until - now
+                if self._tokens >= 1. and timeout <= 0.:
+                    self._tokens -= 1.
+                    heapq.heappop(self._queue)
+                    self._cond.notify_all()
+                    break
+                timeout = max(timeout,
+                              (1. - self._tokens) * self.per / self.rate)
+                self._cond.wait(timeout)
+            waited = time.monotonic() - start
+            stats = self._stats[LANES[priority]]
+            stats["requests"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+        return waited
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a number of seconds, e.g. after the
+        server responded with HTTP 429.
+
+        Arguments:
+            seconds (float): Length of the pause.
+        """
+        with self._cond:
+            self._paused_until = max(self._paused_until,
+                                     time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Get the delay before the next retry. Exponential backoff with
+        jitter, unless the server sent a Retry-After header.
+
+        Arguments:
+            attempt (int): Number of the retry (0 for the first retry).
+            retry_after (str) optional: Retry-After header value in seconds.
+        """
+        with self._cond:
+            self.retries += 1
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * (0.5 + random.random() / 2.)
+
+    def stats(self):
+        """Get the queue depth and wait time statistics per lane.
+
+        Returns:
+            dict: {"queue_depth": {lane: int}, "lanes": {lane: {"requests",
+            "wait_total", "wait_max", "wait_mean"}}, "retries": int}
+        """
+        with self._cond:
+            depth = {lane: 0 for lane in LANES.values()}
+            for priority, _ in self._queue:
+                depth[LANES[priority]] += 1
+            lanes = dict()
+            for lane, stats in self._stats.items():
+                lanes[lane] = dict(stats)
+                lanes[lane]["wait_mean"] = (stats["wait_total"]
+                                            / max(stats["requests"], 1))
+            return {"queue_depth": depth, "lanes": lanes,
+                    "retries": self.retries}
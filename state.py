@@ -0,0 +1,259 @@
+"""
+Module providing an in-process store of the account state: positions,
+working orders and balances.
+
+The store is seeded once from get_account_info and then kept in sync
+incrementally: orders submitted through the client are added as soon as
+they are accepted, and delta fetches of the orders entered since the last
+sync, or since the oldest working order if it is older, update the order
+statuses and apply new fills to the positions. Each sync also refreshes the
+balances.
+Lookups by symbol are answered from memory, so risk checks do not need an
+account round trip.
+
+Example:
+>>state = AccountState()
+>>td = TDAmeritrade("account_no.txt", "oAuth.txt", account_state=state)
+>>state.seed(td)
+>>td.place_order(symbol="SPYV", price=30.16, quantity=2, instruction="BUY")
+>>state.open_quantity("SPYV", "BUY")
+>>state.sync(td)
+
+Classes:
+    AccountState
+
+"""
+import itertools
+import threading
+from datetime import date
+
+from models import Order, OrderLeg, Position
+
+
+# Statuses after which an order no longer works.
+TERMINAL_STATUSES = ("FILLED", "CANCELED", "REJECTED", "EXPIRED", "REPLACED")
+# Effect of a fill on a position: (attribute, sign) per leg instruction.
+FILL_EFFECTS = {"BUY": ("long_quantity", 1), "SELL": ("long_quantity", -1),
+                "BUY_TO_OPEN": ("long_quantity", 1),
+                "SELL_TO_CLOSE": ("long_quantity", -1),
+                "SELL_SHORT": ("short_quantity", 1),
+                "BUY_TO_COVER": ("short_quantity", -1),
+                "SELL_TO_OPEN": ("short_quantity", 1),
+                "BUY_TO_CLOSE": ("short_quantity", -1)}
+SUBMITTED = "SUBMITTED"
+# Id prefix of the submissions whose order id is not known yet.
+LOCAL_PREFIX = "local-"
+
+
+class AccountState:
+    """Positions, working orders and balances of an account, indexed by
+    symbol.
+
+    Class variables
+        balances (dict): currentBalances of the account information.
+        synced (datetime.date): Day of the last seed or sync, orders entered
+        since are fetched by the next sync.
+    """
+    def __init__(self):
+        self.balances = dict()
+        self.synced = None
+        self._positions = dict()
+        self._orders = dict()
+        self._working = dict()
+        self._filled = dict()
+        self._local_ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def seed(self, client):
+        """Load the state from the account information.
+
+        Arguments:
+            client (TDAmeritrade): Client of the account.
+        """
+        self.load(client.get_account_info(fields="positions,orders"))
+
+    def load(self, account_info):
+        """Replace the state with the account information. The fills of the
+        orders seen here are already part of the positions, only later fills
+        are applied.
+
+        Arguments:
+            account_info (dict): Decoded get_account_info response.
+        """
+        account = account_info["securitiesAccount"]
+        with self._lock:
+            self.balances = dict(account.get("currentBalances") or dict())
+            self._positions = dict()
+            for position in account.get("positions") or list():
+                position = Position.from_json(position)
+                self._positions[position.symbol] = position
+            self._orders = dict()
+            self._working = dict()
+            self._filled = dict()
+            for order in account.get("orderStrategies") or list():
+                order = Order.from_json(order)
+                self._filled[str(order.order_id)] = order.filled_quantity or 0
+                self._upsert(order)
+            self.synced = date.today()
+
+    def sync(self, client):
+        """Fetch the orders entered since the last sync, or since the oldest
+        working order (GTC orders, DAY orders of previous days not yet seen
+        expired), apply them and refresh the balances. The range is fetched
+        with iter_orders, so it is not truncated at max_results orders.
+
+        Arguments:
+            client (TDAmeritrade): Client of the account.
+        """
+        today = date.today()
+        since = self.synced or today
+        oldest = self._oldest_working_day()
+        if oldest is not None and oldest < since:
+            since = oldest
+        orders = list(client.iter_orders(since, today, order_status=None,
+                                         as_models=True))
+        self.apply_orders(orders)
+        account = client.get_account_info(fields=None)["securitiesAccount"]
+        with self._lock:
+            self.balances = dict(account.get("currentBalances") or dict())
+        self.synced = today
+
+    def _oldest_working_day(self):
+        """Get the day the oldest working order was entered, None if no
+        working order was fetched from the API.
+        """
+        with self._lock:
+            days = [date.fromisoformat(order.entered_time[:10])
+                    for orders in self._working.values()
+                    for order in orders.values() if order.entered_time]
+        return min(days) if days else None
+
+    def _upsert(self, order):
+        """Index an order, or drop it from the working orders once it is
+        done.
+        """
+        order_id = str(order.order_id)
+        self._orders[order_id] = order
+        ids = self._working.setdefault(order.symbol, dict())
+        if order.status in TERMINAL_STATUSES:
+            ids.pop(order_id, None)
+        else:
+            ids[order_id] = order
+
+    def _reconcile(self, order):
+        """Drop the local submission an order fetched from the API stands
+        for.
+        """
+        for order_id, local in self._working.get(order.symbol, dict()).items():
+            if (order_id.startswith(LOCAL_PREFIX)
+                    and local.instruction == order.instruction
+                    and local.quantity == order.quantity
+                    and local.price == order.price):
+                del self._working[order.symbol][order_id]
+                del self._orders[order_id]
+                return
+
+    def _apply_fill(self, order, quantity):
+        """Apply a fill of quantity of an order to the positions.
+        """
+        for leg in order.legs:
+            attribute, sign = FILL_EFFECTS.get(leg.instruction, (None, 0))
+            if attribute is None:
+                continue
+            if order.quantity and len(order.legs) > 1:
+                filled = quantity * (leg.quantity or 0) / order.quantity
+            else:
+                filled = quantity
+            position = self._positions.get(leg.symbol)
+            if position is None:
+                position = Position(symbol=leg.symbol,
+                                    asset_type=leg.asset_type,
+                                    long_quantity=0., short_quantity=0.)
+                self._positions[leg.symbol] = position
+            setattr(position, attribute,
+                    (getattr(position, attribute) or 0.) + sign * filled)
+            if not position.long_quantity and not position.short_quantity:
+                del self._positions[leg.symbol]
+
+    def apply_orders(self, orders):
+        """Apply fetched orders (decoded get_orders response or
+        models.Order): update the statuses and apply the new fills.
+
+        Arguments:
+            orders (list): Orders.
+        """
+        with self._lock:
+            for order in orders:
+                if not isinstance(order, Order):
+                    order = Order.from_json(order)
+                order_id = str(order.order_id)
+                if order_id not in self._orders:
+                    self._reconcile(order)
+                filled = order.filled_quantity or 0
+                delta = filled - self._filled.get(order_id, 0)
+                if delta > 0:
+                    self._apply_fill(order, delta)
+                    self._filled[order_id] = filled
+                self._upsert(order)
+
+    def record_submission(self, symbol, price, quantity, instruction,
+                          order_id=None):
+        """Add an order submitted through the client as working. Without an
+        order id it is replaced by the matching order of the next sync.
+
+        Arguments:
+            symbol (str): Symbol traded.
+            price (float): Limit price.
+            quantity (int): Number of shares.
+            instruction (str): "BUY" | "SELL"
+            order_id (str) optional: Order id from the Location header.
+        """
+        with self._lock:
+            if order_id is None:
+                order_id = "{}{}".format(LOCAL_PREFIX, next(self._local_ids))
+            leg = OrderLeg(instruction, quantity, symbol)
+            order = Order(order_id=order_id, status=SUBMITTED,
+                          order_type="LIMIT", price=price, quantity=quantity,
+                          filled_quantity=0, symbol=symbol,
+                          instruction=instruction, legs=(leg,))
+            self._upsert(order)
+
+    def position(self, symbol):
+        """Get the position of a symbol, None if there is none.
+        """
+        return self._positions.get(symbol)
+
+    def quantity(self, symbol):
+        """Get the net quantity (long - short) held of a symbol.
+        """
+        position = self._positions.get(symbol)
+        return 0. if position is None else position.quantity
+
+    def positions(self):
+        """Get every position.
+        """
+        with self._lock:
+            return list(self._positions.values())
+
+    def working_orders(self, symbol=None):
+        """Get the working orders, of a symbol or of every symbol.
+        """
+        with self._lock:
+            if symbol is not None:
+                return list(self._working.get(symbol, dict()).values())
+            return [order for orders in self._working.values()
+                    for order in orders.values()]
+
+    def open_quantity(self, symbol, instruction=None):
+        """Get the quantity of the working orders of a symbol still to be
+        filled.
+
+        Arguments:
+            symbol (str): Symbol.
+            instruction (str) optional: Only orders with this instruction.
+        """
+        with self._lock:
+            return sum((order.quantity or 0) - (order.filled_quantity or 0)
+                       for order in self._working.get(symbol, dict()).values()
+                       if instruction is None
+                       or order.instruction == instruction)
@@ -0,0 +1,348 @@
+"""
+Module providing a client for the TDAmeritrade streaming API.
+
+A single long lived WebSocket connection is used to subscribe to level one
+quotes (QUOTE service) and chart bars (CHART_EQUITY service). Incoming
+updates are decoded from the numbered streamer fields into named fields and
+pushed into callbacks and/or an asyncio queue.
+
+Example:
+>>td = TDAmeritrade("account_no.txt", "oAuth.txt")
+>>streamer = TDStreamer.from_client(td, queue=asyncio.Queue())
+>>await streamer.connect()
+>>await streamer.subscribe_quotes(["SPYG", "SPYV"])
+>>asyncio.ensure_future(streamer.run())
+>>service, update = await streamer.queue.get()
+
+Classes:
+    WebSocket
+    TDStreamer
+
+"""
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import os
+import ssl
+import struct
+import urllib.parse
+from datetime import datetime
+from urllib.parse import urlsplit
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Streamer field numbers and the names they are decoded into.
+QUOTE_FIELDS = {"1": "bid", "2": "ask", "3": "last", "4": "bid_size",
+                "5": "ask_size", "8": "volume", "9": "last_size",
+                "12": "high", "13": "low", "15": "close", "28": "open"}
+CHART_FIELDS = {"1": "open", "2": "high", "3": "low", "4": "close",
+                "5": "volume", "6": "sequence", "7": "datetime",
+                "8": "chart_day"}
+SERVICE_FIELDS = {"QUOTE": QUOTE_FIELDS, "CHART_EQUITY": CHART_FIELDS}
+
+
+class WebSocket:
+    """Minimal WebSocket (RFC 6455) client on top of asyncio streams.
+    Supports text messages, fragmentation, ping/pong and close.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self.closed = False
+
+    @classmethod
+    async def connect(cls, url):
+        """Open the connection and perform the opening handshake.
+
+        Arguments:
+            url (str): ws:// or wss:// url.
+        """
+        parts = urlsplit(url)
+        secure = parts.scheme == "wss"
+        port = parts.port or (443 if secure else 80)
+        context = ssl.create_default_context() if secure else None
+        reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                       ssl=context)
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        writer.write(("GET {} HTTP/1.1\r\n"
+                      "Host: {}\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      "Sec-WebSocket-Key: {}\r\n"
+                      "Sec-WebSocket-Version: 13\r\n\r\n")
+                     .format(path, parts.netloc, key).encode("ascii"))
+        await writer.drain()
+
+        status = await reader.readline()
+        if status.split()[1:2] != [b"101"]:
+            writer.close()
+            raise ConnectionError("WebSocket handshake failed: {!r}"
+                                  .format(status))
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1(
+            (key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        if headers.get("sec-websocket-accept") != accept:
+            writer.close()
+            raise ConnectionError("WebSocket handshake failed: bad accept key")
+        return cls(reader, writer)
+
+    @staticmethod
+    def _mask(payload, mask):
+        """Apply the WebSocket XOR mask to the payload.
+        """
+        length = len(payload)
+        if length == 0:
+            return payload
+        key = (mask * (length // 4 + 1))[:length]
+        return (int.from_bytes(payload, "big")
+                ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+
+    async def _send_frame(self, opcode, payload):
+        """Send a single masked frame.
+        """
+        length = len(payload)
+        header = bytearray([0x80 | opcode])
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", length)
+        mask = os.urandom(4)
+        self._writer.write(bytes(header) + mask + self._mask(payload, mask))
+        await self._writer.drain()
+
+    async def send(self, text):
+        """Send a text message.
+        """
+        await self._send_frame(OPCODE_TEXT, text.encode("utf-8"))
+
+    async def _read_frame(self):
+        """Read a single frame. Returns (fin, opcode, payload).
+        """
+        first, second = await self._reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", await self._reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", await self._reader.readexactly(8))
+        mask = await self._reader.readexactly(4) if second & 0x80 else None
+        payload = await self._reader.readexactly(length)
+        if mask is not None:
+            payload = self._mask(payload, mask)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    async def recv(self):
+        """Receive the next text message. Answers pings. Returns None once
+        the connection is closed.
+        """
+        fragments = list()
+        while True:
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except asyncio.IncompleteReadError:
+                self.closed = True
+                return None
+            if opcode == OPCODE_PING:
+                await self._send_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                if not self.closed:
+                    self.closed = True
+                    await self._send_frame(OPCODE_CLOSE, payload[:2])
+                return None
+            elif opcode in (OPCODE_TEXT, OPCODE_BINARY,
+                            OPCODE_CONTINUATION):
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode("utf-8")
+
+    async def close(self):
+        """Send a close frame and close the connection.
+        """
+        if not self.closed:
+            self.closed = True
+            try:
+                await self._send_frame(OPCODE_CLOSE, struct.pack("!H", 1000))
+            except ConnectionError:
+                pass
+        self._writer.close()
+
+
+class TDStreamer:
+    """Streaming quote and chart feed subscription client.
+
+    Class variables
+        url (str): WebSocket url of the streamer.
+        credentials (dict): Login request parameters (None to skip login).
+        account (str): Account id sent with every request.
+        source (str): Application id sent with every request.
+        queue (asyncio.Queue): Queue receiving (service, update) tuples.
+    """
+    def __init__(self, url, credentials=None, account=None, source=None,
+                 queue=None):
+        """Create the streamer. The connection is opened by connect.
+
+        Arguments:
+            url (str): WebSocket url of the streamer.
+            credentials (dict) optional: Login parameters, see from_client.
+            account (str) optional: Account id sent with every request.
+            source (str) optional: Application id sent with every request.
+            queue (asyncio.Queue) optional: Queue receiving the updates.
+        """
+        self.url = url
+        self.credentials = credentials
+        self.account = account
+        self.source = source
+        self.queue = queue
+        self._socket = None
+        self._callbacks = dict()
+        self._request_ids = itertools.count()
+
+    @classmethod
+    def from_client(cls, client, queue=None):
+        """Create a streamer from the user principals of a TDAmeritrade
+        client. This makes a blocking rpc.
+
+        Arguments:
+            client (TDAmeritrade): Authenticated client.
+            queue (asyncio.Queue) optional: Queue receiving the updates.
+        """
+        principals = client.get_user_principals()
+        info = principals["streamerInfo"]
+        account = principals["accounts"][0]
+        timestamp = datetime.strptime(info["tokenTimestamp"],
+                                      "%Y-%m-%dT%H:%M:%S%z")
+        credentials = {
+            "userid": account["accountId"],
+            "token": info["token"],
+            "company": account["company"],
+            "segment": account["segment"],
+            "cddomain": account["accountCdDomainId"],
+            "usergroup": info["userGroup"],
+            "accesslevel": info["accessLevel"],
+            "authorized": "Y",
+            "timestamp": int(timestamp.timestamp() * 1000),
+            "appid": info["appId"],
+            "acl": info["acl"]
+        }
+        url = "wss://{}/ws".format(info["streamerSocketUrl"])
+        return cls(url, credentials=credentials, account=account["accountId"],
+                   source=info["appId"], queue=queue)
+
+    def add_callback(self, service, callback):
+        """Register a callback called with every update of a service.
+
+        Arguments:
+            service (str): QUOTE | CHART_EQUITY
+            callback (callable): Called as callback(update).
+        """
+        self._callbacks.setdefault(service, list()).append(callback)
+
+    async def _send(self, service, command, parameters):
+        """Send a single streamer request.
+        """
+        request = {"requests": [{
+            "service": service,
+            "command": command,
+            "requestid": next(self._request_ids),
+            "account": self.account,
+            "source": self.source,
+            "parameters": parameters
+        }]}
+        await self._socket.send(json.dumps(request))
+
+    async def connect(self):
+        """Open the WebSocket and log in, if credentials are set.
+        """
+        self._socket = await WebSocket.connect(self.url)
+        if self.credentials is not None:
+            await self._send("ADMIN", "LOGIN", {
+                "credential": urllib.parse.urlencode(self.credentials),
+                "token": self.credentials["token"],
+                "version": "1.0"
+            })
+
+    async def subscribe(self, service, symbols, fields):
+        """Subscribe to a service for a set of symbols.
+
+        Arguments:
+            service (str): Streamer service, e.g. QUOTE.
+            symbols (list): Symbols to subscribe.
+            fields (iterable): Streamer field numbers.
+        """
+        await self._send(service, "SUBS", {
+            "keys": ",".join(symbols),
+            "fields": ",".join(["0"] + [str(field) for field in fields])
+        })
+
+    async def subscribe_quotes(self, symbols):
+        """Subscribe to level one quotes.
+        """
+        await self.subscribe("QUOTE", symbols, QUOTE_FIELDS)
+
+    async def subscribe_chart(self, symbols):
+        """Subscribe to one minute chart bars.
+        """
+        await self.subscribe("CHART_EQUITY", symbols, CHART_FIELDS)
+
+    @staticmethod
+    def parse(message):
+        """Decode the data updates of a streamer message into
+        (service, update) tuples. Responses and heartbeats are skipped.
+
+        Arguments:
+            message (str): Raw streamer message.
+        """
+        updates = list()
+        for data in json.loads(message).get("data", list()):
+            service = data["service"]
+            names = SERVICE_FIELDS.get(service, dict())
+            for content in data.get("content", list()):
+                update = {"symbol": content.get("key"),
+                          "timestamp": data.get("timestamp")}
+                for field, value in content.items():
+                    if field in names:
+                        update[names[field]] = value
+                updates.append((service, update))
+        return updates
+
+    async def run(self):
+        """Receive messages until the connection is closed and dispatch the
+        updates to the callbacks and the queue.
+        """
+        while True:
+            message = await self._socket.recv()
+            if message is None:
+                break
+            for service, update in self.parse(message):
+                for callback in self._callbacks.get(service, list()):
+                    callback(update)
+                if self.queue is not None:
+                    await self.queue.put((service, update))
+
+    async def close(self):
+        """Log out and close the connection.
+        """
+        if self._socket is not None and not self._socket.closed:
+            await self._send("ADMIN", "LOGOUT", dict())
+            await self._socket.close()
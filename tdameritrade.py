@@ -5,50 +5,266 @@ web based API.
 Example:
 Class:
     TDAmeritrade
+    AsyncTDAmeritrade
+
+See streaming.TDStreamer for the streaming quote and chart feed.
+
+NumPy, pandas and asyncio are only imported by the features that need them
+(price history, quotes as a DataFrame, AsyncTDAmeritrade), so scripts that
+only place orders or read accounts and watchlists start fast. Likewise
+urllib.error is imported when an HTTP error is raised and concurrent.futures
+for the concurrent fetches.
 
 """
-import urllib.request
+import atexit
+import copy
+import functools
+import io
+import queue
+import random
+import threading
+import urllib.parse
 import time
 import logging
 import json
-from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
+import operator
+from datetime import date, datetime, timedelta
+
+from auth import TokenManager
+from decoders import CandleStreamParser, get_decoder
+from metrics import Metrics
+from models import Order, Transaction
+from orders import LIMIT_ORDER
+from scheduler import RequestScheduler, PRIORITY_HIGH, PRIORITY_NORMAL
+from transport import HTTPTransport
+
+
+BASE_URL = "https://api.tdameritrade.com/v1/"
+_LOG_LOCK = threading.Lock()
+_LOG_CONFIGURED = False
+_LOG_LISTENER = None
+CANDLE_FIELDS = ("open", "high", "low", "close", "volume")
+_candle_getter = operator.itemgetter("datetime", *CANDLE_FIELDS)
+# Quote fields returned by get_quotes(as_frame=True): (column, key, dtype).
+QUOTE_COLUMNS = (("bid", "bidPrice", "float64"),
+                 ("ask", "askPrice", "float64"),
+                 ("last", "lastPrice", "float64"),
+                 ("volume", "totalVolume", "int64"))
+MAX_QUOTE_SYMBOLS = 300
+MAX_URL_LENGTH = 2000
+# Cached endpoints whose responses are stale once an order is submitted.
+ORDER_INVALIDATES = ("account", "orders", "savedorders", "transactions")
+
+
+@functools.lru_cache(maxsize=None)
+def candle_dtypes():
+    """Get the candle dtypes, built on first use so that NumPy is only
+    imported with the price history.
+
+    Returns:
+        (CANDLE_DTYPE, _RAW_CANDLE_DTYPE): CANDLE_DTYPE has a datetime64[ms]
+        datetime, _RAW_CANDLE_DTYPE the same layout with the epoch
+        milliseconds as int64.
+    """
+    import numpy as np
+    candle_dtype = np.dtype([("datetime", "datetime64[ms]"),
+                             ("open", np.float64), ("high", np.float64),
+                             ("low", np.float64), ("close", np.float64),
+                             ("volume", np.int64)])
+    raw_dtype = np.dtype([("datetime", np.int64)] + candle_dtype.descr[1:])
+    return candle_dtype, raw_dtype
+
+
+def __getattr__(name):
+    """Build the CANDLE_DTYPE and _RAW_CANDLE_DTYPE module attributes on
+    first access, see candle_dtypes.
+    """
+    if name == "CANDLE_DTYPE":
+        return candle_dtypes()[0]
+    if name == "_RAW_CANDLE_DTYPE":
+        return candle_dtypes()[1]
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
 
 
 def dump_message(function):
     """Dump the message to file.
     Useful for debugging the message parser.
     """
-    def wrapper(self, url, data=None):
+    def wrapper(self, url, data=None, **kwargs):
         """Wrapper function.
         """
-        function(self, url, data)
+        message = function(self, url, data, **kwargs)
 
         with open("message.txt", mode='w') as file_obj:
-            file_obj.writelines(json.dumps(self.message))
+            file_obj.writelines(json.dumps(message))
+        return message
 
     return wrapper
 
 
+def setup_logging(filename="tdameritrade.log", asynchronous=True):
+    """Set up the module logger. The handlers are installed only once, no
+    matter how many clients are created. In asynchronous mode the records
+    are put on a queue and written to the file and console by a background
+    thread, so the caller never waits on disk I/O. The log file is only
+    opened when the first record is written.
+
+    Arguments:
+        filename (str) optional: Name of the log file.
+        asynchronous (bool) optional: Write the records from a background
+        thread.
+
+    Returns:
+        logger
+    """
+    global _LOG_CONFIGURED, _LOG_LISTENER  # pylint: disable=global-statement
+    import logging.handlers
+    logger = logging.getLogger(__name__)
+    with _LOG_LOCK:
+        if _LOG_CONFIGURED:
+            return logger
+        logger.setLevel(logging.DEBUG)
+        file_handle = logging.FileHandler(filename, delay=True)
+        file_handle.setLevel(logging.DEBUG)
+        console_handle = logging.StreamHandler()
+        console_handle.setLevel(logging.ERROR)
+        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        formatter = logging.Formatter(log_format)
+        file_handle.setFormatter(formatter)
+        console_handle.setFormatter(formatter)
+        if asynchronous:
+            log_queue = queue.SimpleQueue()
+            _LOG_LISTENER = logging.handlers.QueueListener(
+                log_queue, file_handle, console_handle,
+                respect_handler_level=True)
+            _LOG_LISTENER.start()
+            atexit.register(_LOG_LISTENER.stop)
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        else:
+            logger.addHandler(file_handle)
+            logger.addHandler(console_handle)
+        _LOG_CONFIGURED = True
+    return logger
+
+
+def _to_date(value):
+    """Convert None (today), a "YYYY-MM-DD" string or a datetime into a
+    datetime.date.
+    """
+    if value is None:
+        return date.today()
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _location_id(headers):
+    """Get the id at the end of the Location header of a created resource,
+    e.g. the order id of a placed order. None if there is no header.
+    """
+    location = headers.get("Location")
+    if not location:
+        return None
+    return location.rstrip("/").split("/")[-1]
+
+
+def endpoint_name(url):
+    """Get the name of the endpoint of a request url, e.g. "watchlists" for
+    "accounts/123/watchlists/456". Used as key for per endpoint settings
+    and statistics.
+
+    Arguments:
+        url (str): Request url relative to the base url.
+    """
+    path = url.split("?", 1)[0].strip("/").split("/")
+    if path[0] == "accounts":
+        return "account" if len(path) < 3 else path[2]
+    if path[0] == "marketdata":
+        return path[-1]
+    return path[0]
+
+
+def decode_candles(candles, as_frame=True):
+    """Decode the candles of a pricehistory response in one pass into typed
+    columns. The epoch milliseconds are converted to datetime64[ms] at once.
+
+    Arguments:
+        candles (list): List of candle dicts with keys datetime, open, high,
+        low, close and volume.
+        as_frame (bool): Return a DataFrame indexed by datetime. If False,
+        return a NumPy structured array of dtype CANDLE_DTYPE.
+    """
+    import numpy as np
+    candle_dtype, raw_dtype = candle_dtypes()
+    data = np.fromiter(map(_candle_getter, candles), dtype=raw_dtype,
+                       count=len(candles)).view(candle_dtype)
+    if not as_frame:
+        return data
+    return candles_to_frame(data)
+
+
+def candles_to_frame(data):
+    """Convert a structured array of dtype CANDLE_DTYPE into a DataFrame
+    indexed by datetime.
+    """
+    import pandas as pd
+    index = pd.DatetimeIndex(data["datetime"], name="datetime")
+    return pd.DataFrame({field: data[field] for field in CANDLE_FIELDS},
+                        index=index)
+
+
+def quotes_to_frame(quotes):
+    """Convert a quotes response into a DataFrame indexed by symbol with
+    typed bid, ask, last and volume columns. Missing prices are NaN and
+    missing volumes 0.
+
+    Arguments:
+        quotes (dict): Quotes keyed by symbol.
+    """
+    import numpy as np
+    import pandas as pd
+    values = list(quotes.values())
+    columns = dict()
+    for column, key, dtype in QUOTE_COLUMNS:
+        default = np.nan if dtype == "float64" else 0
+        columns[column] = np.fromiter((quote.get(key, default)
+                                       for quote in values),
+                                      dtype=dtype, count=len(values))
+    return pd.DataFrame(columns, index=pd.Index(list(quotes), name="symbol"))
+
+
 class TDAmeritrade:
     """Class to for format http urls to conform to the TDAmeritrade API.  Sends
-    the http request (GET, PUT, or POST). Saves the response (if any) into
-    class variable message.
+    the http request (GET, PUT, or POST). Every method returns the response
+    of its own request, so one instance can be shared across threads (see
+    bulk).
 
     Class variables
-        message (str): Last request.response obtained from TD Ameritrade API
-        rpc.
         logger (logger): Logger
         account_no: TD Ameritrade account number to post rpcs
         oath_hash: OAuth 2.0 certificate used to validate rpc
+        token_manager: Holds and renews the OAuth 2.0 access token
+        metrics: Per endpoint request timing histograms and counters
+        log_payload_rate: Fraction of the request/response payloads logged
+        transport: HTTP transport shared by every request (keep-alive pool)
+        base_url: Base url of the API
+        scheduler: Rate limiter pacing the requests (priority lanes)
+        price_cache: On-disk price history cache (None to disable)
+        response_cache: In-memory cache of GET responses (None to disable)
 
     Example:
     >>td = TDAmeritrade("account_no.txt", "oAuth.txt")
     >>td.get_watchlist()
 
     """
-    def __init__(self, filename_account, filename_oauth):
+    def __init__(self, filename_account, filename_oauth, transport=None,
+                 base_url=BASE_URL, scheduler=None, price_cache=None,
+                 response_cache=None, token_manager=None, metrics=None,
+                 log_payload_rate=0., decoder=None, stream_candles=False,
+                 account_state=None):
         """Setup a logger. Get the account number and OAuth2.0 certificate from
         an external file that is necessary for the request url and request
         headers. The account and OAuth2.0 certificate are not included as they
@@ -60,30 +276,93 @@ class TDAmeritrade:
             number.
             filename_oath (str): Name of the file containing the OAuth
             certificate.
+            transport (HTTPTransport) optional: Transport used to send the
+            requests. Defaults to a keep-alive HTTPTransport.
+            base_url (str) optional: Base url of the API.
+            scheduler (RequestScheduler) optional: Rate limiter used to pace
+            the requests. Defaults to the TD Ameritrade quota of 120 requests
+            per minute.
+            price_cache (PriceHistoryCache) optional: On-disk cache used by
+            get_price_history to fetch only the missing candles.
+            response_cache (ResponseCache) optional: TTL cache of GET
+            responses of read-only endpoints. Invalidated when an order is
+            submitted.
+            token_manager (TokenManager) optional: Renews the access token
+            with a refresh token. Defaults to the static token read from
+            filename_oauth.
+            metrics (Metrics) optional: Collects the request timings.
+            Defaults to a new Metrics.
+            log_payload_rate (float) optional: Fraction of the requests whose
+            request and response payloads are logged at DEBUG level. Off by
+            default, as large payloads are costly to format and write.
+            decoder (callable) optional: JSON decoder taking the response
+            body as bytes. Defaults to the fastest installed, see
+            decoders.get_decoder, looked up with the first response.
+            stream_candles (bool) optional: Parse the price history candles
+            incrementally while the body is read, into a preallocated
+            buffer. Lowers the peak memory of large histories.
+            account_state (state.AccountState) optional: Store of the
+            account state the accepted orders are recorded in.
         """
         self._setup_logging()
         self.account_no = self.get_account_number(filename_account)
-        self.oauth_hash = self.get_oauth_hash(filename_oauth)
+        self.transport = HTTPTransport() if transport is None else transport
+        oauth_hash = self.get_oauth_hash(filename_oauth)
+        if token_manager is None:
+            token_manager = TokenManager(access_token=oauth_hash)
+        elif token_manager.access_token is None:
+            token_manager.access_token = oauth_hash
+        if token_manager.transport is None:
+            token_manager.transport = self.transport
+        token_manager.start()
+        self.token_manager = token_manager
+        self.base_url = base_url
+        self.scheduler = RequestScheduler() if scheduler is None \
+            else scheduler
+        self.price_cache = price_cache
+        self.response_cache = response_cache
+        self.metrics = Metrics() if metrics is None else metrics
+        self.log_payload_rate = log_payload_rate
+        self._decoder = decoder
+        self.stream_candles = stream_candles
+        self.account_state = account_state
+
+    def for_account(self, account_no):
+        """Get a client of another account sharing this client's transport,
+        token manager, scheduler, caches and metrics. The account_state is
+        not shared.
 
-        self.message = None
+        Arguments:
+            account_no (str): Account number.
+        """
+        client = copy.copy(self)
+        client.account_no = str(account_no)
+        client.account_state = None
+        return client
 
     def _setup_logging(self):
-        """Set up a logger.
+        """Set up a logger. The handlers are installed only once, see
+        setup_logging.
         """
-        # create logger with 'spam_application'
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.DEBUG)
-        file_handle = logging.FileHandler('tdameritrade.log')
-        file_handle.setLevel(logging.DEBUG)
-        console_handle = logging.StreamHandler()
-        console_handle.setLevel(logging.ERROR)
-        log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        formatter = logging.Formatter(log_format)
-        file_handle.setFormatter(formatter)
-        console_handle.setFormatter(formatter)
-        logger.addHandler(file_handle)
-        logger.addHandler(console_handle)
-        self._logger = logger
+        self._logger = setup_logging()
+
+    @property
+    def decoder(self):
+        """JSON decoder of the response bodies.
+        """
+        if self._decoder is None:
+            self._decoder = get_decoder()
+        return self._decoder
+
+    @decoder.setter
+    def decoder(self, decoder):
+        self._decoder = decoder
+
+    @property
+    def oauth_hash(self):
+        """Current OAuth 2.0 access token.
+        """
+        return self.token_manager.get_token()
 
     @staticmethod
     def get_account_number(filename):
@@ -96,7 +375,7 @@ class TDAmeritrade:
             number.
         """
         with open(filename) as file_obj:
-            account_no = file_obj.readlines()[0]
+            account_no = file_obj.readline()
         account_no = account_no.rstrip("\n")
         return account_no
 
@@ -111,56 +390,190 @@ class TDAmeritrade:
             certificate.
         """
         with open(filename) as file_obj:
-            oauth_hash = file_obj.readlines()[0]
+            oauth_hash = file_obj.readline()
         oauth_hash = oauth_hash.rstrip("\n")
         return oauth_hash
 
+    def _log_payload(self):
+        """Whether the payloads of this request are logged. Payloads are
+        logged at DEBUG level for a sampled log_payload_rate fraction of the
+        requests.
+        """
+        rate = self.log_payload_rate
+        if rate <= 0. or not self._logger.isEnabledFor(logging.DEBUG):
+            return False
+        return rate >= 1. or random.random() < rate
+
+    def _execute(self, method, url, headers=None, body=None,
+                 priority=PRIORITY_NORMAL, endpoint=None, stream=False):
+        """Send a request through the scheduler and the transport. Adds the
+        OAuth 2.0 header. Retries with backoff on HTTP 429 and, for GET
+        requests, on HTTP 5xx. A 429 pauses every lane of the scheduler. POST
+        requests are not retried on 5xx as the order may already have been
+        accepted. An HTTP 401 renews the access token and retries once.
+
+        Arguments:
+            method (str): GET | POST
+            url (str): Absolute url.
+            headers (dict): Request headers.
+            body (bytes): Request body.
+            priority (int): Scheduler lane (PRIORITY_HIGH | PRIORITY_NORMAL).
+            endpoint (str): Endpoint name the metrics are recorded under.
+            stream (bool): Leave the body of a successful response unread,
+            see HTTPTransport.request.
+
+        Returns:
+            Response
+        """
+        if endpoint is None:
+            endpoint = endpoint_name(url[len(self.base_url):])
+        headers = dict() if headers is None else dict(headers)
+        token = self.token_manager.get_token()
+        attempt = 0
+        renewed = False
+        while True:
+            headers["Authorization"] = "Bearer {}".format(token)
+            self.scheduler.acquire(priority)
+            try:
+                response = self.transport.request(method, url,
+                                                  headers=headers, body=body,
+                                                  stream=stream)
+            except Exception:
+                self.metrics.count(endpoint, "requests")
+                self.metrics.count(endpoint, "errors")
+                raise
+            self.metrics.record_response(endpoint, response)
+            status = response.status
+            if status == 401 and not renewed:
+                renewed = True
+                token = self.token_manager.invalidate(token)
+                if token is not None:
+                    self._logger.warning("HTTP 401, access token renewed: %s",
+                                         url)
+                    continue
+                return response
+            retry = status == 429 or (status >= 500 and method == "GET")
+            if not retry or attempt >= self.scheduler.max_retries:
+                return response
+            delay = self.scheduler.backoff_delay(
+                attempt, response.headers.get("Retry-After"))
+            self._logger.warning("HTTP %s, retrying in %.1fs: %s", status,
+                                 delay, url)
+            if status == 429:
+                self.scheduler.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+
 #    @print_message
-    def _send_request(self, url, data=None):
-        """Make the rpc. Creates a request object from a base url contatenated
+    def _send_request(self, url, data=None, priority=PRIORITY_NORMAL):
+        """Make the rpc. Builds the full url from the base url contatenated
         with the additional url information provided by the argument. Adds
-        headers, such as content type, length, ..., as well as the OAuth2.0
-        header. For PUT calls, converts the data object to JSON and encodes.
+        headers, such as content type, as well as the OAuth2.0 header. For
+        POST calls, converts the data object to JSON and encodes. The request
+        is sent over the shared keep-alive transport.
 
         Arguments:
         url (str): Specific url details to add to the base url for the request.
-        data (dict): Dictionary with details required for the request.
+        data (dict or bytes): Dictionary with details required for the
+        request, or the already JSON encoded body.
+        priority (int): Scheduler lane (PRIORITY_HIGH | PRIORITY_NORMAL).
+
+        Returns:
+            The decoded JSON response of a GET request, the id at the end of
+            the Location header (None if there is none) of a POST request.
         """
-        base_url = "https://api.tdameritrade.com/v1/"
-        url = base_url + url
-        request = urllib.request.Request(url)
-        request.add_header("Authorization", "Bearer {}"
-                           .format(self.oauth_hash).encode("utf-8"))
+        endpoint, key = endpoint_name(url), url
+        cache = self.response_cache
+        if data is None and cache is not None and cache.cacheable(endpoint):
+            hit, message = cache.get(endpoint, key)
+            if hit:
+                return message
+        else:
+            cache = None
+        start = time.perf_counter()
+        url = self.base_url + url
+        headers = dict()
+        if data is None:
+            method, body = "GET", None
+        else:
+            method = "POST"
+            headers["Content-Type"] = "application/json; charset=utf-8"
+            if isinstance(data, bytes):
+                body = data
+            else:
+                body = json.dumps(data).encode("utf-8")
+        log_payload = self._log_payload()
+        self._logger.info("URL: %s", url)
+        self._logger.debug("headers: %s", headers)
+        if body is not None and log_payload:
+            self._logger.debug("data: %s", body)
+        response = self._execute(method, url, headers=headers, body=body,
+                                 priority=priority, endpoint=endpoint)
+        status = response.status
+        if status >= 400:
+            self._logger.error("response: %s %s", status, response.body)
+            from urllib.error import HTTPError
+            raise HTTPError(url, status, response.reason, response.headers,
+                            io.BytesIO(response.body))
+        message = None
         if data is None:
-            self._logger.info("URL: %s", request.get_full_url())
-            self._logger.debug("headers: %s", request.headers)
-            response = urllib.request.urlopen(request)
-            self.message = json.loads(response.read().decode("utf-8"))
+            decode_start = time.perf_counter()
+            message = self.decoder(response.body)
+            self.metrics.observe(endpoint, "decode",
+                                 time.perf_counter() - decode_start)
+            if cache is not None:
+                cache.put(endpoint, key, message)
         else:
-            request.add_header("""Content-Type", "application/json;\
-                                  charset=utf-8""")
-            data = json.dumps(data).encode("utf-8")
-            request.add_header("Content-Length", len(data))
-            self._logger.info("URL: %s", request.get_full_url())
-            self._logger.debug("headers: %s", request.headers)
-            self._logger.debug("data: %s", data)
-            response = urllib.request.urlopen(request, data=data)
-        status = response.getcode()
+            message = _location_id(response.headers)
+            if self.response_cache is not None:
+                self.response_cache.invalidate(ORDER_INVALIDATES)
+        if log_payload:
+            self._logger.debug("response: %s", message)
         if (status == 200 or status == 201):
-            self._logger.info("response: %s", self.message)
+            self._logger.info("response: %s %s bytes", status,
+                              len(response.body))
         else:
-            self._logger.error("response: %s", self.message)
+            self._logger.error("response: %s %s", status, message)
+        self.metrics.observe(endpoint, "total", time.perf_counter() - start)
+        return message
+
+    def bulk(self, method, calls, max_workers=8):
+        """Run many calls of a method on a thread pool sharing this client
+        (connection pool, scheduler and caches). Results are returned in the
+        order of the calls. The first exception raised by a call is
+        re-raised.
+
+        Arguments:
+            method (callable or str): Bound method of this client, or its
+            name, e.g. "get_price_history".
+            calls (iterable): Keyword argument dicts, one per call.
+            max_workers (int) optional: Number of worker threads.
+
+        Example:
+        >>td.bulk("get_price_history", [{"symbol": sym} for sym in symbols])
+        """
+        if isinstance(method, str):
+            method = getattr(self, method)
+        calls = list(calls)
+        if len(calls) <= 1:
+            return [method(**kwargs) for kwargs in calls]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(method, **kwargs) for kwargs in calls]
+            return [future.result() for future in futures]
 
     def get_account_info(self, fields="positions,orders"):
         """Get account information.
 
         Arguments:
             fields (list) optional: List of fields requested.
-            (e.g. ["positions", "orders"])
+            (e.g. ["positions", "orders"]). None for the balances only.
         """
-        url = "accounts/{}?fields={}".format(self.account_no, fields)
-        self._send_request(url)
-        return self.message
+        if fields is None:
+            url = "accounts/{}".format(self.account_no)
+        else:
+            url = "accounts/{}?fields={}".format(self.account_no, fields)
+        return self._send_request(url)
 
     def get_orders(self, max_results=100, from_date=None, to_date=None,
                    order_status="WORKING"):
@@ -172,23 +585,21 @@ class TDAmeritrade:
             to_date (obj datetime.date): Most current date to retreive orders
             order_status (str): Most likely FILLED | WORKING
         """
-        order_status = None
         if to_date is None:
             to_date = datetime.strftime(datetime.today(), format="%Y-%m-%d")
         if from_date is None:
             from_date = datetime.strftime(datetime.today() - timedelta(35),
                                           format="%Y-%m-%d")
         if order_status is None:
-            url = """orders?accountId={}&maxResults={}&fromEnteredTime={}\
-                     &toEnteredTime={}"""\
+            url = ("orders?accountId={}&maxResults={}&fromEnteredTime={}"
+                   "&toEnteredTime={}")\
                 .format(self.account_no, max_results, from_date, to_date)
         else:
-            url = """orders?accountID={}&maxResults={}&fromEnteredTime={}\
-                     &toEnteredTime={}&status={}"""\
+            url = ("orders?accountId={}&maxResults={}&fromEnteredTime={}"
+                   "&toEnteredTime={}&status={}")\
                     .format(self.account_no, max_results, from_date, to_date,
                             order_status)
-        self._send_request(url)
-        return self.message
+        return self._send_request(url)
 
     def get_transactions(self, trans_type="TRADE", from_date=None, to_date=None,
                       symbol="SPYG"):
@@ -203,33 +614,157 @@ class TDAmeritrade:
             url = "accounts/{}/transactions?type={}&startDate={}&endDate={}"\
                     .format(self.account_no, trans_type, from_date, to_date)
         else:
-            url = """accounts/{}/transactions?type={}&symbol={}&startDate={}\
-                     &endDate={}"""\
+            url = ("accounts/{}/transactions?type={}&symbol={}&startDate={}"
+                   "&endDate={}")\
                     .format(self.account_no, trans_type, symbol, from_date,
                             to_date)
-        self._send_request(url)
-        return self.message
+        return self._send_request(url)
+
+    def _iter_windows(self, fetch, from_date, to_date, window_days, id_key,
+                      max_workers, limit=None):
+        """Split a date range into windows, fetch the windows concurrently
+        and yield the records as the windows complete. Records are
+        de-duplicated by id_key. A window returning limit records or more
+        may have been truncated and is split in half and fetched again.
+
+        Arguments:
+            fetch (callable): Called as fetch(from_date, to_date) with
+            datetime.date arguments, returns a list of records.
+            from_date (datetime.date): First day of the range.
+            to_date (datetime.date): Last day of the range.
+            window_days (int): Number of days per window.
+            id_key (str): Record key used to de-duplicate.
+            max_workers (int): Number of windows fetched concurrently.
+            limit (int) optional: Maximum number of records of a response.
+        """
+        windows = list()
+        start = from_date
+        while start <= to_date:
+            end = min(start + timedelta(window_days - 1), to_date)
+            windows.append((start, end))
+            start = end + timedelta(1)
+        windows.reverse()
+
+        seen = set()
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, \
+            wait
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = dict()
+            while windows or pending:
+                while windows and len(pending) < max_workers:
+                    window = windows.pop()
+                    pending[executor.submit(fetch, *window)] = window
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    records = future.result() or list()
+                    if (limit is not None and len(records) >= limit
+                            and end > start):
+                        middle = start + (end - start) // 2
+                        windows.extend([(middle + timedelta(1), end),
+                                        (start, middle)])
+                        continue
+                    for record in records:
+                        record_id = record.get(id_key)
+                        if record_id in seen:
+                            continue
+                        seen.add(record_id)
+                        yield record
+
+    def iter_orders(self, from_date, to_date=None, order_status=None,
+                    window_days=30, max_results=100, max_workers=4,
+                    as_models=False):
+        """Iterate over the orders of a long date range. The range is split
+        into windows fetched concurrently, windows hitting max_results are
+        split further. Orders are yielded as they arrive, once per orderId.
+
+        Arguments:
+            from_date (obj datetime.date): Oldest date to retreive orders
+            to_date (obj datetime.date) optional: Most current date to
+            retreive orders. Defaults to today.
+            order_status (str) optional: Most likely FILLED | WORKING
+            window_days (int) optional: Number of days per request.
+            max_results (int) optional: Maximum number of orders per request.
+            max_workers (int) optional: Number of concurrent requests.
+            as_models (bool) optional: Yield models.Order records instead of
+            the decoded JSON dicts.
+        """
+        def fetch(start, end):
+            return self.get_orders(max_results=max_results,
+                                   from_date=start.isoformat(),
+                                   to_date=end.isoformat(),
+                                   order_status=order_status)
+
+        orders = self._iter_windows(fetch, _to_date(from_date),
+                                    _to_date(to_date), window_days, "orderId",
+                                    max_workers, limit=max_results)
+        return map(Order.from_json, orders) if as_models else orders
+
+    def iter_transactions(self, from_date, to_date=None, trans_type="TRADE",
+                          symbol=None, window_days=30, max_workers=4,
+                          as_models=False):
+        """Iterate over the transactions of a long date range. The range is
+        split into windows fetched concurrently. Transactions are yielded as
+        they arrive, once per transactionId.
+
+        Arguments:
+            from_date (obj datetime.date): First day of the range.
+            to_date (obj datetime.date) optional: Last day of the range.
+            Defaults to today.
+            trans_type (str) optional: Transaction type, e.g. TRADE.
+            symbol (str) optional: Only transactions of this symbol.
+            window_days (int) optional: Number of days per request.
+            max_workers (int) optional: Number of concurrent requests.
+            as_models (bool) optional: Yield models.Transaction records
+            instead of the decoded JSON dicts.
+        """
+        def fetch(start, end):
+            return self.get_transactions(trans_type=trans_type,
+                                         from_date=start.isoformat(),
+                                         to_date=end.isoformat(),
+                                         symbol=symbol)
+
+        transactions = self._iter_windows(fetch, _to_date(from_date),
+                                          _to_date(to_date), window_days,
+                                          "transactionId", max_workers)
+        if as_models:
+            return map(Transaction.from_json, transactions)
+        return transactions
 
     def get_watchlists(self):
         """Get all watchlists in account.
         """
         url = "accounts/{}/watchlists".format(self.account_no)
-        self._send_request(url)
-        return self.message
+        return self._send_request(url)
 
     def get_watchlist(self, id="1148189253"):
         """Get watchlist. Defaults to CommissionFree.
         """
         url = "accounts/{}/watchlists/{}".format(self.account_no, id)
-        self._send_request(url)
-        return self.message
+        return self._send_request(url)
+
+    def get_user_principals(self,
+                            fields="streamerSubscriptionKeys,"
+                                   "streamerConnectionInfo"):
+        """Get the user principals, including the streamer connection
+        information used by streaming.TDStreamer.
+
+        Arguments:
+            fields (str) optional: Comma separated additional fields.
+        """
+        url = "userprincipals?fields={}".format(fields)
+        return self._send_request(url)
 
     def get_refresh_token(self):
-        """Get a refresh token.
+        """Get a refresh token. Renews the access token together with the
+        refresh token (access_type offline). Requires a token_manager with a
+        refresh token and client id.
         References:
         https://developer.tdameritrade.com/content/simple-auth-local-apps
         https://developer.tdameritrade.com/authentication/apis/post/token-0
         """
+        self.token_manager.refresh(access_type="offline")
+        return self.token_manager.refresh_token
 
     def get_recent_orders(self):
         """Get orders that were filled in the last 35 days. This is to
@@ -238,13 +773,9 @@ class TDAmeritrade:
         to_date = datetime.strftime(datetime.today(), format="%Y-%m-%d")
         from_date = datetime.strftime(datetime.today() - timedelta(35),
                                       format="%Y-%m-%d")
-        orders = self.get_orders(max_results=100, from_date=from_date, to_date=to_date,
-                     order_status="FILLED")
-        orders = list()
-        for order in self.message:
-            orders.append(order["orderLegCollection"]
-                          [0]["instrument"]["symbol"])
-        return orders
+        orders = self.get_orders(max_results=100, from_date=from_date,
+                                 to_date=to_date, order_status="FILLED")
+        return [Order.from_json(order).symbol for order in orders]
 
     def get_recent_transactions(self):
         """Get orders that were filled in the last 35 days. This is to
@@ -254,16 +785,17 @@ class TDAmeritrade:
         from_date = datetime.strftime(datetime.today() - timedelta(35),
                                       format="%Y-%m-%d")
         # TODO use all free etfs
-        for sym in ["SPYG", "SPYV"]:  # free_etfs:
-            self._transactions(trans_type="BUY_ONLY", from_date=from_date,
-                               to_date=to_date, symbol=sym)
+        calls = [{"trans_type": "BUY_ONLY", "from_date": from_date,
+                  "to_date": to_date, "symbol": sym}
+                 for sym in ["SPYG", "SPYV"]]  # free_etfs:
         transactions = list()
-        for trans in self.message:
-            transactions.append({
-                "date": trans["transactionDate"],
-                "fee": trans["fees"]["commission"],
-                "symbol": trans["transactionItem"]["instrument"]["symbol"]
-            })
+        for message in self.bulk(self.get_transactions, calls):
+            for trans in map(Transaction.from_json, message):
+                transactions.append({
+                    "date": trans.date,
+                    "fee": trans.commission,
+                    "symbol": trans.symbol
+                })
         return transactions
 
     def get_commission_free_etfs(self):
@@ -271,9 +803,9 @@ class TDAmeritrade:
         a watchlist.
         """
         watchlist_id = "1148189253"
-        self.get_watchlist(id=watchlist_id)
+        watchlist = self.get_watchlist(id=watchlist_id)
         symbols = list()
-        for itm in self.message["watchlistItems"]:
+        for itm in watchlist["watchlistItems"]:
             symbols.append(itm["instrument"]["symbol"])
         return symbols
 
@@ -284,24 +816,9 @@ class TDAmeritrade:
         instruction (str): "BUY" | "SELL"
         """
         url = "accounts/{}/savedorders".format(self.account_no)
-        data = {
-            "orderType": "LIMIT",
-            "session": "NORMAL",
-            "price": price,
-            "duration": "DAY",
-            "orderStrategyType": "SINGLE",
-            "orderLegCollection": [
-                {
-                    "instruction": instruction,
-                    "quantity": quantity,
-                    "instrument": {
-                        "symbol": symbol,
-                        "assetType": "EQUITY"
-                    }
-                }
-            ]
-        }
-        self._send_request(url, data=data)
+        data = LIMIT_ORDER.render(symbol=symbol, price=price,
+                                  quantity=quantity, instruction=instruction)
+        self._send_request(url, data=data, priority=PRIORITY_HIGH)
 
     def place_order(self, symbol=None, price=None, quantity=0,
                     instruction=None):
@@ -310,60 +827,555 @@ class TDAmeritrade:
         instruction (str): "BUY" | "SELL"
         """
         url = "accounts/{}/orders".format(self.account_no)
-        data = {
-            "orderType": "LIMIT",
-            "session": "NORMAL",
-            "price": price,
-            "duration": "DAY",
-            "orderStrategyType": "SINGLE",
-            "orderLegCollection": [
-                {
-                    "instruction": instruction,
-                    "quantity": quantity,
-                    "instrument": {
-                        "symbol": symbol,
-                        "assetType": "EQUITY"
-                    }
-                }
-            ]
-        }
-        self._send_request(url, data=data)
+        data = LIMIT_ORDER.render(symbol=symbol, price=price,
+                                  quantity=quantity, instruction=instruction)
+        order_id = self._send_request(url, data=data, priority=PRIORITY_HIGH)
+        if self.account_state is not None:
+            self.account_state.record_submission(symbol, price, quantity,
+                                                 instruction,
+                                                 order_id=order_id)
 
-    def get_price_history(self, symbol=None, period_type="month", period="3",
-                          frequency_type="daily", frequency=1,
-                          end_date=int(time.time()*1000), start_date=None,
-                          extended_hours="true"):
-        """Get the price history.
+    def place_orders(self, orders, saved=False, dry_run=False,
+                     template=LIMIT_ORDER, max_workers=8):
+        """Submit a batch of orders concurrently in the high priority lane of
+        the scheduler. The payloads are serialized from a pre-compiled
+        template. A failed order does not stop the batch.
+
+        Arguments:
+            orders (iterable): (symbol, price, quantity, instruction) tuples.
+            saved (bool) optional: Create saved orders instead of orders.
+            dry_run (bool) optional: Only serialize the payloads, nothing is
+            sent. Useful to benchmark serialization throughput offline.
+            template (OrderTemplate) optional: Payload template.
+            max_workers (int) optional: Number of concurrent submissions.
+
+        Returns:
+            list of dict, one per order in submission order: symbol, status
+            (HTTP status, None on dry run or error), order_id (from the
+            Location header), latency (seconds) and error (None or message).
+        """
+        path = "savedorders" if saved else "orders"
+        url = "{}accounts/{}/{}".format(self.base_url, self.account_no, path)
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+
+        def submit(order):
+            symbol, price, quantity, instruction = order
+            result = {"symbol": symbol, "status": None, "order_id": None,
+                      "latency": None, "error": None}
+            start = time.perf_counter()
+            body = template.render(symbol=symbol, price=price,
+                                   quantity=quantity, instruction=instruction)
+            if dry_run:
+                result["latency"] = time.perf_counter() - start
+                return result
+            try:
+                response = self._execute("POST", url, headers=headers,
+                                         body=body, priority=PRIORITY_HIGH,
+                                         endpoint=path)
+            except Exception as err:  # pylint: disable=broad-except
+                result["error"] = repr(err)
+                self._logger.error("order %s failed: %r", symbol, err)
+            else:
+                result["status"] = response.status
+                result["order_id"] = _location_id(response.headers)
+                if response.status >= 400:
+                    result["error"] = response.body.decode("utf-8", "replace")
+                    self._logger.error("order %s rejected: %s %s", symbol,
+                                       response.status, result["error"])
+                elif not saved and self.account_state is not None:
+                    self.account_state.record_submission(
+                        symbol, price, quantity, instruction,
+                        order_id=result["order_id"])
+            result["latency"] = time.perf_counter() - start
+            return result
+
+        orders = list(orders)
+        if dry_run or len(orders) <= 1:
+            results = [submit(order) for order in orders]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(submit, orders))
+        if not dry_run and self.response_cache is not None:
+            self.response_cache.invalidate(ORDER_INVALIDATES)
+        return results
+
+    def _fetch_candles(self, symbol, period_type, period, frequency_type,
+                       frequency, end_date, start_date, extended_hours):
+        """Request the price history and decode it into a structured array.
         """
         if start_date is None:
-            url = """marketdata/{}/pricehistory?periodType={}&period={}\
-                     &frequencyType={}&frequency={}&endDate={}\
-                     &needExtendedHoursData={}"""\
+            url = ("marketdata/{}/pricehistory?periodType={}&period={}"
+                   "&frequencyType={}&frequency={}&endDate={}"
+                   "&needExtendedHoursData={}")\
                 .format(symbol, period_type, period, frequency_type, frequency,
                         end_date, extended_hours)
         else:
-            url = """marketdata/{}/pricehistory?periodType={}&frequencyType={}\
-                    &frequency={}&endDate={}&startDate={}\
-                    &needExtendedHoursData={}"""\
+            url = ("marketdata/{}/pricehistory?periodType={}&frequencyType={}"
+                   "&frequency={}&endDate={}&startDate={}"
+                   "&needExtendedHoursData={}")\
                     .format(symbol, period_type, frequency_type, frequency,
                             end_date, start_date, extended_hours)
-        self._send_request(url)
-        data = np.array([[datetime.fromtimestamp(t["datetime"]/1000.).date(),
-                          t["open_price"], t["high"], t["low"],
-                          t["close_price"], t["volume"]]
-                         for t in self.message["candles"]])
-        data = pd.DataFrame(index=data[:, 0],
-                            columns=["open", "high", "low", "close", "volume"],
-                            data=data[:, 1:])
-        return data
+        if self.stream_candles:
+            return self._stream_candles(url)
+        message = self._send_request(url)
+        return decode_candles(message["candles"], as_frame=False)
+
+    def _stream_candles(self, url):
+        """Request the price history and parse the candles while the body is
+        read from the socket, without holding the full body or the decoded
+        message in memory.
+        """
+        endpoint = endpoint_name(url)
+        start = time.perf_counter()
+        url = self.base_url + url
+        self._logger.info("URL: %s", url)
+        response = self._execute("GET", url, endpoint=endpoint, stream=True)
+        if response.status >= 400:
+            self._logger.error("response: %s %s", response.status,
+                               response.body)
+            from urllib.error import HTTPError
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, io.BytesIO(response.body))
+        candle_dtype, raw_dtype = candle_dtypes()
+        parser = CandleStreamParser(raw_dtype,
+                                    ("datetime",) + CANDLE_FIELDS,
+                                    capacity=4096, decoder=self.decoder)
+        try:
+            for chunk in response.iter_content():
+                parser.feed(chunk)
+        finally:
+            response.close()
+        self.metrics.observe(endpoint, "download",
+                             response.timings["download"])
+        self.metrics.count(endpoint, "response_bytes",
+                           response.bytes_received)
+        self._logger.info("response: %s %s bytes", response.status,
+                          response.bytes_received)
+        self.metrics.observe(endpoint, "total", time.perf_counter() - start)
+        return parser.result().view(candle_dtype)
+
+    def _fetch_cached_candles(self, symbol, period_type, period,
+                              frequency_type, frequency, end_date,
+                              extended_hours):
+        """Get the price history through the on-disk cache. Only the candles
+        after the last cached one are requested and merged into the cache,
+        none if the cache reaches end_date. The full period is requested if
+        the cache does not reach back to the start of the period; cached
+        candles after end_date are kept, so the cache never loses its most
+        recent candles. Regular and extended hours histories are cached
+        apart.
+        """
+        import numpy as np
+        from cache import period_start, START_SLACK_DAYS
+        cache = self.price_cache
+        start = period_start(period_type, period, end_date)
+        end = np.datetime64(int(end_date), "ms")
+        key = (symbol, frequency_type, frequency)
+        with cache.lock(*key, extended_hours=extended_hours):
+            cached = cache.load(*key, extended_hours=extended_hours)
+            if cached is not None and len(cached) == 0:
+                cached = None
+            slack = np.timedelta64(START_SLACK_DAYS, "D")
+            if cached is None or cached["datetime"][0] > start + slack:
+                data = self._fetch_candles(symbol, period_type, period,
+                                           frequency_type, frequency,
+                                           end_date, None, extended_hours)
+                if cached is not None:
+                    if len(data):
+                        cached = cached[cached["datetime"]
+                                        > data["datetime"][-1]]
+                    data = np.concatenate([data, cached])
+                cache.store(*key, data, extended_hours=extended_hours)
+            elif cached["datetime"][-1] < end:
+                last = int(cached["datetime"][-1].astype("int64"))
+                tail = self._fetch_candles(symbol, period_type, period,
+                                           frequency_type, frequency,
+                                           end_date, last, extended_hours)
+                data = cache.merge(cached, tail)
+                cache.store(*key, data, extended_hours=extended_hours)
+            else:
+                data = cached
+        dates = data["datetime"]
+        return data[(dates >= start) & (dates <= end)]
+
+    def get_price_history(self, symbol=None, period_type="month", period="3",
+                          frequency_type="daily", frequency=1,
+                          end_date=None, start_date=None,
+                          extended_hours="true", as_frame=True):
+        """Get the price history. If the client has a price_cache and no
+        start_date is given, only the candles missing from the cache are
+        requested. The cached history is then sliced from an estimate of the
+        start of the period (see cache.PERIOD_DAYS, e.g. 31 days a month),
+        so it may hold a few more candles at the start than an uncached
+        request. Pass start_date for exact bounds.
+
+        Arguments:
+            end_date (int) optional: Epoch milliseconds of the last candle.
+            Defaults to now.
+            start_date (int) optional: Epoch milliseconds of the first candle.
+            as_frame (bool) optional: Return a DataFrame indexed by datetime.
+            If False, return a NumPy structured array of dtype CANDLE_DTYPE
+            and skip pandas entirely.
+        """
+        if end_date is None:
+            end_date = int(time.time()*1000)
+        if self.price_cache is not None and start_date is None:
+            data = self._fetch_cached_candles(symbol, period_type, period,
+                                              frequency_type, frequency,
+                                              end_date, extended_hours)
+        else:
+            data = self._fetch_candles(symbol, period_type, period,
+                                       frequency_type, frequency, end_date,
+                                       start_date, extended_hours)
+        if not as_frame:
+            return data
+        return candles_to_frame(data)
+
+    def get_price_panel(self, symbols, period_type="month", period="3",
+                        frequency_type="daily", frequency=1, end_date=None,
+                        extended_hours="true", fill="backfill",
+                        max_workers=8):
+        """Get the price history of several symbols aligned on a shared time
+        index. The histories are fetched concurrently and written straight
+        into one dense float64 array of shape (time, symbol, field), the
+        fields in CANDLE_FIELDS order.
+
+        Arguments:
+            symbols (list): Symbols to request.
+            end_date (int) optional: Epoch milliseconds of the last candle.
+            Defaults to now, shared by every symbol.
+            fill (str or float) optional: backfill | ffill | a fill value for
+            the bars missing for a symbol. None leaves NaN.
+            max_workers (int) optional: Number of concurrent requests.
+
+        Returns:
+            analytics.PricePanel
+        """
+        from analytics import align_candles
+        symbols = list(symbols)
+        if end_date is None:
+            end_date = int(time.time()*1000)
+        calls = [dict(symbol=symbol, period_type=period_type, period=period,
+                      frequency_type=frequency_type, frequency=frequency,
+                      end_date=end_date, extended_hours=extended_hours,
+                      as_frame=False) for symbol in symbols]
+        histories = self.bulk("get_price_history", calls,
+                              max_workers=max_workers)
+        return align_candles(symbols, histories, fill=fill,
+                             fields=CANDLE_FIELDS)
+
+    def _quote_chunks(self, symbols, max_symbols=MAX_QUOTE_SYMBOLS,
+                      max_url_length=MAX_URL_LENGTH):
+        """Split the symbols into the fewest chunks whose quotes url fits
+        within max_url_length characters and max_symbols symbols.
+        """
+        base_length = len(self.base_url) + len("marketdata/quotes?symbol=")
+        chunks = list()
+        chunk = list()
+        length = base_length
+        for symbol in symbols:
+            symbol = urllib.parse.quote(symbol, safe="")
+            extra = len(symbol) + (3 if chunk else 0)
+            if chunk and (length + extra > max_url_length
+                          or len(chunk) >= max_symbols):
+                chunks.append(chunk)
+                chunk = list()
+                length = base_length
+                extra = len(symbol)
+            chunk.append(symbol)
+            length += extra
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def get_quotes(self, symbols=None, as_frame=True, max_symbols=None,
+                   max_workers=4):
+        """Get price quotes. Any number of symbols can be requested. The
+        symbols are split into chunks that fit the url length limit, the
+        chunks are fetched in parallel and the results are merged.
+
+        Arguments:
+            symbols (list): Symbols to quote.
+            as_frame (bool) optional: Return a DataFrame indexed by symbol
+            with columns bid, ask, last (float64) and volume (int64). If
+            False, return the merged quotes dict keyed by symbol.
+            max_symbols (int) optional: Maximum number of symbols per request.
+            max_workers (int) optional: Number of chunks fetched in parallel.
+        """
+        if max_symbols is None:
+            max_symbols = MAX_QUOTE_SYMBOLS
+        chunks = self._quote_chunks(symbols, max_symbols=max_symbols)
+
+        def fetch(chunk):
+            url = "marketdata/quotes?symbol={}".format("%2C".join(chunk))
+            return self._send_request(url)
+
+        quotes = dict()
+        if len(chunks) == 1:
+            quotes.update(fetch(chunks[0]))
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for message in executor.map(fetch, chunks):
+                    quotes.update(message)
+        if not as_frame:
+            return quotes
+        return quotes_to_frame(quotes)
+
+
+class AsyncTDAmeritrade:
+    """Asyncio variant of TDAmeritrade. Mirrors the methods of TDAmeritrade
+    as coroutines, iter_orders and iter_transactions as async generators.
+    The blocking requests run on a thread pool that shares a single
+    keep-alive transport, so up to max_concurrency requests are in flight at
+    once. The file readers (get_account_number, get_oauth_hash) and
+    for_account, which make no request, are left out: use them on client.
+
+    Class variables
+        client (TDAmeritrade): Synchronous client used to make the rpcs.
+        max_concurrency (int): Maximum number of concurrent requests.
+
+    Example:
+    >>td = AsyncTDAmeritrade("account_no.txt", "oAuth.txt")
+    >>async for sym, bars in td.get_price_history_many(["SPYG", "SPYV"]):
+    >>    print(sym, bars)
+
+    """
+    def __init__(self, filename_account, filename_oauth, max_concurrency=8,
+                 transport=None, base_url=BASE_URL, scheduler=None,
+                 price_cache=None, response_cache=None, token_manager=None,
+                 metrics=None, log_payload_rate=0., decoder=None,
+                 stream_candles=False, account_state=None):
+        """Create the synchronous client and the thread pool.
+
+        Arguments:
+            filename_account (str): Name of the file containing the account
+            number.
+            filename_oath (str): Name of the file containing the OAuth
+            certificate.
+            max_concurrency (int) optional: Maximum number of concurrent
+            requests.
+            transport (HTTPTransport) optional: Transport used to send the
+            requests. Defaults to a keep-alive pool of max_concurrency
+            connections.
+            base_url (str) optional: Base url of the API.
+            scheduler (RequestScheduler) optional: Rate limiter used to pace
+            the requests.
+            price_cache (PriceHistoryCache) optional: On-disk price history
+            cache.
+            response_cache (ResponseCache) optional: TTL cache of GET
+            responses.
+            token_manager (TokenManager) optional: Renews the access token.
+            metrics (Metrics) optional: Collects the request timings.
+            log_payload_rate (float) optional: Fraction of the payloads
+            logged.
+            decoder (callable) optional: JSON decoder taking bytes.
+            stream_candles (bool) optional: Parse the price history candles
+            incrementally.
+            account_state (state.AccountState) optional: Store the accepted
+            orders are recorded in.
+        """
+        if transport is None:
+            transport = HTTPTransport(pool_size=max_concurrency)
+        self.client = TDAmeritrade(filename_account, filename_oauth,
+                                   transport=transport, base_url=base_url,
+                                   scheduler=scheduler,
+                                   price_cache=price_cache,
+                                   response_cache=response_cache,
+                                   token_manager=token_manager,
+                                   metrics=metrics,
+                                   log_payload_rate=log_payload_rate,
+                                   decoder=decoder,
+                                   stream_candles=stream_candles,
+                                   account_state=account_state)
+        self.max_concurrency = max_concurrency
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def _run(self, function, *args, **kwargs):
+        """Run a blocking client method on the thread pool.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _iterate(self, iterator):
+        """Yield the items of a blocking iterator, each item being fetched on
+        the thread pool. The iterator is closed if the iteration stops early.
+        """
+        done = object()
+        try:
+            while True:
+                item = await self._run(next, iterator, done)
+                if item is done:
+                    return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self._run(close)
+
+    async def get_account_info(self, *args, **kwargs):
+        """See TDAmeritrade.get_account_info.
+        """
+        return await self._run(self.client.get_account_info, *args, **kwargs)
+
+    async def get_orders(self, *args, **kwargs):
+        """See TDAmeritrade.get_orders.
+        """
+        return await self._run(self.client.get_orders, *args, **kwargs)
+
+    async def get_transactions(self, *args, **kwargs):
+        """See TDAmeritrade.get_transactions.
+        """
+        return await self._run(self.client.get_transactions, *args, **kwargs)
+
+    async def iter_orders(self, *args, **kwargs):
+        """See TDAmeritrade.iter_orders. Yields the orders as they arrive.
+
+        Example:
+        >>async for order in td.iter_orders(date(2018, 1, 1)):
+        >>    print(order["orderId"])
+        """
+        iterator = self.client.iter_orders(*args, **kwargs)
+        async for order in self._iterate(iterator):
+            yield order
+
+    async def iter_transactions(self, *args, **kwargs):
+        """See TDAmeritrade.iter_transactions. Yields the transactions as
+        they arrive.
+        """
+        iterator = self.client.iter_transactions(*args, **kwargs)
+        async for transaction in self._iterate(iterator):
+            yield transaction
+
+    async def get_watchlists(self):
+        """See TDAmeritrade.get_watchlists.
+        """
+        return await self._run(self.client.get_watchlists)
+
+    async def get_watchlist(self, *args, **kwargs):
+        """See TDAmeritrade.get_watchlist.
+        """
+        return await self._run(self.client.get_watchlist, *args, **kwargs)
+
+    async def get_user_principals(self, *args, **kwargs):
+        """See TDAmeritrade.get_user_principals.
+        """
+        return await self._run(self.client.get_user_principals, *args,
+                               **kwargs)
+
+    async def get_refresh_token(self):
+        """See TDAmeritrade.get_refresh_token.
+        """
+        return await self._run(self.client.get_refresh_token)
+
+    async def get_recent_orders(self):
+        """See TDAmeritrade.get_recent_orders.
+        """
+        return await self._run(self.client.get_recent_orders)
+
+    async def get_recent_transactions(self):
+        """See TDAmeritrade.get_recent_transactions.
+        """
+        return await self._run(self.client.get_recent_transactions)
+
+    async def get_commission_free_etfs(self):
+        """See TDAmeritrade.get_commission_free_etfs.
+        """
+        return await self._run(self.client.get_commission_free_etfs)
+
+    async def create_saved_order(self, *args, **kwargs):
+        """See TDAmeritrade.create_saved_order.
+        """
+        return await self._run(self.client.create_saved_order, *args,
+                               **kwargs)
+
+    async def place_order(self, *args, **kwargs):
+        """See TDAmeritrade.place_order.
+        """
+        return await self._run(self.client.place_order, *args, **kwargs)
+
+    async def place_orders(self, *args, **kwargs):
+        """See TDAmeritrade.place_orders.
+        """
+        return await self._run(self.client.place_orders, *args, **kwargs)
+
+    async def get_price_history(self, *args, **kwargs):
+        """See TDAmeritrade.get_price_history.
+        """
+        return await self._run(self.client.get_price_history, *args,
+                               **kwargs)
+
+    async def get_quotes(self, *args, **kwargs):
+        """See TDAmeritrade.get_quotes.
+        """
+        return await self._run(self.client.get_quotes, *args, **kwargs)
+
+    async def get_price_panel(self, *args, **kwargs):
+        """See TDAmeritrade.get_price_panel.
+        """
+        return await self._run(self.client.get_price_panel, *args, **kwargs)
+
+    async def get_price_history_many(self, symbols, max_concurrency=None,
+                                     **kwargs):
+        """Get the price history of many symbols concurrently. Yields
+        (symbol, price history) tuples in the order the requests complete.
+
+        Arguments:
+            symbols (list): Symbols to request.
+            max_concurrency (int) optional: Maximum number of requests in
+            flight. Defaults to the client max_concurrency.
+            kwargs: Passed on to TDAmeritrade.get_price_history.
+        """
+        import asyncio
+        if max_concurrency is None:
+            max_concurrency = self.max_concurrency
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def fetch(symbol):
+            async with semaphore:
+                data = await self.get_price_history(symbol=symbol, **kwargs)
+            return symbol, data
+
+        tasks = [asyncio.ensure_future(fetch(sym)) for sym in symbols]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def bulk(self, method, calls, max_workers=None):
+        """Run many calls of a TDAmeritrade method concurrently on the
+        thread pool. Results are returned in the order of the calls. The
+        first exception raised by a call is re-raised.
+
+        Arguments:
+            method (callable or str): Bound method of client, or its name,
+            e.g. "get_price_history".
+            calls (iterable): Keyword argument dicts, one per call.
+            max_workers (int) optional: Maximum number of calls in flight.
+            Defaults to the client max_concurrency.
+        """
+        import asyncio
+        if isinstance(method, str):
+            method = getattr(self.client, method)
+        semaphore = asyncio.Semaphore(max_workers or self.max_concurrency)
+
+        async def call(kwargs):
+            async with semaphore:
+                return await self._run(method, **kwargs)
+
+        return await asyncio.gather(*[call(kwargs) for kwargs in calls])
 
-    def get_quotes(self, symbols=None):
-        """Get price quotes
+    def close(self):
+        """Shut down the thread pool and close the pooled connections.
         """
-        symbol_url = "%2C".join(symbols)
-        url = "marketdata/quotes?symbol={}".format(symbol_url)
-        self._send_request(url)
-        return self.message
+        self._executor.shutdown(wait=True)
+        self.client.transport.close()
 
 
 def test():
@@ -384,7 +1396,7 @@ def test():
     # app.get_quotes(["SPYV", "SPYG"])
     # app.place_order(symbol="SPYV", price=20.16, quantity=2,
     #                 instruction="Buy")
-    print(app.message)
+    print(app.get_watchlists())
 
 
 if __name__ == "__main__":
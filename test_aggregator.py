@@ -0,0 +1,49 @@
+"""
+Tests of the incremental bar aggregator.
+
+Run with
+
+    python -m pytest test_aggregator.py
+
+"""
+import unittest
+
+from aggregator import CLOSE, HIGH, LOW, OPEN, VOLUME, BarAggregator
+
+
+MINUTE = 60000
+START = 1531411200000
+
+
+class BarAggregatorTest(unittest.TestCase):
+    """Folding quotes into one minute bars.
+    """
+    def setUp(self):
+        self.bars = BarAggregator(["SPYG", "SPYV"], frequencies=(60,),
+                                  capacity=10)
+
+    def test_quotes_build_bars(self):
+        self.bars.update("SPYG", 30., 1000, START)
+        self.bars.update("SPYG", 31., 1100, START + 10000)
+        self.bars.update("SPYG", 29., 1150, START + 20000)
+        self.bars.update("SPYG", 30.5, 1200, START + MINUTE)
+        index, data = self.bars.get_bars("SPYG", 60, as_frame=False)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(list(data[0, [OPEN, HIGH, LOW, CLOSE, VOLUME]]),
+                         [30., 31., 29., 29., 150.])
+        self.assertEqual(data[1, VOLUME], 50.)
+
+    def test_late_quote_volume_is_counted(self):
+        self.bars.update("SPYG", 30., 1000, START)
+        self.bars.update("SPYG", 30.5, 1100, START + MINUTE)
+        self.bars.update("SPYG", 99., 1160, START + 30000)
+        self.bars.update("SPYG", 30.6, 1200, START + MINUTE + 10000)
+        _, data = self.bars.get_bars("SPYG", 60, as_frame=False)
+        self.assertEqual(data[0, VOLUME], 0.)
+        self.assertEqual(data[1, VOLUME], 200.)
+        self.assertEqual(data[1, HIGH], 30.6)
+        self.assertEqual(data[1, CLOSE], 30.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
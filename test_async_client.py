@@ -0,0 +1,90 @@
+"""
+Tests of the asyncio client against a stand-in transport.
+
+Run with
+
+    python -m pytest test_async_client.py
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from urllib.parse import parse_qsl, urlsplit
+
+from tdameritrade import AsyncTDAmeritrade, setup_logging
+from transport import Response
+
+
+class OrdersTransport:
+    """Stand-in transport answering every orders request with one order per
+    day of the requested range, the order id being the day ordinal.
+    """
+    def request(self, method, url, headers=None, body=None, stream=False):
+        query = dict(parse_qsl(urlsplit(url).query))
+        first = date.fromisoformat(query["fromEnteredTime"]).toordinal()
+        last = date.fromisoformat(query["toEnteredTime"]).toordinal()
+        orders = [{"orderId": ordinal, "status": "FILLED",
+                   "enteredTime": "{}T14:30:00+0000".format(
+                       date.fromordinal(ordinal))}
+                  for ordinal in range(first, last + 1)]
+        return Response(200, "OK", dict(), json.dumps(orders).encode("utf-8"),
+                        url)
+
+    def close(self):
+        pass
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+    """AsyncTDAmeritrade.iter_orders and bulk.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        setup_logging(os.path.join(self.directory, "tdameritrade.log"))
+        filenames = list()
+        for name, value in (("account_no.txt", "123456789"),
+                            ("oAuth_hash.txt", "token")):
+            filename = os.path.join(self.directory, name)
+            with open(filename, mode='w') as file_obj:
+                file_obj.write(value + "\n")
+            filenames.append(filename)
+        self.client = AsyncTDAmeritrade(*filenames,
+                                        transport=OrdersTransport())
+        self.start, self.end = date(2018, 1, 1), date(2018, 3, 1)
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    async def test_iter_orders(self):
+        ids = [order["orderId"] async for order
+               in self.client.iter_orders(self.start, self.end)]
+        self.assertEqual(sorted(ids), list(range(self.start.toordinal(),
+                                                 self.end.toordinal() + 1)))
+
+    async def test_iter_orders_as_models(self):
+        orders = [order async for order in self.client.iter_orders(
+            self.start, self.end, as_models=True)]
+        self.assertEqual(len(orders), (self.end - self.start).days + 1)
+        self.assertEqual({order.status for order in orders}, {"FILLED"})
+
+    async def test_iteration_stopped_early(self):
+        iterator = self.client.iter_orders(self.start, self.end)
+        async for _ in iterator:
+            break
+        await iterator.aclose()
+        self.assertEqual(len(await self.client.get_orders(
+            from_date="2018-01-01", to_date="2018-01-05")), 5)
+
+    async def test_bulk_keeps_call_order(self):
+        calls = [{"from_date": "2018-01-01", "to_date": "2018-01-{:02d}"
+                  .format(day)} for day in range(1, 11)]
+        results = await self.client.bulk("get_orders", calls)
+        self.assertEqual([len(orders) for orders in results],
+                         list(range(1, 11)))
+
+
+if __name__ == "__main__":
+    unittest.main()
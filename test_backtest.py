@@ -0,0 +1,43 @@
+"""
+Tests of the backtest order simulation.
+
+Run with
+
+    python -m pytest test_backtest.py
+
+"""
+import unittest
+
+import numpy as np
+
+from backtest import simulate
+
+
+class SimulateTest(unittest.TestCase):
+    """simulate over hand-built bars of one symbol.
+    """
+    def setUp(self):
+        # open, high, low, close, volume
+        self.bars = np.array([[[10., 10., 10., 10., 100.]],
+                              [[10., 11., 9., 11., 100.]],
+                              [[np.nan] * 5],
+                              [[12., 12., 12., 12., 100.]]])
+        self.prices = np.array([[10.], [np.nan], [np.nan], [np.nan]])
+        self.quantities = np.array([[5.], [0.], [0.], [0.]])
+
+    def test_limit_buy_fills(self):
+        result = simulate(self.bars, self.prices, self.quantities,
+                          initial_cash=1000.)
+        self.assertEqual(result["fills"], 1)
+        self.assertEqual(result["equity"][1], 1000. + 5 * (11. - 10.))
+        self.assertEqual(result["final_equity"], 1000. + 5 * (12. - 10.))
+
+    def test_missing_close_keeps_last_mark(self):
+        result = simulate(self.bars, self.prices, self.quantities,
+                          initial_cash=1000.)
+        self.assertEqual(result["equity"][2], result["equity"][1])
+        self.assertEqual(result["max_drawdown"], 0.)
+
+
+if __name__ == "__main__":
+    unittest.main()
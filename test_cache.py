@@ -0,0 +1,131 @@
+"""
+Tests of the on-disk price history cache against a stand-in transport.
+
+Run with
+
+    python -m pytest test_cache.py
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from cache import PERIOD_DAYS, PriceHistoryCache
+from tdameritrade import TDAmeritrade, setup_logging
+from transport import Response
+
+
+DAY = 86400000
+START = 1514764800000
+
+
+def day(number):
+    """Get the epoch milliseconds of a day of the synthetic history.
+    """
+    return START + number * DAY
+
+
+class PriceHistoryTransport:
+    """Stand-in transport answering pricehistory requests with one daily
+    candle per day, from startDate (or endDate minus the period) to
+    endDate.
+
+    Class variables
+        queries (list): Query parameters (dict) of the requests received.
+    """
+    def __init__(self):
+        self.queries = list()
+
+    def request(self, method, url, headers=None, body=None, stream=False):
+        query = dict(parse_qsl(urlsplit(url).query))
+        self.queries.append(query)
+        end = int(query["endDate"])
+        if "startDate" in query:
+            first = int(query["startDate"])
+        else:
+            first = end - int(query["period"]) * PERIOD_DAYS["month"] * DAY
+        candles = [{"datetime": stamp, "open": 1., "high": 2., "low": 0.5,
+                    "close": 1.5, "volume": 100}
+                   for stamp in range(START, end + 1, DAY) if stamp >= first]
+        data = json.dumps({"candles": candles, "empty": not candles})
+        return Response(200, "OK", dict(), data.encode("utf-8"), url)
+
+    def close(self):
+        pass
+
+
+class PriceHistoryCacheTest(unittest.TestCase):
+    """get_price_history through a PriceHistoryCache.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        setup_logging(os.path.join(self.directory, "tdameritrade.log"))
+        filenames = list()
+        for name, value in (("account_no.txt", "123456789"),
+                            ("oAuth_hash.txt", "token")):
+            filename = os.path.join(self.directory, name)
+            with open(filename, mode='w') as file_obj:
+                file_obj.write(value + "\n")
+            filenames.append(filename)
+        self.transport = PriceHistoryTransport()
+        self.cache = PriceHistoryCache(os.path.join(self.directory, "cache"))
+        self.client = TDAmeritrade(*filenames, transport=self.transport,
+                                   price_cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def history(self, end, period=3):
+        """Get the datetimes (epoch milliseconds) of a cached history.
+        """
+        data = self.client.get_price_history("SPYG", period=period,
+                                             end_date=day(end),
+                                             as_frame=False)
+        return data["datetime"].astype(np.int64)
+
+    def cached_last(self):
+        """Get the epoch milliseconds of the last cached candle.
+        """
+        return int(self.cache.load("SPYG", "daily", 1)["datetime"][-1]
+                   .astype(np.int64))
+
+    def test_tail_is_fetched(self):
+        self.history(150)
+        dates = self.history(200)
+        self.assertEqual(dates[-1], day(200))
+        self.assertEqual(int(self.transport.queries[-1]["startDate"]),
+                         day(150))
+        self.assertEqual(self.cached_last(), day(200))
+
+    def test_end_date_before_cached_end(self):
+        self.history(150)
+        dates = self.history(145)
+        self.assertEqual(dates[-1], day(145))
+        self.assertEqual(len(self.transport.queries), 1)
+        self.assertEqual(self.cached_last(), day(150))
+
+    def test_full_refetch_keeps_newer_candles(self):
+        self.history(150)
+        dates = self.history(145, period=6)
+        self.assertEqual(dates[-1], day(145))
+        self.assertNotIn("startDate", self.transport.queries[-1])
+        cached = self.cache.load("SPYG", "daily", 1)["datetime"]
+        self.assertEqual(self.cached_last(), day(150))
+        self.assertTrue((np.diff(cached.astype(np.int64)) == DAY).all())
+
+    def test_extended_hours_are_cached_apart(self):
+        self.history(150)
+        self.client.get_price_history("SPYG", end_date=day(150),
+                                      extended_hours="false", as_frame=False)
+        self.assertEqual(len(self.transport.queries), 2)
+        self.assertTrue(os.path.exists(self.cache.path(
+            "SPYG", "daily", 1, "false")))
+
+
+if __name__ == "__main__":
+    unittest.main()
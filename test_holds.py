@@ -0,0 +1,91 @@
+"""
+Tests of the hold index sync against a stand-in client.
+
+Run with
+
+    python -m pytest test_holds.py
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+from holds import HoldIndex
+from models import Order
+
+
+def order_json(order_id, symbol, entered, status, filled=0., closed=None):
+    """Build a decoded get_orders order of one leg.
+    """
+    order = {"orderId": order_id, "status": status, "quantity": 2.,
+             "filledQuantity": filled,
+             "enteredTime": "{}T14:30:00+0000".format(entered),
+             "orderLegCollection": [{"instruction": "BUY", "quantity": 2.,
+                                     "instrument": {"symbol": symbol}}]}
+    if closed is not None:
+        order["closeTime"] = "{}T15:00:00+0000".format(closed)
+    return order
+
+
+class OrdersClient:
+    """Stand-in client answering iter_orders with the orders entered in the
+    range.
+
+    Class variables
+        orders (list): Decoded orders of the account.
+        ranges (list): (from_date, to_date) of the calls.
+    """
+    def __init__(self, orders):
+        self.orders = orders
+        self.ranges = list()
+
+    def iter_orders(self, from_date, to_date=None, order_status=None,
+                    as_models=False):
+        self.ranges.append((from_date, to_date))
+        for order in self.orders:
+            if from_date.isoformat() <= order["enteredTime"][:10]:
+                yield Order.from_json(order) if as_models else order
+
+
+class HoldIndexSyncTest(unittest.TestCase):
+    """HoldIndex.sync of orders filled after they were entered.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        self.filename = os.path.join(self.directory, "holds.json")
+        self.today = date.today()
+        self.entered = self.today - timedelta(10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_old_working_order_filled_later(self):
+        client = OrdersClient([order_json(1, "SPYG", self.entered,
+                                          "WORKING")])
+        holds = HoldIndex(self.filename)
+        holds.sync(client)
+        self.assertEqual(holds.open_since, self.entered)
+        self.assertTrue(holds.can_trade("SPYG"))
+        client.orders = [order_json(1, "SPYG", self.entered, "FILLED",
+                                    filled=2., closed=self.today)]
+        holds = HoldIndex(self.filename)
+        holds.sync(client)
+        self.assertEqual(client.ranges[-1][0], self.entered)
+        self.assertEqual(holds.last_fill("SPYG"), self.today)
+        self.assertFalse(holds.can_trade("SPYG"))
+        self.assertIsNone(holds.open_since)
+
+    def test_window_starts_at_last_sync(self):
+        client = OrdersClient([order_json(1, "SPYG", self.entered, "FILLED",
+                                          filled=2., closed=self.entered)])
+        holds = HoldIndex(self.filename)
+        holds.sync(client)
+        self.assertEqual(holds.last_fill("SPYG", "BUY"), self.entered)
+        holds.sync(client)
+        self.assertEqual(client.ranges[-1][0], self.today - timedelta(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
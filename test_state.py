@@ -0,0 +1,104 @@
+"""
+Tests of the account state kept in sync through a client over a stand-in
+transport.
+
+Run with
+
+    python -m pytest test_state.py
+
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from urllib.parse import parse_qsl, urlsplit
+
+from state import AccountState
+from tdameritrade import TDAmeritrade, setup_logging
+from transport import Response
+
+
+ORDER_ID = "98765"
+
+
+class AccountTransport:
+    """Stand-in transport accepting orders with a Location header and
+    answering the orders and account requests.
+
+    Class variables
+        orders (list): Decoded orders returned by get_orders.
+        order_queries (list): Query parameters (dict) of the order requests.
+    """
+    def __init__(self):
+        self.orders = list()
+        self.order_queries = list()
+
+    def request(self, method, url, headers=None, body=None, stream=False):
+        parts = urlsplit(url)
+        if method == "POST":
+            headers = {"Location": "{}/{}".format(url, ORDER_ID)}
+            return Response(201, "Created", headers, b"", url)
+        if parts.path.endswith("/orders"):
+            self.order_queries.append(dict(parse_qsl(parts.query)))
+            data = self.orders
+        else:
+            data = {"securitiesAccount": {
+                "currentBalances": {"cashBalance": 1000.}}}
+        return Response(200, "OK", dict(), json.dumps(data).encode("utf-8"),
+                        url)
+
+    def close(self):
+        pass
+
+
+class AccountStateTest(unittest.TestCase):
+    """AccountState fed by TDAmeritrade.place_order and sync.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        setup_logging(os.path.join(self.directory, "tdameritrade.log"))
+        filenames = list()
+        for name, value in (("account_no.txt", "123456789"),
+                            ("oAuth_hash.txt", "token")):
+            filename = os.path.join(self.directory, name)
+            with open(filename, mode='w') as file_obj:
+                file_obj.write(value + "\n")
+            filenames.append(filename)
+        self.transport = AccountTransport()
+        self.state = AccountState()
+        self.state.synced = date.today()
+        self.client = TDAmeritrade(*filenames, transport=self.transport,
+                                   account_state=self.state)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_place_order_records_the_order_id(self):
+        self.client.place_order(symbol="SPYV", price=30.16, quantity=2,
+                                instruction="BUY")
+        orders = self.state.working_orders("SPYV")
+        self.assertEqual([order.order_id for order in orders], [ORDER_ID])
+        self.assertEqual(self.state.open_quantity("SPYV", "BUY"), 2)
+
+    def test_sync_applies_the_fill(self):
+        self.client.place_order(symbol="SPYV", price=30.16, quantity=2,
+                                instruction="BUY")
+        self.transport.orders = [{
+            "orderId": int(ORDER_ID), "status": "FILLED", "price": 30.16,
+            "quantity": 2., "filledQuantity": 2.,
+            "enteredTime": "{}T14:30:00+0000".format(date.today()),
+            "orderLegCollection": [{"instruction": "BUY", "quantity": 2.,
+                                    "instrument": {"symbol": "SPYV"}}]}]
+        self.state.sync(self.client)
+        query = self.transport.order_queries[-1]
+        self.assertEqual(query["fromEnteredTime"], date.today().isoformat())
+        self.assertNotIn("status", query)
+        self.assertEqual(self.state.working_orders(), list())
+        self.assertEqual(self.state.quantity("SPYV"), 2.)
+        self.assertEqual(self.state.balances, {"cashBalance": 1000.})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests of the streaming client against a local WebSocket stand-in replaying
+recorded streamer frames.
+
+Run with
+
+    python -m pytest test_streaming.py
+
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from replay import StreamerReplayServer, load_frames, save_frames
+from streaming import CHART_FIELDS, QUOTE_FIELDS, TDStreamer, WebSocket
+
+
+def quote_message(symbols, timestamp=1531411200000):
+    """Build a QUOTE data message for the symbols.
+    """
+    content = [{"key": symbol, "1": 30.1, "2": 30.2, "3": 30.15,
+                "8": 1000 + i, "99": "ignored"}
+               for i, symbol in enumerate(symbols)]
+    return json.dumps({"data": [{"service": "QUOTE", "timestamp": timestamp,
+                                 "command": "SUBS", "content": content}]})
+
+
+FRAMES = [
+    json.dumps({"response": [{"service": "ADMIN", "command": "LOGIN",
+                              "content": {"code": 0, "msg": "ok"}}]}),
+    quote_message(["SPYG", "SPYV"]),
+    json.dumps({"notify": [{"heartbeat": "1531411201000"}]}),
+    json.dumps({"data": [{"service": "CHART_EQUITY",
+                          "timestamp": 1531411260000, "command": "SUBS",
+                          "content": [{"key": "SPYG", "1": 35.0, "2": 35.2,
+                                       "3": 34.9, "4": 35.1, "5": 1200.,
+                                       "7": 1531411200000}]}]}),
+    # 126 length form (< 64 KiB) and 127 length form (>= 64 KiB).
+    quote_message(["SYM{}".format(i) for i in range(20)]),
+    quote_message(["SYM{}".format(i) for i in range(1000)]),
+]
+UPDATES = 2 + 1 + 20 + 1000
+
+
+class ParseTest(unittest.TestCase):
+    """Decoding of the streamer messages.
+    """
+    def test_fields_are_named(self):
+        updates = TDStreamer.parse(FRAMES[1])
+        self.assertEqual(updates[0], ("QUOTE", {
+            "symbol": "SPYG", "timestamp": 1531411200000, "bid": 30.1,
+            "ask": 30.2, "last": 30.15, "volume": 1000}))
+        service, update = TDStreamer.parse(FRAMES[3])[0]
+        self.assertEqual(service, "CHART_EQUITY")
+        self.assertEqual(set(update) - {"symbol", "timestamp"},
+                         {CHART_FIELDS[field] for field in
+                          ("1", "2", "3", "4", "5", "7")})
+
+    def test_responses_and_heartbeats_are_skipped(self):
+        self.assertEqual(TDStreamer.parse(FRAMES[0]), list())
+        self.assertEqual(TDStreamer.parse(FRAMES[2]), list())
+
+    def test_mask_is_symmetric(self):
+        payload = bytes(range(256)) * 3
+        masked = WebSocket._mask(payload, b"\x01\x02\x03\x04")
+        self.assertNotEqual(masked, payload)
+        self.assertEqual(WebSocket._mask(masked, b"\x01\x02\x03\x04"),
+                         payload)
+        self.assertEqual(WebSocket._mask(b"", b"\x01\x02\x03\x04"), b"")
+
+
+class StreamerTest(unittest.IsolatedAsyncioTestCase):
+    """TDStreamer against a StreamerReplayServer.
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        self.filename = os.path.join(self.directory, "frames.jsonl")
+        save_frames(self.filename, FRAMES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    async def _replay(self, fragment_size=None, symbols=("SPYG", "SPYV")):
+        """Subscribe to the quotes and run the streamer until the server
+        closes. Returns the server, the callback updates and the queue.
+        """
+        server = StreamerReplayServer(load_frames(self.filename),
+                                      fragment_size=fragment_size)
+        called = list()
+        async with server:
+            streamer = TDStreamer(server.url, account="123456789",
+                                  source="APP", queue=asyncio.Queue())
+            streamer.add_callback("QUOTE", called.append)
+            await streamer.connect()
+            await streamer.subscribe_quotes(list(symbols))
+            await asyncio.wait_for(streamer.run(), timeout=10)
+            await streamer.close()
+            await asyncio.sleep(0.05)
+        return server, called, streamer.queue
+
+    def test_frame_file_round_trip(self):
+        self.assertEqual(load_frames(self.filename),
+                         [json.dumps(json.loads(frame)) for frame in FRAMES])
+
+    async def test_updates_are_dispatched(self):
+        server, called, queue = await self._replay()
+        self.assertEqual(queue.qsize(), UPDATES)
+        updates = [queue.get_nowait() for _ in range(UPDATES)]
+        self.assertEqual([service for service, _ in updates].count(
+            "CHART_EQUITY"), 1)
+        quotes = [update for service, update in updates
+                  if service == "QUOTE"]
+        self.assertEqual(called, quotes)
+        self.assertEqual(quotes[-1]["symbol"], "SYM999")
+        self.assertEqual(server.pongs, [b"replay"])
+        self.assertEqual(server.close_code, 1000)
+
+    async def test_fragmented_messages_are_joined(self):
+        _, called, _ = await self._replay(fragment_size=100)
+        self.assertEqual(len(called), UPDATES - 1)
+        self.assertEqual(called[:2], [update for _, update in
+                                      TDStreamer.parse(FRAMES[1])])
+
+    async def test_client_frames_are_masked(self):
+        symbols = ["SYM{}".format(i) for i in range(12000)]
+        server, _, _ = await self._replay(symbols=symbols)
+        self.assertEqual(server.unmasked, 0)
+        subscription = server.received[0]["requests"][0]
+        self.assertEqual(subscription["command"], "SUBS")
+        self.assertEqual(subscription["parameters"]["keys"],
+                         ",".join(symbols))
+        self.assertEqual(subscription["parameters"]["fields"],
+                         ",".join(["0"] + list(QUOTE_FIELDS)))
+
+
+if __name__ == "__main__":
+    unittest.main()
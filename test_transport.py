@@ -0,0 +1,175 @@
+"""
+Tests of the keep-alive HTTP transport against a local stand-in server.
+
+Run with
+
+    python -m pytest test_transport.py
+
+"""
+import gzip
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tdameritrade import TDAmeritrade, setup_logging
+from transport import HTTPTransport
+
+
+PAYLOAD = json.dumps([{"name": "watchlist", "symbol": "SPYG"}] * 50).encode()
+
+
+class StandInServer:
+    """Local HTTP/1.1 server answering every GET with PAYLOAD, gzipped if
+    accepted.
+
+    Class variables
+        posts (list): Bodies of the POST requests received.
+        drop_after_response (bool): Close the connection after answering,
+        without telling the client.
+        drop_next_post (bool): Read the next POST and close the connection
+        without answering.
+    """
+    def __init__(self):
+        self.posts = list()
+        self.drop_after_response = False
+        self.drop_next_post = False
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/v1/".format(host, port)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def _answer(self, status, body):
+                encoding = self.headers.get("Accept-Encoding", "")
+                if body and "gzip" in encoding:
+                    body = gzip.compress(body)
+                self.send_response(status)
+                if "gzip" in encoding:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if server.drop_after_response:
+                    self.close_connection = True
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                self._answer(200, PAYLOAD)
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                length = int(self.headers.get("Content-Length") or 0)
+                server.posts.append(self.rfile.read(length))
+                if server.drop_next_post:
+                    server.drop_next_post = False
+                    self.close_connection = True
+                    return
+                self._answer(201, b"")
+
+        return Handler
+
+
+class TransportTest(unittest.TestCase):
+    """Connection reuse, gzip decoding, idle eviction and stale connection
+    retries of HTTPTransport.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp(prefix="tdameritrade-test-")
+        setup_logging(os.path.join(cls.directory, "tdameritrade.log"))
+        cls.filenames = list()
+        for name, value in (("account_no.txt", "123456789"),
+                            ("oAuth_hash.txt", "token")):
+            filename = os.path.join(cls.directory, name)
+            with open(filename, mode='w') as file_obj:
+                file_obj.write(value + "\n")
+            cls.filenames.append(filename)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        self.server = StandInServer()
+        self.url = self.server.base_url + "accounts/123456789/watchlists"
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_client_reuses_one_connection(self):
+        client = TDAmeritrade(*self.filenames, base_url=self.server.base_url)
+        for _ in range(10):
+            self.assertEqual(client.get_watchlists(), json.loads(PAYLOAD))
+        self.assertEqual(client.transport.requests_sent, 10)
+        self.assertEqual(client.transport.connections_created, 1)
+        client.transport.close()
+
+    def test_gzip_is_decoded(self):
+        transport = HTTPTransport()
+        response = transport.request("GET", self.url)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.body, PAYLOAD)
+        self.assertLess(response.bytes_received, len(PAYLOAD))
+        streamed = transport.request("GET", self.url, stream=True)
+        self.assertEqual(b"".join(streamed.iter_content(chunk_size=64)),
+                         PAYLOAD)
+        self.assertEqual(transport.connections_created, 1)
+        transport.close()
+
+    def test_idle_connection_is_evicted(self):
+        transport = HTTPTransport(idle_timeout=0.05)
+        transport.request("GET", self.url)
+        transport.request("GET", self.url)
+        self.assertEqual(transport.connections_created, 1)
+        time.sleep(0.1)
+        transport.request("GET", self.url)
+        self.assertEqual(transport.connections_created, 2)
+        transport.close()
+
+    def test_stale_get_is_retried(self):
+        transport = HTTPTransport()
+        self.server.drop_after_response = True
+        transport.request("GET", self.url)
+        response = transport.request("GET", self.url)
+        self.assertEqual(response.body, PAYLOAD)
+        self.assertEqual(transport.connections_created, 2)
+        transport.close()
+
+    def test_stale_post_is_not_resent(self):
+        transport = HTTPTransport()
+        transport.request("GET", self.url)
+        self.server.drop_next_post = True
+        with self.assertRaises((http.client.RemoteDisconnected,
+                                ConnectionResetError, BrokenPipeError)):
+            transport.request("POST", self.url, body=b'{"order": 2}')
+        self.assertEqual(self.server.posts, [b'{"order": 2}'])
+        transport.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,294 @@
+"""
+Module providing the HTTP transport used by the TDAmeritrade client.
+
+The transport keeps a pool of persistent (keep-alive) connections per host so
+that consecutive requests reuse the same TCP + TLS session instead of paying
+for a new handshake on every call.
+
+Classes:
+    Response
+    HTTPTransport
+
+"""
+import gzip
+import http.client
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit
+
+
+# Errors raised when a pooled connection was closed by the server while it
+# sat idle.  Requests of an IDEMPOTENT_METHODS method are retried once on a
+# fresh connection; others are not, as the server may have processed them
+# (e.g. an order POST) before dropping the connection.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                           http.client.CannotSendRequest,
+                           ConnectionResetError,
+                           BrokenPipeError)
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class Response:
+    """Response returned by a transport.
+
+    Class variables
+        status (int): HTTP status code.
+        reason (str): HTTP reason phrase.
+        headers (http.client.HTTPMessage): Response headers.
+        body (bytes): Response body (already decompressed).
+        url (str): Requested url.
+        timings (dict): Seconds spent per phase: connect (new connections
+        only, DNS + TCP + TLS), ttfb (time to first byte) and download.
+        bytes_sent (int): Size of the request body.
+        bytes_received (int): Size of the response body on the wire.
+        raw (http.client.HTTPResponse): Unread body of a streamed response
+        (body is None until read through iter_content).
+    """
+    __slots__ = ("status", "reason", "headers", "body", "url", "timings",
+                 "bytes_sent", "bytes_received", "raw", "_release")
+
+    def __init__(self, status, reason, headers, body, url, timings=None,
+                 bytes_sent=0, bytes_received=0, raw=None, release=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.url = url
+        self.timings = dict() if timings is None else timings
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.raw = raw
+        self._release = release
+
+    def iter_content(self, chunk_size=65536):
+        """Iterate over the (decompressed) body in chunks. For a streamed
+        response the body is read from the socket as it is consumed and the
+        connection is returned to the pool once the body is read.
+
+        Arguments:
+            chunk_size (int): Number of bytes read from the socket at a time.
+        """
+        if self.raw is None:
+            if self.body:
+                yield self.body
+            return
+        encoding = self.headers.get("Content-Encoding")
+        decompressor = None
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            decompressor = zlib.decompressobj()
+        start = time.perf_counter()
+        complete = False
+        try:
+            while True:
+                chunk = self.raw.read(chunk_size)
+                if not chunk:
+                    break
+                self.bytes_received += len(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if decompressor is not None:
+                chunk = decompressor.flush()
+                if chunk:
+                    yield chunk
+            complete = True
+        finally:
+            self.timings["download"] = time.perf_counter() - start
+            self.close(complete)
+
+    def close(self, complete=False):
+        """Release the connection of a streamed response. An incompletely
+        read connection is closed instead of being reused.
+        """
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(complete)
+
+    def __repr__(self):
+        return "<Response [{} {}] {}>".format(self.status, self.reason,
+                                               self.url)
+
+
+class HTTPTransport:
+    """Keep-alive HTTP/1.1 transport with a per host connection pool.
+
+    Class variables
+        pool_size (int): Maximum number of idle connections kept per host.
+        idle_timeout (float): Seconds an idle connection is kept before it is
+        discarded.
+        timeout (float): Socket timeout in seconds.
+        accept_gzip (bool): Advertise and decode gzip/deflate encoded bodies.
+        connections_created (int): Number of connections opened so far.
+        requests_sent (int): Number of requests sent so far.
+
+    Example:
+    >>transport = HTTPTransport(pool_size=8)
+    >>td = TDAmeritrade("account_no.txt", "oAuth.txt", transport=transport)
+    """
+    def __init__(self, pool_size=4, idle_timeout=60., timeout=30.,
+                 accept_gzip=True):
+        """Create an empty pool. Connections are opened lazily.
+
+        Arguments:
+            pool_size (int): Maximum number of idle connections kept per host.
+            idle_timeout (float): Seconds before an idle connection is closed.
+            timeout (float): Socket timeout in seconds.
+            accept_gzip (bool): Request compressed responses.
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.accept_gzip = accept_gzip
+        self.connections_created = 0
+        self.requests_sent = 0
+        self._pools = dict()
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme, host, port):
+        """Open a new connection to the host.
+        """
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port,
+                                               timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port,
+                                              timeout=self.timeout)
+        with self._lock:
+            self.connections_created += 1
+        return conn
+
+    @staticmethod
+    def _connect(conn, timings):
+        """Open the socket of a new connection (DNS, TCP and TLS) and time
+        it.
+        """
+        start = time.perf_counter()
+        conn.connect()
+        timings["connect"] = time.perf_counter() - start
+
+    def _get_connection(self, key):
+        """Take an idle connection from the pool, or open a new one. Returns
+        the connection and whether it was reused.
+        """
+        now = time.monotonic()
+        with self._lock:
+            pool = self._pools.setdefault(key, list())
+            while pool:
+                conn, last_used = pool.pop()
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._new_connection(*key), False
+
+    def _release_connection(self, key, conn):
+        """Return a connection to the pool, or close it if the pool is full.
+        """
+        with self._lock:
+            pool = self._pools.setdefault(key, list())
+            if len(pool) < self.pool_size:
+                pool.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    @staticmethod
+    def _decode_body(body, encoding):
+        """Decompress the body according to the Content-Encoding header.
+        """
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        if encoding == "deflate":
+            return zlib.decompress(body)
+        return body
+
+    def request(self, method, url, headers=None, body=None, stream=False):
+        """Send the request over a pooled connection and read the full
+        response.
+
+        Arguments:
+            method (str): HTTP method (GET | POST | PUT | DELETE).
+            url (str): Absolute url.
+            headers (dict): Request headers.
+            body (bytes): Request body.
+            stream (bool): Do not read the body of a successful response.
+            It is read through Response.iter_content, which releases the
+            connection when done.
+
+        Returns:
+            Response
+        """
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = "{}?{}".format(path, parts.query)
+        headers = dict() if headers is None else dict(headers)
+        headers.setdefault("Connection", "keep-alive")
+        if self.accept_gzip:
+            headers.setdefault("Accept-Encoding", "gzip, deflate")
+
+        timings = dict()
+        conn, reused = self._get_connection(key)
+        try:
+            if not reused:
+                self._connect(conn, timings)
+            start = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused or method.upper() not in IDEMPOTENT_METHODS:
+                raise
+            conn = self._new_connection(*key)
+            self._connect(conn, timings)
+            start = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+        timings["ttfb"] = time.perf_counter() - start
+        with self._lock:
+            self.requests_sent += 1
+        bytes_sent = len(body) if body else 0
+        if stream and response.status < 300:
+            def release(complete):
+                if complete and not response.will_close:
+                    self._release_connection(key, conn)
+                else:
+                    conn.close()
+            return Response(response.status, response.reason, response.msg,
+                            None, url, timings=timings, bytes_sent=bytes_sent,
+                            raw=response, release=release)
+
+        start = time.perf_counter()
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        timings["download"] = time.perf_counter() - start
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release_connection(key, conn)
+
+        received = len(data)
+        data = self._decode_body(data, response.getheader("Content-Encoding"))
+        return Response(response.status, response.reason, response.msg, data,
+                        url, timings=timings, bytes_sent=bytes_sent,
+                        bytes_received=received)
+
+    def close(self):
+        """Close every pooled connection.
+        """
+        with self._lock:
+            pools, self._pools = self._pools, dict()
+        for pool in pools.values():
+            for conn, _ in pool:
+                conn.close()